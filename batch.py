@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Batch runner
+Description: Patches many game installations from a single invocation
+
+Targets come from command line paths, glob patterns and manifest files.
+Each one runs on a bounded thread pool, but targets are queued per
+device and a worker is only handed a target whose device has a free
+slot. Two 330 MB sequential streams on one spinning disk turn into
+seeks, so by default each device serves one target at a time while
+different devices work in parallel, and a long queue on one disk never
+keeps workers from the others.
+Every target produces a result dict, and the whole run is summarised as
+JSON for build scripts.
+
+Targets share the process, so only work that leaves the interpreter
+overlaps: file I/O, hashing, xdelta3.exe and the process-pool decoder.
+The in-process built-in decoder is pure Python and holds the global
+interpreter lock, so its targets take turns however many workers run.
+"""
+
+import glob
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+SUMMARY_VERSION = 1
+
+# Result statuses that count as a failed run
+FAILED_STATUSES = ("failed", "not_found", "error", "interrupted")
+
+
+def read_manifest(path: str) -> List[str]:
+    """Read target paths from a manifest, one per line
+
+    Blank lines and lines starting with # are ignored; relative paths are
+    taken relative to the manifest's directory.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    targets = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            targets.append(os.path.normpath(os.path.join(base, os.path.expanduser(line))))
+    return targets
+
+
+def expand_targets(paths: Iterable[str], manifests: Iterable[str] = ()) -> List[str]:
+    """Expand paths, glob patterns and manifests into unique targets
+
+    Patterns are expanded here because the Windows shell passes them
+    through unexpanded. A pattern that matches nothing is kept as-is so it
+    shows up as not found in the summary instead of vanishing.
+    """
+    candidates = []
+    for manifest in manifests:
+        candidates.extend(read_manifest(manifest))
+    candidates.extend(paths)
+
+    targets = []
+    seen = set()
+    for candidate in candidates:
+        matches = sorted(glob.glob(candidate, recursive=True)) if glob.has_magic(candidate) else []
+        for target in matches or [candidate]:
+            key = os.path.normcase(os.path.abspath(target))
+            if key not in seen:
+                seen.add(key)
+                targets.append(target)
+    return targets
+
+
+def device_of(path: str) -> int:
+    """Device id of path, or of its nearest existing parent"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return -1
+            path = parent
+
+
+class BatchRunner:
+    """Runs one function per target with global and per-device limits"""
+
+    def __init__(self, process: Callable[[str], dict], max_workers: int = 4,
+                 per_device: int = 1, on_result: Optional[Callable[[dict], None]] = None):
+        self.process = process
+        self.max_workers = max(1, max_workers)
+        self.per_device = max(1, per_device)
+        self.on_result = on_result
+
+    def _run_one(self, target: str, queued: float) -> dict:
+        started = time.monotonic()
+        try:
+            result = self.process(target)
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        finished = time.monotonic()
+        result.setdefault("target", target)
+        result["waited"] = round(started - queued, 3)
+        result["elapsed"] = round(finished - started, 3)
+        return result
+
+    def run(self, targets: List[str]) -> List[dict]:
+        """Process every target; results are returned in target order
+
+        Targets are queued per device and dispatched round-robin across
+        the devices that have a free slot, so no worker ever sits blocked
+        waiting for a busy disk while another disk has work.
+        """
+        results: List[Optional[dict]] = [None] * len(targets)
+        queues: Dict[int, Deque[int]] = {}
+        for i, target in enumerate(targets):
+            queues.setdefault(device_of(target), deque()).append(i)
+        busy = dict.fromkeys(queues, 0)
+        queued = time.monotonic()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch") as executor:
+            def dispatch():
+                progress = True
+                while progress and len(running) < self.max_workers:
+                    progress = False
+                    for device, queue in queues.items():
+                        if len(running) >= self.max_workers:
+                            break
+                        if queue and busy[device] < self.per_device:
+                            i = queue.popleft()
+                            busy[device] += 1
+                            running[executor.submit(self._run_one, targets[i], queued)] = (i, device)
+                            progress = True
+
+            dispatch()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, device = running.pop(future)
+                    busy[device] -= 1
+                    result = future.result()
+                    results[i] = result
+                    if self.on_result:
+                        self.on_result(result)
+                dispatch()
+        return results
+
+
+def summarize(results: List[dict]) -> dict:
+    """Machine readable summary of a batch run"""
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {
+        "version": SUMMARY_VERSION,
+        "ok": not any(result["status"] in FAILED_STATUSES for result in results),
+        "counts": counts,
+        "results": results,
+    }
+
+
+def write_summary(summary: dict, path: str) -> None:
+    """Write the summary as JSON to path, or to stdout for "-" """
+    text = json.dumps(summary, indent=2)
+    if path == "-":
+        print(text)
+        return
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
+    os.replace(temp_path, path)
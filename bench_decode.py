@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Decoder microbenchmark for ESM Patcher
+Times the VCDIFF window executors against each other
+
+Compares the instruction interpreter (vcdiff.execute_window), a decode
+plan run one op at a time, and the batched NumPy executor when NumPy is
+installed. Only window execution is timed: sections are unpacked and
+plans compiled beforehand. Every executor's output is checked against
+the interpreter's.
+
+By default a synthetic delta with an ESM-like op mix (many short ADDs
+and target copies, long source copies) is generated; pass a real source
+and patch to time those instead.
+
+Usage:
+  python bench_decode.py
+  python bench_decode.py --source Fallout4.esm --patch assets/fallout4_323025.xdelta
+"""
+
+import argparse
+import mmap
+import random
+import sys
+import time
+import zlib
+
+import decode_plan
+import vcdiff
+
+
+def synthetic_delta(source: bytes, windows: int, window_size: int, seed: int) -> bytes:
+    """A delta of mostly small ops copying from source and from itself"""
+    rng = random.Random(seed)
+    parts = [vcdiff.encode_header()]
+    for _ in range(windows):
+        encoder = vcdiff.WindowEncoder(0, len(source))
+        while encoder.target_length < window_size:
+            room = window_size - encoder.target_length
+            kind = rng.random()
+            written = encoder.target_length
+            if kind < 0.35:
+                n = min(room, int(rng.expovariate(1 / 150)) + 4)
+                encoder.copy(rng.randrange(len(source) - n), n)
+            elif kind < 0.70:
+                encoder.add(rng.randbytes(min(room, rng.randint(1, 12))))
+            elif kind < 0.99 and written > 64:
+                n = min(room, rng.randint(4, 40))
+                if rng.random() < 0.2:
+                    # Overlapping: repeats a short period
+                    start = written - rng.randint(1, 8)
+                else:
+                    start = rng.randrange(written - min(n, written))
+                encoder.copy(len(source) + start, n)
+            else:
+                encoder.run(rng.randrange(256), min(room, rng.randint(1, 300)))
+        parts.append(encoder.encode())
+    return b"".join(parts)
+
+
+def time_executor(run, windows, source, repeat: int):
+    """Best wall time over repeat passes and the Adler32 of each window"""
+    best = None
+    checksums = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        outputs = [run(window, source) for window in windows]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        checksums = [zlib.adler32(out) for out in outputs]
+    return best, checksums
+
+
+def benchmark(source, delta: bytes, repeat: int) -> bool:
+    """Time every available executor on delta; False if any output differs"""
+    header, windows = vcdiff.index_windows(delta)
+    sections = vcdiff.SectionDecoder(header)
+    unpacked = [sections.sections(delta, window) for window in windows]
+    plan = decode_plan.compile_plan(delta)
+    total = sum(window.target_length for window in windows)
+
+    def interpret(window, source):
+        return vcdiff.execute_window(window, unpacked[window.index], source)
+
+    def run_plan(batched):
+        def run(window, source):
+            plan.batched = batched
+            return plan.execute_window(plan.windows[window.index], source)
+        return run
+
+    executors = [("instructions", interpret), ("plan, scalar", run_plan(False))]
+    if decode_plan.np is not None:
+        executors.append(("plan, batched", run_plan(True)))
+    else:
+        print("NumPy is not installed; skipping the batched executor")
+
+    print(f"{len(windows)} windows, {total / (1024 * 1024):.1f} MB of target, {len(plan):,} plan ops")
+    baseline = None
+    reference = None
+    ok = True
+    for name, run in executors:
+        elapsed, checksums = time_executor(run, windows, source, repeat)
+        if reference is None:
+            baseline, reference = elapsed, checksums
+        same = checksums == reference
+        ok = ok and same
+        print(f"  {name:<14} {elapsed:7.3f}s  {total / (1024 * 1024) / elapsed:8.1f} MB/s  "
+              f"x{baseline / elapsed:5.2f}{'' if same else '  OUTPUT DIFFERS'}")
+    return ok
+
+
+def main():
+    """Run the benchmark described by the command line"""
+    parser = argparse.ArgumentParser(description="Compare the VCDIFF window executors")
+    parser.add_argument("--source", help="source file of a real patch")
+    parser.add_argument("--patch", help="real patch to decode against --source")
+    parser.add_argument("--windows", type=int, default=8, help="synthetic windows (default 8)")
+    parser.add_argument("--window-size", type=int, default=1 << 20,
+                        help="synthetic window size in bytes (default 1 MiB)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="passes per executor; the best is reported")
+    args = parser.parse_args()
+    if bool(args.source) != bool(args.patch):
+        parser.error("--source and --patch go together")
+
+    if args.patch:
+        with open(args.patch, "rb") as f:
+            delta = f.read()
+        with open(args.source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            ok = benchmark(source, delta, args.repeat)
+    else:
+        source = random.Random(args.seed).randbytes(16 << 20)
+        delta = synthetic_delta(source, args.windows, args.window_size, args.seed)
+        ok = benchmark(source, delta, args.repeat)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,15 +2,26 @@
 """
 Build script for ESM VR Patcher
 Creates a distributable package for Nexus Mods
+
+Usage:
+  python build.py                   Full build
+  python build.py <step>            One build step, e.g. prepare_assets
+  python build.py encode OLD NEW -o assets/new.xdelta
+                                    Author a patch from OLD to NEW
 """
 
 import os
 import sys
+import time
 import shutil
 import zipfile
+import argparse
 import subprocess
 from pathlib import Path
 
+import compose_delta
+import delta_encoder
+
 # Configuration
 PROJECT_NAME = "ESM_Patcher"
 VERSION = "1.0.0"
@@ -46,6 +57,7 @@ def prepare_assets():
         "xdelta3.exe": "Download from: https://github.com/jmacd/xdelta-gpl/releases",
         "fallout4_323025.xdelta": "Extract from Fallout: London VR installer",
         "fallout4_322806.xdelta": "Extract from Fallout: London VR installer",
+        "patches.json": "Patch manifest, part of the source tree",
         "icon.ico": "Optional: Add custom icon"
     }
     
@@ -257,6 +269,70 @@ A standalone tool to patch Next-Gen Fallout4.esm files for mod compatibility. Es
     
     print("\n✓ Created Nexus description file")
 
+def encode_patch(argv):
+    """Author a new patch with the multi-core VCDIFF encoder"""
+    parser = argparse.ArgumentParser(
+        prog="build.py encode",
+        description="Encode a VCDIFF patch that turns SOURCE into TARGET",
+    )
+    parser.add_argument("source", help="the ESM the patch will be applied to")
+    parser.add_argument("target", help="the ESM the patch should produce")
+    parser.add_argument("-o", "--output", required=True, help="patch to write")
+    parser.add_argument("--block-size", type=int, default=delta_encoder.DEFAULT_BLOCK_SIZE,
+                        help=f"source block size in bytes (default {delta_encoder.DEFAULT_BLOCK_SIZE})")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU core)")
+    parser.add_argument("--verify", action="store_true", help="decode the patch and compare it with TARGET")
+    parser.add_argument("--manifest", help="patch manifest to add the patch to")
+    parser.add_argument("--from", dest="source_variant", metavar="VARIANT", help="manifest variant of SOURCE")
+    parser.add_argument("--to", dest="target_variant", metavar="VARIANT", help="manifest variant of TARGET")
+    args = parser.parse_args(argv)
+    if args.manifest and not (args.source_variant and args.target_variant):
+        parser.error("--manifest needs --from and --to")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    
+    mb = 1024 * 1024
+    
+    def progress(done, total):
+        print(f"\r  Encoding... {done * 100 // total}%", end="", flush=True)
+    
+    print(f"Encoding {args.source} -> {args.target}...")
+    try:
+        report = delta_encoder.encode_delta(args.source, args.target, args.output,
+                                            block_size=args.block_size, workers=args.workers,
+                                            progress_callback=progress)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"\n✗ Encoding failed: {e}")
+        return 1
+    print()
+    
+    print(f"  Source {report.source_size / mb:.1f} MB, target {report.target_size / mb:.1f} MB, "
+          f"{report.windows} windows, block size {report.block_size}, {report.workers} worker(s)")
+    print(f"  Index built in {report.index_seconds:.1f}s, windows encoded in {report.encode_seconds:.1f}s")
+    print(f"  {report.matched / max(report.target_size, 1):.1%} of the target copied from the source")
+    print(f"✓ Wrote {args.output}: {report.delta_size:,} bytes "
+          f"({report.ratio:.2%} of the target, {report.throughput / mb:.1f} MB/s overall)")
+    
+    print("  Per core:")
+    for number, (pid, (windows, size, seconds)) in enumerate(sorted(report.per_core.items()), 1):
+        rate = size / seconds / mb if seconds else 0.0
+        print(f"    core {number} (pid {pid}): {windows} windows, {size / mb:.1f} MB "
+              f"in {seconds:.2f}s CPU, {rate:.1f} MB/s")
+    
+    if args.verify:
+        print("Verifying...")
+        started = time.perf_counter()
+        ok, message = delta_encoder.verify(args.source, args.target, args.output)
+        print(f"{'✓' if ok else '✗'} {message} ({time.perf_counter() - started:.1f}s)")
+        if not ok:
+            return 1
+    
+    if args.manifest:
+        compose_delta.update_manifest(args.manifest, args.output, args.source_variant, args.target_variant)
+        print(f"✓ Added {args.source_variant} -> {args.target_variant} to {args.manifest}")
+    
+    return 0
+
 def main():
     """Main build process"""
     print(f"Building {PROJECT_NAME} v{VERSION}")
@@ -303,5 +379,34 @@ def main():
     
     return 0
 
+# Build steps that can be run on their own
+STEPS = {
+    "create_directories": create_directories,
+    "check_requirements": check_requirements,
+    "prepare_assets": prepare_assets,
+    "build_executable": build_executable,
+    "create_package": create_package,
+    "create_nexus_description": create_nexus_description,
+}
+
+# Commands with their own arguments
+COMMANDS = {
+    "encode": encode_patch,
+}
+
+def dispatch(argv):
+    """Run the full build, one step, or a command named by argv"""
+    if not argv:
+        return main()
+    
+    name, rest = argv[0], argv[1:]
+    if name in COMMANDS:
+        return COMMANDS[name](rest)
+    if name in STEPS and not rest:
+        return 1 if STEPS[name]() is False else 0
+    
+    print(f"Usage: python build.py [{' | '.join(list(STEPS) + list(COMMANDS))}]")
+    return 2
+
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(dispatch(sys.argv[1:]))
\ No newline at end of file
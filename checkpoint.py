@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Patch checkpoints
+Description: Resumable decoding with a journal next to the partial output
+
+A journaled decode writes the target window by window and, after each
+window has been flushed and fsynced, records in a small sidecar file how
+many windows and bytes of the output are final, together with the
+running CRC32 of those bytes. If the run dies (crash, power loss, a
+killed process), the next one validates the journal against the source
+and patches it is given, checks the partial output against the recorded
+CRC32 and carries on from the first unfinished window. An interruption
+costs the window in flight, not the whole decode.
+
+hashlib objects cannot be saved, so the running state of the full
+digests (MD5/SHA-256) is rebuilt on resume by reading back the finished
+prefix once - a sequential read instead of a decode, and the same pass
+that proves the prefix survived intact.
+
+A PatchLock marks an ESM as being patched, so that recovery started from
+another job or process leaves the journals of a live patch alone. Its
+lock file lives in the user cache directory, named after the ESM's
+absolute path, so nothing is left behind in the game's Data folder.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+import fingerprint
+import vcdiff
+
+try:
+    import msvcrt  # Windows
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+JOURNAL_VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+
+# Read size when re-hashing the finished prefix on resume
+PREFIX_READ_SIZE = 4 * 1024 * 1024
+
+
+def journal_path(output_path: str) -> str:
+    return output_path + JOURNAL_SUFFIX
+
+
+def has_journal(output_path: str) -> bool:
+    """Whether output_path is a partial output a later run can resume"""
+    return os.path.exists(output_path) and os.path.exists(journal_path(output_path))
+
+
+def discard(output_path: str) -> None:
+    """Remove a partial output and its journal"""
+    for path in (output_path, journal_path(output_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def default_lock_dir() -> str:
+    """Where PatchLock files are kept"""
+    return os.path.join(fingerprint.default_cache_dir(), "locks")
+
+
+def lock_path(esm_path: str, lock_dir: Optional[str] = None) -> str:
+    """Lock file of esm_path: one per absolute path, outside the game folder"""
+    key = os.path.normcase(os.path.abspath(esm_path))
+    name = hashlib.sha256(key.encode("utf-8", "surrogatepass")).hexdigest()[:32] + ".lock"
+    return os.path.join(lock_dir or default_lock_dir(), name)
+
+
+class PatchLock:
+    """Exclusive, non-blocking lock held while an ESM is patched or restored
+
+    The lock is an OS file lock on lock_path(esm_path), taken through its
+    own file handle, so it excludes other processes as well as other jobs
+    of this one. The OS drops it when the holder exits, so a crash never
+    leaves an ESM locked; the empty lock file stays in the cache directory
+    to be reused by the next patch of the same ESM.
+    """
+
+    def __init__(self, esm_path: str, lock_dir: Optional[str] = None):
+        self.esm_path = esm_path
+        self.path = lock_path(esm_path, lock_dir)
+        self._file = None
+
+    def acquire(self) -> bool:
+        """Take the lock; False if someone else holds it"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, "a+b")
+        try:
+            if msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self) -> None:
+        if self._file is None:
+            return
+        try:
+            if msvcrt is not None:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def source_identity(source_path: str) -> dict:
+    """Cheap identity of a source file that survives renames and hard links"""
+    return {
+        "size": os.path.getsize(source_path),
+        "sampled": fingerprint.sampled_fingerprint(source_path),
+    }
+
+
+def patch_digests(patch_paths: List[str]) -> List[str]:
+    digests = []
+    for path in patch_paths:
+        with open(path, "rb") as f:
+            digests.append(hashlib.sha256(f.read()).hexdigest())
+    return digests
+
+
+def read_journal(output_path: str) -> Optional[dict]:
+    try:
+        with open(journal_path(output_path), "r", encoding="utf-8") as f:
+            journal = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(journal, dict) or journal.get("version") != JOURNAL_VERSION:
+        return None
+    return journal
+
+
+def write_journal(output_path: str, journal: dict) -> None:
+    """Replace the journal atomically and make it durable"""
+    path = journal_path(output_path)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _prefix_crc32(output, length: int, digest_sink=None) -> int:
+    """CRC32 of the first length bytes of an open output, feeding digest_sink"""
+    crc = 0
+    output.seek(0)
+    remaining = length
+    while remaining:
+        data = output.read(min(PREFIX_READ_SIZE, remaining))
+        if not data:
+            break
+        crc = zlib.crc32(data, crc)
+        if digest_sink is not None:
+            digest_sink.update(data)
+        remaining -= len(data)
+    return crc if remaining == 0 else -1
+
+
+def decode_resumable(
+    source_path: str,
+    patch_paths: List[str],
+    deltas: list,
+    output_path: str,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    digest_sink=None,
+) -> Tuple[int, int]:
+    """Decode a patch (or chain) into output_path, resuming a previous run if possible
+
+    deltas are the loaded patches or decode plans of patch_paths, in
+    order; patch_paths identify them in the journal. See vcdiff.decode()
+    for progress_callback and digest_sink, which also cover the resumed
+    prefix. Returns (bytes written in total, bytes resumed from). The
+    journal is left in place; discard() or remove it once the output has
+    been committed.
+    """
+    identity = {"source": source_identity(source_path), "patches": patch_digests(patch_paths)}
+    windows = deltas[-1].windows if hasattr(deltas[-1], "windows") else vcdiff.index_windows(deltas[-1])[1]
+    total = sum(w.target_length for w in windows)
+
+    start = 0
+    done = 0
+    crc = 0
+    journal = read_journal(output_path)
+    if journal and os.path.exists(output_path) and all(journal.get(k) == v for k, v in identity.items()):
+        start = journal.get("windows", 0)
+        done = journal.get("bytes", 0)
+        expected = windows[start].target_offset if start < len(windows) else total
+        if done != expected or os.path.getsize(output_path) < done:
+            start = done = 0
+        else:
+            with open(output_path, "rb") as f:
+                crc = _prefix_crc32(f, done)
+            if crc != journal.get("crc32"):
+                start = done = crc = 0
+    resumed = done
+
+    mode = "r+b" if resumed else "wb"
+    with open(output_path, mode) as out, open(source_path, "rb") as src:
+        if resumed and digest_sink is not None:
+            _prefix_crc32(out, resumed, digest_sink)
+        out.truncate(resumed)
+        out.seek(resumed)
+        if not resumed:
+            write_journal(output_path, dict(identity, version=JOURNAL_VERSION, windows=0, bytes=0, crc32=0))
+        elif progress_callback:
+            progress_callback(done, total)
+
+        def run(source):
+            nonlocal done, crc
+            chained = vcdiff.chain_source(source, deltas[:-1])
+            for window, data in vcdiff.iter_decode(chained, deltas[-1], start):
+                out.write(data)
+                if digest_sink is not None:
+                    digest_sink.update(data)
+                crc = zlib.crc32(data, crc)
+                done += len(data)
+
+                # The journal may only ever point at durable output
+                out.flush()
+                os.fsync(out.fileno())
+                write_journal(output_path, dict(identity, version=JOURNAL_VERSION,
+                                                windows=window.index + 1, bytes=done, crc32=crc))
+                if progress_callback:
+                    progress_callback(done, total)
+
+        # mmap refuses empty files; an empty source is still a valid input
+        if os.fstat(src.fileno()).st_size == 0:
+            run(b"")
+        else:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                run(source)
+
+    return done, resumed
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Delta composer for ESM Patcher
+Merges a chain of VCDIFF patches (A->B, B->C, ...) into a single A->C delta
+
+Every byte of each intermediate target is mapped back to where it came
+from: a range of the original source A, literal ADD data or a RUN. COPY
+instructions of the next delta are then rewritten through that map, so
+the composed delta copies straight from A and end users pay one decode
+pass however long the version history gets. The composed delta keeps the
+window layout and Adler32 checksums of the last delta in the chain.
+
+Usage:
+  python compose_delta.py A_to_B.xdelta B_to_C.xdelta -o assets/A_to_C.xdelta
+  python compose_delta.py ... -o assets/A_to_C.xdelta --verify A.esm \\
+      --manifest assets/patches.json --from nextgen-v2 --to compatible
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from bisect import bisect_right
+from typing import Iterator, List, Optional, Tuple
+
+import vcdiff
+
+# Kinds of TargetMap pieces
+COPY_SOURCE = 0  # value: offset in the original source
+LITERAL = 1      # value: the bytes themselves
+RUN = 2          # value: the repeated byte
+
+
+class TargetMap:
+    """Where every byte of a target comes from, as sorted contiguous pieces"""
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.lengths: List[int] = []
+        self.kinds: List[int] = []
+        self.values: list = []
+        self.length = 0
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def append(self, kind: int, length: int, value) -> None:
+        """Add the next piece of the target, merging it into the last when contiguous"""
+        if not length:
+            return
+        if self.kinds:
+            last = len(self.kinds) - 1
+            last_kind = self.kinds[last]
+            if kind == last_kind and (
+                (kind == COPY_SOURCE and self.values[last] + self.lengths[last] == value)
+                or (kind == RUN and self.values[last] == value)
+            ):
+                self.lengths[last] += length
+                self.length += length
+                return
+            if kind == LITERAL and last_kind == LITERAL:
+                self.values[last] += value
+                self.lengths[last] += length
+                self.length += length
+                return
+
+        self.starts.append(self.length)
+        self.lengths.append(length)
+        self.kinds.append(kind)
+        self.values.append(bytearray(value) if kind == LITERAL else value)
+        self.length += length
+
+    def slice(self, start: int, length: int) -> Iterator[Tuple[int, int, object]]:
+        """Yield (kind, length, value) pieces covering target[start:start + length]"""
+        if start + length > self.length:
+            raise vcdiff.VCDIFFError(f"Range {start:,}+{length:,} is past the end of the "
+                                     f"intermediate target ({self.length:,} bytes)")
+        i = bisect_right(self.starts, start) - 1
+        while length > 0:
+            offset = start - self.starts[i]
+            n = min(self.lengths[i] - offset, length)
+            kind = self.kinds[i]
+            value = self.values[i]
+            if kind == COPY_SOURCE:
+                yield kind, n, value + offset
+            elif kind == LITERAL:
+                yield kind, n, bytes(value[offset:offset + n])
+            else:
+                yield kind, n, value
+            start += n
+            length -= n
+            i += 1
+
+
+def map_delta(delta: bytes, base: Optional[TargetMap] = None) -> Tuple[TargetMap, List[vcdiff.VCDIFFWindow]]:
+    """Map a delta's target onto the original source
+
+    With base None the delta's source is the original source; otherwise
+    base maps the delta's source (the previous target) onto it. Returns the
+    target map and the delta's windows.
+    """
+    header, windows = vcdiff.index_windows(delta)
+    sections = vcdiff.SectionDecoder(header)
+    target = TargetMap()
+
+    for window in windows:
+        if window.indicator & vcdiff.VCD_TARGET:
+            raise vcdiff.VCDIFFError(f"Window {window.index} copies from the target (VCD_TARGET is not supported)")
+        seg_len = window.source_length
+        window_start = target.length
+
+        for itype, size, value in vcdiff.iter_instructions(window, sections.sections(delta, window)):
+            if itype == vcdiff.VCD_ADD:
+                target.append(LITERAL, size, value)
+                continue
+            if itype == vcdiff.VCD_RUN:
+                target.append(RUN, size, value)
+                continue
+
+            address = value
+            if address < seg_len:
+                n = min(size, seg_len - address)
+                position = window.source_position + address
+                if base is None:
+                    target.append(COPY_SOURCE, n, position)
+                else:
+                    for piece in base.slice(position, n):
+                        target.append(*piece)
+                size -= n
+                address = seg_len
+
+            # Copies from earlier in the window resolve through the map built
+            # so far; an overlapping copy repeats with its period
+            start = window_start + address - seg_len
+            while size > 0:
+                n = min(size, target.length - start)
+                for piece in list(target.slice(start, n)):
+                    target.append(*piece)
+                start += n
+                size -= n
+
+    return target, windows
+
+
+def encode_map(target: TargetMap, windows: List[vcdiff.VCDIFFWindow], app_header: bytes = b"") -> bytes:
+    """Write a target map as a delta against the original source
+
+    One output window per window of the last delta, each with a source
+    segment spanning the source ranges it copies.
+    """
+    parts = [vcdiff.encode_header(app_header)]
+    for window in windows:
+        pieces = list(target.slice(window.target_offset, window.target_length))
+        copies = [(value, n) for kind, n, value in pieces if kind == COPY_SOURCE]
+        if copies:
+            low = min(value for value, _ in copies)
+            high = max(value + n for value, n in copies)
+            encoder = vcdiff.WindowEncoder(low, high - low)
+        else:
+            low = 0
+            encoder = vcdiff.WindowEncoder()
+
+        for kind, n, value in pieces:
+            if kind == COPY_SOURCE:
+                encoder.copy(value - low, n)
+            elif kind == LITERAL:
+                encoder.add(value)
+            else:
+                encoder.run(value, n)
+        parts.append(encoder.encode(window.checksum))
+    return b"".join(parts)
+
+
+def composed_app_header(first: vcdiff.VCDIFFHeader, last: vcdiff.VCDIFFHeader) -> bytes:
+    """xdelta3 "target//source/" header naming the last target and the first source"""
+    first_parts = first.app_header.split(b"/")
+    last_parts = last.app_header.split(b"/")
+    if len(first_parts) == 4 and len(last_parts) == 4:
+        return b"/".join(last_parts[:2] + first_parts[2:])
+    return last.app_header
+
+
+def compose(deltas: List[bytes]) -> bytes:
+    """Compose deltas applied in order into one delta against the first source"""
+    if not deltas:
+        raise ValueError("Nothing to compose")
+    target = None
+    for delta in deltas:
+        target, windows = map_delta(delta, target)
+    app_header = composed_app_header(vcdiff.parse_header(deltas[0]), vcdiff.parse_header(deltas[-1]))
+    return encode_map(target, windows, app_header)
+
+
+class _Digest:
+    """Write sink that only hashes"""
+
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return len(data)
+
+
+def verify(source_path: str, patch_paths: List[str], composed_path: str) -> Tuple[bool, str]:
+    """Check that the composed delta produces what the chain produces"""
+    chained = _Digest()
+    vcdiff.decode_into(source_path, patch_paths, chained)
+    composed = _Digest()
+    vcdiff.decode_into(source_path, composed_path, composed)
+    if chained.sha256.digest() != composed.sha256.digest():
+        return False, "composed delta output differs from the chain"
+    return True, f"outputs match (sha256 {composed.sha256.hexdigest()})"
+
+
+def update_manifest(manifest_path: str, patch_path: str, source: str, target: str,
+                    section: str = "edges", input_size: Optional[int] = None,
+                    force: bool = False) -> None:
+    """Add or replace the manifest edge source -> target with the composed patch
+
+    section is the manifest list to update ("reverse" for reverse deltas).
+    input_size is the total size of the deltas the patch was composed
+    from. A composed patch larger than that is refused unless force is
+    set: its sections carry no secondary compression, and users would
+    download more than the chain it replaces.
+    """
+    patch_size = os.path.getsize(patch_path)
+    if input_size is not None and patch_size > input_size and not force:
+        raise ValueError(f"{os.path.basename(patch_path)} is {patch_size:,} bytes, larger than "
+                         f"the {input_size:,} bytes of deltas it was composed from")
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for end in (source, target):
+        if end not in data.get("variants", {}):
+            raise ValueError(f"{manifest_path} has no variant {end!r}")
+
+    with open(patch_path, "rb") as f:
+        patch_sha256 = hashlib.sha256(f.read()).hexdigest()
+    relative = os.path.relpath(os.path.abspath(patch_path), os.path.dirname(os.path.abspath(manifest_path)))
+    edge = {
+        "from": source,
+        "to": target,
+        "patch": relative.replace(os.sep, "/"),
+        "patch_size": patch_size,
+        "patch_sha256": patch_sha256,
+    }
+
+    edges = [e for e in data.get(section, []) if not (e.get("from") == source and e.get("to") == target)]
+    edges.append(edge)
+    data[section] = edges
+
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(temp_path, manifest_path)
+
+
+def main():
+    """Compose the deltas given on the command line"""
+    parser = argparse.ArgumentParser(
+        description="Merge chained VCDIFF patches into a single delta",
+    )
+    parser.add_argument("deltas", nargs="+", help="deltas in the order they are applied")
+    parser.add_argument("-o", "--output", required=True, help="composed delta to write")
+    parser.add_argument("--verify", metavar="SOURCE",
+                        help="original source file; check the composed delta against the chain")
+    parser.add_argument("--manifest", help="patch manifest to add the composed edge to")
+    parser.add_argument("--from", dest="source", metavar="VARIANT", help="manifest variant of the source")
+    parser.add_argument("--to", dest="target", metavar="VARIANT", help="manifest variant of the target")
+    parser.add_argument("--force", action="store_true",
+                        help="add the composed delta to the manifest even if it is larger than its inputs")
+    args = parser.parse_args()
+    if args.manifest and not (args.source and args.target):
+        parser.error("--manifest needs --from and --to")
+
+    deltas = []
+    for path in args.deltas:
+        with open(path, "rb") as f:
+            deltas.append(f.read())
+
+    print(f"Composing {len(deltas)} delta(s)...")
+    started = time.perf_counter()
+    try:
+        composed = compose(deltas)
+    except vcdiff.VCDIFFError as e:
+        print(f"✗ {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+
+    temp_path = args.output + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(composed)
+    os.replace(temp_path, args.output)
+
+    inputs = sum(len(delta) for delta in deltas)
+    print(f"✓ Wrote {args.output}: {len(composed):,} bytes "
+          f"(inputs {inputs:,} bytes, {elapsed:.1f}s)")
+    if any(vcdiff.parse_header(delta).indicator & vcdiff.VCD_DECOMPRESS for delta in deltas):
+        print("  Note: sections are written uncompressed; the inputs used secondary compression")
+
+    if args.verify:
+        print("Verifying against the chain...")
+        try:
+            ok, message = verify(args.verify, args.deltas, args.output)
+        except vcdiff.VCDIFFError as e:
+            ok, message = False, str(e)
+        print(f"{'✓' if ok else '✗'} {message}")
+        if not ok:
+            return 1
+
+    if args.manifest:
+        try:
+            update_manifest(args.manifest, args.output, args.source, args.target,
+                            input_size=inputs, force=args.force)
+        except ValueError as e:
+            print(f"✗ Not added to {args.manifest}: {e} (use --force to add it anyway)")
+            return 1
+        print(f"✓ Added {args.source} -> {args.target} to {args.manifest}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
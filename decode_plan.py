@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Decode plans
+Description: Pre-compiled op tables for the bundled VCDIFF patches
+
+Decoding a delta spends most of its Python time on the instruction stream:
+code-table lookups, varint parsing and address-cache modes, redone on
+every run for patches that never change. A decode plan does that work
+once. Each window is flattened into flat array-backed op tables (op type,
+source offset, destination offset, length) plus one packed payload of all
+ADD data, and applying the plan is a loop of bulk slice copies. Plans are
+cached on disk keyed by the patch's SHA-256, so an edited or replaced
+patch simply compiles a new one.
+
+A plan can be passed anywhere vcdiff accepts delta bytes: iter_decode(),
+decode(), chain_source() and decode_into().
+
+With NumPy installed, windows run through a batched executor: the source
+copies, ADDs and RUNs of a window write disjoint ranges and read nothing
+the window produces, so each kind is done in one pass of fancy indexing,
+and only the copies from the window's own output run one by one.
+bench_decode.py compares the executors.
+"""
+
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from typing import List, Optional
+
+import fingerprint
+import vcdiff
+
+try:
+    import numpy as np  # Optional: enables the batched executor
+except ImportError:
+    np = None
+
+# Op types
+OP_ADD = 0     # payload[src:src + length]
+OP_RUN = 1     # src is the repeated byte
+OP_SOURCE = 2  # source segment[src:src + length]
+OP_TARGET = 3  # window output[src:src + length], may overlap the destination
+
+PLAN_MAGIC = b"ESMPLAN\x00"
+PLAN_FORMAT = 1
+
+# magic, format, offset width (4 or 8), window count, op count, payload size
+_HEADER = struct.Struct("<8sHH3Q")
+# indicator, has checksum, checksum, source position, source length,
+# target offset, target length, first op, end op
+_WINDOW = struct.Struct("<BBI6Q")
+
+_RUN_BYTES = [bytes([value]) for value in range(256)]
+
+# The batched executor gathers ops shorter than this with fancy indexing;
+# longer ones are cheaper as one slice assignment each
+BATCH_MIN_LENGTH = 64
+
+
+class PlanError(Exception):
+    """Raised for a plan file that is truncated, foreign or from another format"""
+
+
+class DecodePlan:
+    """A delta compiled into op tables, ready to be executed against a source"""
+
+    # Use the batched executor when NumPy is available
+    batched = True
+
+    def __init__(self, windows: List[vcdiff.VCDIFFWindow], ops: array, srcs: array,
+                 dsts: array, lengths: array, payload: bytes, op_ranges: List[tuple]):
+        self.windows = windows
+        self.ops = ops
+        self.srcs = srcs
+        self.dsts = dsts
+        self.lengths = lengths
+        self.payload = payload
+        self.op_ranges = op_ranges  # (first op, end op) of each window
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    @property
+    def target_length(self) -> int:
+        return sum(w.target_length for w in self.windows)
+
+    def execute_window(self, window: vcdiff.VCDIFFWindow, source, out=None):
+        """Produce one window's target bytes; same contract as vcdiff.execute_window()"""
+        target_len = window.target_length
+        if out is None:
+            out = bytearray(target_len)
+        elif len(out) != target_len:
+            raise ValueError(f"Output buffer holds {len(out)} bytes, window {window.index} needs {target_len}")
+
+        segment = vcdiff.source_segment(window, source)
+        try:
+            if self.batched and np is not None:
+                try:
+                    self._execute_batched(window, segment, out)
+                except (IndexError, ValueError):
+                    raise vcdiff.VCDIFFError(f"Plan for window {window.index} reads or writes out of range")
+            else:
+                self._execute_scalar(window, segment, out)
+        finally:
+            # Drop the export so the caller can close the source mmap. After
+            # an error, NumPy arrays in the traceback's frames may still
+            # export the segment; it is freed along with the traceback.
+            try:
+                segment.release()
+            except BufferError:
+                pass
+        if len(out) != target_len:
+            raise vcdiff.VCDIFFError(f"Plan for window {window.index} produced {len(out)} bytes, "
+                                     f"expected {target_len}")
+        return out
+
+    def _execute_scalar(self, window: vcdiff.VCDIFFWindow, segment, out) -> None:
+        """Run a window's ops one slice assignment at a time"""
+        first, end = self.op_ranges[window.index]
+        payload = memoryview(self.payload)
+        run_bytes = _RUN_BYTES
+        for op, src, dst, n in zip(self.ops[first:end], self.srcs[first:end],
+                                   self.dsts[first:end], self.lengths[first:end]):
+            if op == OP_SOURCE:
+                out[dst:dst + n] = segment[src:src + n]
+            elif op == OP_ADD:
+                out[dst:dst + n] = payload[src:src + n]
+            elif op == OP_RUN:
+                out[dst:dst + n] = run_bytes[src] * n
+            elif src + n <= dst:
+                out[dst:dst + n] = out[src:src + n]
+            else:
+                _copy_overlapping(out, src, dst, n)
+
+    def _execute_batched(self, window: vcdiff.VCDIFFWindow, segment, out) -> None:
+        """Run a window's ops a whole kind at a time with NumPy
+
+        Every op writes its own range of the window and ops are ordered by
+        destination, so a copy from the window's output only reads bytes
+        that earlier ops wrote. Source copies, ADDs and RUNs read nothing
+        from the output, which lets them all go first in any order; the
+        output copies then follow in their original order.
+        """
+        first, end = self.op_ranges[window.index]
+        if first == end:
+            return
+        ops = np.frombuffer(self.ops, np.uint8, end - first, first)
+        srcs, dsts, lengths = (
+            np.frombuffer(column, np.dtype(column.typecode), end - first,
+                          first * column.itemsize).astype(np.int64)
+            for column in (self.srcs, self.dsts, self.lengths)
+        )
+        out_array = np.frombuffer(out, np.uint8)
+
+        for op, data in ((OP_SOURCE, segment), (OP_ADD, self.payload)):
+            mask = ops == op
+            if mask.any():
+                _gather(out_array, np.frombuffer(data, np.uint8), srcs[mask], dsts[mask], lengths[mask])
+
+        mask = ops == OP_RUN
+        if mask.any():
+            values, starts, counts = srcs[mask], dsts[mask], lengths[mask]
+            bulk = counts >= BATCH_MIN_LENGTH
+            for value, dst, n in zip(values[bulk].tolist(), starts[bulk].tolist(), counts[bulk].tolist()):
+                out_array[dst:dst + n] = value
+            small = ~bulk
+            if small.any():
+                counts = counts[small]
+                out_array[np.repeat(starts[small], counts) + _offsets(counts)] = \
+                    np.repeat(values[small].astype(np.uint8), counts)
+
+        mask = ops == OP_TARGET
+        for src, dst, n in zip(srcs[mask].tolist(), dsts[mask].tolist(), lengths[mask].tolist()):
+            if src + n <= dst:
+                out[dst:dst + n] = out[src:src + n]
+            else:
+                _copy_overlapping(out, src, dst, n)
+
+    def save(self, path: str) -> None:
+        """Write the plan to path atomically"""
+        wide = max(max(self.srcs, default=0), max(self.dsts, default=0),
+                   max(self.lengths, default=0)) > 0xFFFFFFFF
+        typecode = "Q" if wide else "I"
+        parts = [_HEADER.pack(PLAN_MAGIC, PLAN_FORMAT, 8 if wide else 4,
+                              len(self.windows), len(self.ops), len(self.payload))]
+        for window, (first, end) in zip(self.windows, self.op_ranges):
+            parts.append(_WINDOW.pack(
+                window.indicator, window.checksum is not None, window.checksum or 0,
+                window.source_position, window.source_length,
+                window.target_offset, window.target_length, first, end,
+            ))
+        parts.append(self.ops.tobytes())
+        for column in (self.srcs, self.dsts, self.lengths):
+            column = array(typecode, column)
+            if sys.byteorder == "big":
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append(self.payload)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(b"".join(parts))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DecodePlan":
+        """Read a plan written by save()"""
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            raise PlanError(f"{path} is truncated")
+        magic, version, width, window_count, op_count, payload_size = _HEADER.unpack_from(data)
+        if magic != PLAN_MAGIC or version != PLAN_FORMAT or width not in (4, 8):
+            raise PlanError(f"{path} is not a format {PLAN_FORMAT} decode plan")
+        expected = (_HEADER.size + window_count * _WINDOW.size + op_count
+                    + 3 * op_count * width + payload_size)
+        if len(data) != expected:
+            raise PlanError(f"{path} is {len(data)} bytes, expected {expected}")
+
+        pos = _HEADER.size
+        windows = []
+        op_ranges = []
+        target_offset = 0
+        for index in range(window_count):
+            (indicator, has_checksum, checksum, source_position, source_length,
+             offset, length, first, end) = _WINDOW.unpack_from(data, pos)
+            pos += _WINDOW.size
+            if offset != target_offset or not first <= end <= op_count:
+                raise PlanError(f"{path}: window {index} is inconsistent")
+            target_offset += length
+            windows.append(_plan_window(index, indicator, source_position, source_length,
+                                        offset, length, checksum if has_checksum else None))
+            op_ranges.append((first, end))
+
+        ops = array("B", data[pos:pos + op_count])
+        pos += op_count
+        columns = []
+        for _ in range(3):
+            column = array("I" if width == 4 else "Q")
+            column.frombytes(data[pos:pos + op_count * width])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns.append(column)
+            pos += op_count * width
+        payload = data[pos:pos + payload_size]
+        return cls(windows, ops, *columns, payload, op_ranges)
+
+
+def _copy_overlapping(out, src: int, dst: int, n: int) -> None:
+    """out[dst:dst + n] = out[src:src + n] byte by byte, with src + n > dst
+
+    The result repeats the period dst - src. Each pass copies everything
+    from src written so far, so the chunk doubles every time instead of
+    staying one period long.
+    """
+    pos = dst
+    while n > 0:
+        chunk = min(n, pos - src)
+        out[pos:pos + chunk] = out[src:src + chunk]
+        pos += chunk
+        n -= chunk
+
+
+def _offsets(lengths):
+    """0..lengths[0]-1, 0..lengths[1]-1, ... concatenated"""
+    return np.arange(int(lengths.sum()), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+
+def _gather(out, data, srcs, dsts, lengths) -> None:
+    """out[dst:dst + n] = data[src:src + n] for every op, short ones in one batch"""
+    bulk = lengths >= BATCH_MIN_LENGTH
+    for src, dst, n in zip(srcs[bulk].tolist(), dsts[bulk].tolist(), lengths[bulk].tolist()):
+        out[dst:dst + n] = data[src:src + n]
+    small = ~bulk
+    if small.any():
+        lengths = lengths[small]
+        offsets = _offsets(lengths)
+        out[np.repeat(dsts[small], lengths) + offsets] = data[np.repeat(srcs[small], lengths) + offsets]
+
+
+def _plan_window(index, indicator, source_position, source_length, target_offset,
+                 target_length, checksum) -> vcdiff.VCDIFFWindow:
+    """A VCDIFFWindow that carries layout only; its sections live in the plan"""
+    return vcdiff.VCDIFFWindow(
+        index=index, indicator=indicator,
+        source_length=source_length, source_position=source_position,
+        target_offset=target_offset, target_length=target_length,
+        delta_indicator=0, data_start=0, data_length=0, inst_length=0,
+        addr_length=0, checksum=checksum, end=0,
+    )
+
+
+def compile_plan(delta) -> DecodePlan:
+    """Flatten every window of a delta into op tables
+
+    COPY addresses are split at the source/target boundary, and adjacent
+    ADDs and contiguous source copies are merged, so the tables are often
+    shorter than the instruction stream.
+    """
+    header, delta_windows = vcdiff.index_windows(delta)
+    sections = vcdiff.SectionDecoder(header)
+    ops = array("B")
+    srcs = array("Q")
+    dsts = array("Q")
+    lengths = array("Q")
+    payload = bytearray()
+    windows = []
+    op_ranges = []
+
+    for window in delta_windows:
+        if window.indicator & vcdiff.VCD_TARGET:
+            raise vcdiff.VCDIFFError(f"Window {window.index} copies from the target "
+                                     f"(VCD_TARGET is not supported)")
+        first = len(ops)
+        seg_len = window.source_length
+        tpos = 0
+
+        def emit(op: int, src: int, n: int) -> None:
+            last = len(ops) - 1
+            if last >= first and ops[last] == op and dsts[last] + lengths[last] == tpos and (
+                    (op == OP_SOURCE and srcs[last] + lengths[last] == src)
+                    or (op == OP_ADD and srcs[last] + lengths[last] == src)):
+                lengths[last] += n
+                return
+            ops.append(op)
+            srcs.append(src)
+            dsts.append(tpos)
+            lengths.append(n)
+
+        for itype, size, value in vcdiff.iter_instructions(window, sections.sections(delta, window)):
+            if itype == vcdiff.VCD_ADD:
+                emit(OP_ADD, len(payload), size)
+                payload += value
+            elif itype == vcdiff.VCD_RUN:
+                emit(OP_RUN, value, size)
+            else:
+                address = value
+                if address < seg_len:
+                    n = min(size, seg_len - address)
+                    emit(OP_SOURCE, address, n)
+                    tpos += n
+                    size -= n
+                    address = seg_len
+                if size:
+                    emit(OP_TARGET, address - seg_len, size)
+            tpos += size
+
+        if tpos != window.target_length:
+            raise vcdiff.VCDIFFError(f"Window {window.index} decoded {tpos} bytes, "
+                                     f"expected {window.target_length}")
+        windows.append(_plan_window(window.index, window.indicator, window.source_position,
+                                    window.source_length, window.target_offset,
+                                    window.target_length, window.checksum))
+        op_ranges.append((first, len(ops)))
+
+    return DecodePlan(windows, ops, srcs, dsts, lengths, bytes(payload), op_ranges)
+
+
+def default_plan_dir() -> str:
+    """Where compiled plans are cached"""
+    return os.path.join(fingerprint.default_cache_dir(), "plans")
+
+
+def load_plan(patch_path: str, cache_dir: Optional[str] = None, use_cache: bool = True) -> DecodePlan:
+    """The decode plan of a patch file, compiled once and then read from the cache
+
+    The cache entry is named after the patch's SHA-256. A missing, stale or
+    unreadable entry is recompiled; a cache that cannot be written is
+    skipped.
+    """
+    with open(patch_path, "rb") as f:
+        delta = f.read()
+    if not use_cache:
+        return compile_plan(delta)
+
+    digest = hashlib.sha256(delta).hexdigest()
+    plan_path = os.path.join(cache_dir or default_plan_dir(), f"{digest}.plan")
+    try:
+        return DecodePlan.load(plan_path)
+    except (OSError, PlanError):
+        pass
+
+    plan = compile_plan(delta)
+    try:
+        plan.save(plan_path)
+    except OSError:
+        pass
+    return plan
+
+
+def load_plans(patch_paths: List[str], cache_dir: Optional[str] = None,
+               use_cache: bool = True) -> List[DecodePlan]:
+    """load_plan() of each patch in a chain"""
+    return [load_plan(path, cache_dir, use_cache) for path in patch_paths]
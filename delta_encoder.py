@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Delta encoder
+Description: Builds VCDIFF patches between two ESM versions on all cores
+
+Authoring a patch has two parts. The source (the ESM the patch will be
+applied to) is cut into fixed-size blocks and each block's Adler32 goes
+into a hash table in shared memory; worker processes compute the block
+checksums in parallel. The target is then split into windows and every
+worker searches its windows for source matches on its own: it rolls an
+Adler32 over the target a byte at a time, looks each value up in the
+shared table, confirms candidates byte for byte and extends them in both
+directions. Unmatched bytes become literals. Each window is encoded by
+the worker that searched it and the parent writes them out in order.
+
+The table holds one block per bucket (the first one indexed), as
+xdelta3's does, so output is the same however the work is scheduled.
+Sections are written uncompressed, with a per-window Adler32 as xdelta3
+writes it, so the result goes through the same decode path as the
+bundled patches.
+"""
+
+import hashlib
+import mmap
+import os
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+import vcdiff
+
+try:
+    from multiprocessing import shared_memory  # Python 3.8+; only needed to encode
+except ImportError:
+    shared_memory = None
+
+# Source bytes per indexed block; smaller finds shorter matches but
+# makes the index bigger and the table busier
+DEFAULT_BLOCK_SIZE = 32
+MIN_BLOCK_SIZE = 8
+
+# Target bytes per window, as xdelta3 uses
+WINDOW_SIZE = 8 * 1024 * 1024
+
+# Source blocks checksummed per indexing job
+INDEX_JOB_BLOCKS = 1 << 18
+
+# Kinds of encoder pieces
+COPY = 0     # value: offset in the source
+LITERAL = 1  # value: offset in the target
+
+ADLER_MOD = 65521
+# Multiplier spreading Adler32 values over the table (Fibonacci hashing)
+_MIX = 0x9E3779B1
+
+
+def _bucket(checksum: int, shift: int) -> int:
+    return ((checksum * _MIX) & 0xFFFFFFFF) >> shift
+
+
+def table_bits(blocks: int) -> int:
+    """log2 of the table size for blocks source blocks: at least two buckets per block"""
+    return min(32, max(10, (2 * blocks - 1).bit_length()))
+
+
+def encode_window(pieces: List[Tuple[int, int, int]], target, start: int, length: int) -> bytes:
+    """Encode (kind, length, value) pieces covering target[start:start + length]
+
+    The window's source segment spans the source ranges it copies; the
+    window carries the Adler32 of its part of the target.
+    """
+    copies = [(value, n) for kind, n, value in pieces if kind == COPY]
+    if copies:
+        low = min(value for value, _ in copies)
+        high = max(value + n for value, n in copies)
+        encoder = vcdiff.WindowEncoder(low, high - low)
+    else:
+        low = 0
+        encoder = vcdiff.WindowEncoder()
+    for kind, n, value in pieces:
+        if kind == COPY:
+            encoder.copy(value - low, n)
+        else:
+            encoder.add(target[value:value + n])
+    checksum = zlib.adler32(target[start:start + length]) & 0xFFFFFFFF
+    return encoder.encode(checksum)
+
+
+def match_length(source, s: int, target, t: int, limit: int) -> int:
+    """Length of the common prefix of source[s:] and target[t:], at most limit"""
+    limit = min(limit, len(source) - s)
+    n = 0
+    step = 256
+    while n < limit:
+        k = min(step, limit - n)
+        if source[s + n:s + n + k] != target[t + n:t + n + k]:
+            # The first difference is in this chunk
+            equal, different = 0, k
+            while different - equal > 1:
+                middle = (equal + different) // 2
+                if source[s + n:s + n + middle] == target[t + n:t + n + middle]:
+                    equal = middle
+                else:
+                    different = middle
+            return n + equal
+        n += k
+        step = min(step * 2, 1 << 20)
+    return n
+
+
+class EncodeReport:
+    """What an encode produced and how long each part took"""
+
+    def __init__(self, source_size: int, target_size: int, block_size: int, workers: int):
+        self.source_size = source_size
+        self.target_size = target_size
+        self.block_size = block_size
+        self.workers = workers
+        self.delta_size = 0
+        self.matched = 0  # Target bytes encoded as source copies
+        self.windows = 0
+        self.index_seconds = 0.0
+        self.encode_seconds = 0.0
+        # Worker pid -> [windows, target bytes, CPU seconds]
+        self.per_core: Dict[int, List] = {}
+
+    @property
+    def ratio(self) -> float:
+        """Delta size as a fraction of the target"""
+        return self.delta_size / self.target_size if self.target_size else 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Target bytes encoded per second of wall time, index included"""
+        elapsed = self.index_seconds + self.encode_seconds
+        return self.target_size / elapsed if elapsed else 0.0
+
+
+# Per-process state of the encoder workers
+_worker_source = None
+_worker_target = None
+_worker_memory: list = []
+_worker_hashes = None
+_worker_table = None
+_worker_block_size = DEFAULT_BLOCK_SIZE
+_worker_shift = 0
+
+
+def _map(path: str):
+    with open(path, "rb") as f:
+        # mmap refuses empty files; an empty file is still a valid input
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _init_worker(source_path: str, target_path: str, hashes_name: Optional[str],
+                 table_name: Optional[str], block_size: int, shift: int) -> None:
+    """Map both files and attach to the shared block index"""
+    global _worker_source, _worker_target, _worker_memory, _worker_hashes, _worker_table
+    global _worker_block_size, _worker_shift
+
+    _worker_source = _map(source_path)
+    _worker_target = _map(target_path)
+    _worker_block_size = block_size
+    _worker_shift = shift
+    if hashes_name is not None:
+        _worker_memory = [shared_memory.SharedMemory(hashes_name), shared_memory.SharedMemory(table_name)]
+        _worker_hashes = _worker_memory[0].buf.cast("I")
+        _worker_table = _worker_memory[1].buf.cast("I")
+
+
+def _hash_blocks_job(first: int, last: int) -> int:
+    """Checksum source blocks first..last - 1 into the shared hashes array"""
+    source = _worker_source
+    size = _worker_block_size
+    _worker_hashes[first:last] = array("I", [
+        zlib.adler32(source[position:position + size])
+        for position in range(first * size, last * size, size)
+    ])
+    return last - first
+
+
+def _match_window(start: int, end: int) -> Tuple[List[Tuple[int, int, int]], int]:
+    """Cover target[start:end] with source copies and literals; also returns the bytes copied"""
+    source = _worker_source
+    target = _worker_target
+    hashes = _worker_hashes
+    table = _worker_table
+    size = _worker_block_size
+    shift = _worker_shift
+    pieces = []
+    matched = 0
+    literal = start
+    position = start
+
+    if table is not None and end - start >= size:
+        checksum = zlib.adler32(target[position:position + size])
+        a, b = checksum & 0xFFFF, checksum >> 16
+        while True:
+            checksum = (b << 16) | a
+            block = table[_bucket(checksum, shift)]
+            if block and hashes[block - 1] == checksum:
+                s = (block - 1) * size
+                if source[s:s + size] == target[position:position + size]:
+                    back = 0
+                    while (position - back > literal and s - back > 0
+                           and source[s - back - 1] == target[position - back - 1]):
+                        back += 1
+                    n = size + match_length(source, s + size, target, position + size, end - position - size)
+                    if position - back > literal:
+                        pieces.append((LITERAL, position - back - literal, literal))
+                    pieces.append((COPY, n + back, s - back))
+                    matched += n + back
+                    position += n
+                    literal = position
+                    if position + size > end:
+                        break
+                    checksum = zlib.adler32(target[position:position + size])
+                    a, b = checksum & 0xFFFF, checksum >> 16
+                    continue
+
+            if position + size >= end:
+                break
+            # Roll the checksum one byte on
+            leaving = target[position]
+            a = (a - leaving + target[position + size]) % ADLER_MOD
+            b = (b - size * leaving + a - 1) % ADLER_MOD
+            position += 1
+
+    if literal < end:
+        pieces.append((LITERAL, end - literal, literal))
+    return pieces, matched
+
+
+def _encode_window_job(index: int, start: int, length: int) -> Tuple[int, bytes, int, int, float]:
+    """Search and encode one target window
+
+    Returns (index, encoded window, bytes copied, worker pid, CPU seconds).
+    """
+    started = time.process_time()
+    pieces, matched = _match_window(start, start + length)
+    encoded = encode_window(pieces, _worker_target, start, length)
+    return index, encoded, matched, os.getpid(), time.process_time() - started
+
+
+def encode_delta(
+    source_path: str,
+    target_path: str,
+    output_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    window_size: int = WINDOW_SIZE,
+    workers: Optional[int] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+) -> EncodeReport:
+    """Write a VCDIFF delta from source_path to target_path into output_path
+
+    workers defaults to the number of CPU cores. progress_callback, if
+    given, is called as progress_callback(target_bytes_done, target_total)
+    as windows finish. Raises ValueError for a block size under
+    MIN_BLOCK_SIZE, RuntimeError where shared memory is unavailable.
+    """
+    if shared_memory is None:
+        raise RuntimeError("Encoding needs Python 3.8 or newer (multiprocessing.shared_memory)")
+    if block_size < MIN_BLOCK_SIZE:
+        raise ValueError(f"Block size must be at least {MIN_BLOCK_SIZE} bytes")
+    source_size = os.path.getsize(source_path)
+    target_size = os.path.getsize(target_path)
+    windows = [(start, min(window_size, target_size - start)) for start in range(0, target_size, window_size)]
+    workers = max(1, workers or os.cpu_count() or 1)
+    report = EncodeReport(source_size, target_size, block_size, workers)
+    report.windows = len(windows)
+
+    blocks = source_size // block_size
+    memory = []
+    hashes_name = table_name = None
+    bits = table_bits(blocks)
+    shift = 32 - bits
+    temp_path = output_path + ".tmp"
+    try:
+        if blocks:
+            memory = [shared_memory.SharedMemory(create=True, size=blocks * 4),
+                      shared_memory.SharedMemory(create=True, size=(1 << bits) * 4)]
+            hashes_name, table_name = memory[0].name, memory[1].name
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(source_path, target_path, hashes_name, table_name, block_size, shift),
+        ) as pool:
+            started = time.perf_counter()
+            if blocks:
+                jobs = [pool.submit(_hash_blocks_job, first, min(first + INDEX_JOB_BLOCKS, blocks))
+                        for first in range(0, blocks, INDEX_JOB_BLOCKS)]
+                for job in as_completed(jobs):
+                    job.result()
+                # Filled in source order so the earliest block owns its bucket
+                with memory[0].buf.cast("I") as hashes, memory[1].buf.cast("I") as table:
+                    for block, checksum in enumerate(hashes):
+                        bucket = _bucket(checksum, shift)
+                        if not table[bucket]:
+                            table[bucket] = block + 1
+            report.index_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            jobs = [pool.submit(_encode_window_job, index, start, length)
+                    for index, (start, length) in enumerate(windows)]
+            encoded: Dict[int, bytes] = {}
+            next_to_write = 0
+            done = 0
+            with open(temp_path, "wb") as out:
+                out.write(vcdiff.encode_header())
+                report.delta_size = out.tell()
+                try:
+                    for job in as_completed(jobs):
+                        index, data, matched, pid, seconds = job.result()
+                        encoded[index] = data
+                        report.matched += matched
+                        core = report.per_core.setdefault(pid, [0, 0, 0.0])
+                        core[0] += 1
+                        core[1] += windows[index][1]
+                        core[2] += seconds
+                        done += windows[index][1]
+
+                        # Windows go out in order; later ones wait in memory
+                        while next_to_write in encoded:
+                            data = encoded.pop(next_to_write)
+                            out.write(data)
+                            report.delta_size += len(data)
+                            next_to_write += 1
+                        if progress_callback:
+                            progress_callback(done, target_size)
+                except BaseException:
+                    for job in jobs:
+                        job.cancel()
+                    raise
+            report.encode_seconds = time.perf_counter() - started
+        os.replace(temp_path, output_path)
+    finally:
+        for block in memory:
+            block.close()
+            block.unlink()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return report
+
+
+def verify(source_path: str, target_path: str, delta_path: str) -> Tuple[bool, str]:
+    """Decode delta_path against source_path and compare the result with target_path"""
+    expected = hashlib.sha256()
+    with open(target_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            expected.update(chunk)
+    decoded = hashlib.sha256()
+    with open(os.devnull, "wb") as devnull:
+        vcdiff.decode_into(source_path, delta_path, devnull, digest_sink=decoded)
+    if decoded.digest() != expected.digest():
+        return False, "decoded output differs from the target"
+    return True, f"decodes to the target (sha256 {decoded.hexdigest()})"
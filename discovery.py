@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Installation discovery
+Description: Finds Fallout 4 installations from Steam, GOG and Proton metadata
+
+Steam libraries are read from libraryfolders.vdf and the Fallout 4 /
+Fallout 4 VR app manifests, so games in any library on any drive are
+found. GOG installs come from the registry and the usual folders, and
+Proton/Wine prefixes are searched for GOG or Steam copies installed inside
+them. Every probe runs on its own daemon thread with a timeout, so a slow
+or disconnected drive only loses its own results instead of hanging the
+search. Results are cached with the stat signatures of every file and
+folder they were derived from, and reused until one of those changes.
+
+All paths are derived from home and the Steam roots, so the whole search
+can run against a fake directory tree.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import fingerprint
+
+try:
+    import winreg  # Windows only
+except ImportError:
+    winreg = None
+
+ESM_NAME = "Fallout4.esm"
+
+# Steam app ids and the game each one is
+STEAM_APPS = {
+    "377160": "Fallout 4",
+    "611660": "Fallout 4 VR",
+}
+
+# GOG Galaxy game id of Fallout 4 GOTY
+GOG_GAME_IDS = ("1998527297",)
+
+# Install folders probed inside Wine/Proton prefixes (relative to drive_c)
+PREFIX_INSTALL_DIRS = (
+    "GOG Games/Fallout 4",
+    "Program Files (x86)/GOG Galaxy/Games/Fallout 4",
+    "Program Files (x86)/Steam/steamapps/common/Fallout 4",
+    "Program Files (x86)/Steam/steamapps/common/Fallout 4 VR",
+)
+
+# Fixed Windows locations, checked in case no metadata points at them
+KNOWN_WINDOWS_LOCATIONS = (
+    r"C:\Games\Fallout 4",
+    r"C:\Games\Fallout 4 VR",
+    r"C:\GOG Games\Fallout 4",
+    r"C:\Program Files (x86)\GOG Galaxy\Games\Fallout 4",
+    r"D:\Steam",
+    r"D:\SteamLibrary",
+)
+
+DEFAULT_PROBE_TIMEOUT = 3.0
+
+CACHE_VERSION = 1
+CACHE_FILENAME = "installations.json"
+
+
+class Installation:
+    """One discovered Fallout4.esm"""
+
+    def __init__(self, esm_path: str, game: str, source: str, library: Optional[str] = None):
+        self.esm_path = esm_path
+        self.game = game
+        self.source = source
+        self.library = library
+
+    def to_dict(self) -> dict:
+        return {"esm_path": self.esm_path, "game": self.game,
+                "source": self.source, "library": self.library}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Installation":
+        return cls(data["esm_path"], data["game"], data["source"], data.get("library"))
+
+    def __repr__(self) -> str:
+        return f"Installation({self.esm_path!r}, {self.game!r}, {self.source!r})"
+
+
+# -- Valve KeyValues (.vdf / .acf) ---------------------------------------
+
+_VDF_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|([{}])|//[^\n]*|(\[[^\]]*\])|([^\s{}"]+)')
+_VDF_ESCAPES = {"n": "\n", "t": "\t", "\\": "\\", '"': '"'}
+
+
+def _vdf_unescape(value: str) -> str:
+    return re.sub(r"\\(.)", lambda m: _VDF_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def parse_vdf(text: str) -> dict:
+    """Parse Valve KeyValues text into nested dicts
+
+    Keys are lower-cased, since Steam writes both "LibraryFolders" and
+    "libraryfolders" depending on its version. Platform conditionals such
+    as [$WIN32] are ignored.
+    """
+    root: dict = {}
+    stack = [root]
+    key = None
+    for match in _VDF_TOKEN.finditer(text):
+        quoted, brace, conditional, bare = match.groups()
+        if conditional is not None or (quoted is None and brace is None and bare is None):
+            continue  # comment or [$PLATFORM] conditional
+        if brace == "{":
+            if key is None:
+                raise ValueError("VDF block without a key")
+            block = stack[-1].setdefault(key, {})
+            stack.append(block if isinstance(block, dict) else {})
+            key = None
+        elif brace == "}":
+            if len(stack) == 1:
+                raise ValueError("Unbalanced '}' in VDF")
+            stack.pop()
+            key = None
+        else:
+            token = _vdf_unescape(quoted) if quoted is not None else bare
+            if key is None:
+                key = token.lower()
+            else:
+                stack[-1][key] = token
+                key = None
+    return root
+
+
+def read_vdf(path: str) -> dict:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return parse_vdf(f.read())
+
+
+# -- Probing ---------------------------------------------------------------
+
+def stat_signature(path: str) -> Optional[List[int]]:
+    """[mtime_ns, size] of path, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class ProbeResult:
+    """What one probe found, plus every path its answer depended on"""
+
+    def __init__(self):
+        self.installations: List[Installation] = []
+        self.libraries: List[str] = []
+        self.watched: Dict[str, Optional[List[int]]] = {}
+
+    def watch(self, path: str) -> Optional[List[int]]:
+        signature = stat_signature(path)
+        self.watched[path] = signature
+        return signature
+
+    def check_install(self, install_dir: str, game: str, source: str,
+                      library: Optional[str] = None) -> bool:
+        """Record install_dir if it holds a Fallout4.esm (in Data or at the root)"""
+        for candidate in (os.path.join(install_dir, "Data", ESM_NAME), os.path.join(install_dir, ESM_NAME)):
+            if self.watch(candidate) is not None:
+                self.installations.append(Installation(candidate, game, source, library))
+                return True
+        return False
+
+
+def run_probes(probes: List[Tuple[str, Callable[[ProbeResult], None]]],
+               timeout: float) -> Tuple[List[ProbeResult], List[str], List[str]]:
+    """Run every probe on its own daemon thread, each limited to timeout seconds
+
+    Returns the results of the probes that finished, the names of those
+    that timed out and the names of those that raised. Daemon threads are
+    used rather than an executor so a probe stuck on a dead drive never
+    delays shutdown.
+    """
+    results: Dict[int, ProbeResult] = {}
+    raised = set()
+    timed_out: List[str] = []
+    failed: List[str] = []
+    threads = []
+
+    def target(index: int, name: str, probe: Callable[[ProbeResult], None]):
+        result = ProbeResult()
+        try:
+            probe(result)
+        except Exception:
+            logging.debug(f"Probe {name} failed", exc_info=True)
+            raised.add(index)
+            return
+        results[index] = result
+
+    for index, (name, probe) in enumerate(probes):
+        thread = threading.Thread(target=target, args=(index, name, probe), name=f"probe-{name}", daemon=True)
+        thread.start()
+        threads.append((index, name, thread))
+
+    deadline = time.monotonic() + timeout
+    for index, name, thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if index in raised:
+            failed.append(name)
+        elif index not in results:
+            timed_out.append(name)
+
+    return [results[i] for i in sorted(results)], timed_out, failed
+
+
+# -- Locations -------------------------------------------------------------
+
+def _registry_value(root, key: str, name: str) -> Optional[str]:
+    if winreg is None:
+        return None
+    try:
+        with winreg.OpenKey(root, key) as handle:
+            return winreg.QueryValueEx(handle, name)[0]
+    except OSError:
+        return None
+
+
+def default_steam_roots(home: str) -> List[str]:
+    """Steam client installations for this platform"""
+    roots = []
+    if os.name == "nt":
+        if winreg is not None:
+            roots.append(_registry_value(winreg.HKEY_CURRENT_USER, r"Software\Valve\Steam", "SteamPath"))
+            roots.append(_registry_value(winreg.HKEY_LOCAL_MACHINE,
+                                         r"SOFTWARE\WOW6432Node\Valve\Steam", "InstallPath"))
+        roots.append(r"C:\Program Files (x86)\Steam")
+    elif sys.platform == "darwin":
+        roots.append(os.path.join(home, "Library", "Application Support", "Steam"))
+    else:
+        roots.extend([
+            os.path.join(home, ".steam", "steam"),
+            os.path.join(home, ".local", "share", "Steam"),
+            os.path.join(home, ".var", "app", "com.valvesoftware.Steam", ".local", "share", "Steam"),
+            os.path.join(home, "snap", "steam", "common", ".local", "share", "Steam"),
+        ])
+    return [os.path.normpath(root) for root in roots if root]
+
+
+def default_gog_dirs(home: str) -> List[str]:
+    """GOG install folders for this platform"""
+    dirs = []
+    if os.name == "nt":
+        if winreg is not None:
+            for game_id in GOG_GAME_IDS:
+                dirs.append(_registry_value(winreg.HKEY_LOCAL_MACHINE,
+                                            rf"SOFTWARE\WOW6432Node\GOG.com\Games\{game_id}", "path"))
+    else:
+        dirs.extend([
+            os.path.join(home, "GOG Games", "Fallout 4"),
+            os.path.join(home, "Games", "Heroic", "Fallout 4"),
+            os.path.join(home, "Games", "Heroic", "Fallout 4 GOTY"),
+        ])
+    return [os.path.normpath(d) for d in dirs if d]
+
+
+def default_prefixes(home: str) -> List[str]:
+    """Stand-alone Wine prefixes (Proton prefixes come from Steam libraries)"""
+    if os.name == "nt":
+        return []
+    return [os.path.join(home, ".wine")]
+
+
+def probe_steam_root(root: str) -> Callable[[ProbeResult], None]:
+    """Collect the library folders of one Steam installation"""
+    def probe(result: ProbeResult):
+        vdf_path = os.path.join(root, "steamapps", "libraryfolders.vdf")
+        if result.watch(vdf_path) is None:
+            if result.watch(os.path.join(root, "steamapps")) is not None:
+                result.libraries.append(root)
+            return
+
+        result.libraries.append(root)
+        data = read_vdf(vdf_path).get("libraryfolders", {})
+        for entry in data.values():
+            # New format: "0" { "path" "..." }, old format: "1" "D:\\SteamLibrary"
+            path = entry.get("path") if isinstance(entry, dict) else entry
+            if path and not path.isdigit():
+                result.libraries.append(os.path.normpath(path))
+    return probe
+
+
+def probe_steam_library(library: str) -> Callable[[ProbeResult], None]:
+    """Find Fallout 4 / VR app manifests and Proton prefixes in one library"""
+    def probe(result: ProbeResult):
+        steamapps = os.path.join(library, "steamapps")
+        if result.watch(steamapps) is None:
+            return
+
+        for app_id, game in STEAM_APPS.items():
+            manifest = os.path.join(steamapps, f"appmanifest_{app_id}.acf")
+            if result.watch(manifest) is None:
+                continue
+            install_dir = read_vdf(manifest).get("appstate", {}).get("installdir") or game
+            result.check_install(os.path.join(steamapps, "common", install_dir), game, "steam", library)
+
+        # Non-Steam copies added as shortcuts run in compatdata prefixes
+        compatdata = os.path.join(steamapps, "compatdata")
+        if result.watch(compatdata) is not None:
+            for entry in sorted(os.listdir(compatdata)):
+                if entry not in STEAM_APPS:
+                    _probe_prefix(result, os.path.join(compatdata, entry, "pfx"), library)
+    return probe
+
+
+def _probe_prefix(result: ProbeResult, prefix: str, library: Optional[str] = None):
+    drive_c = os.path.join(prefix, "drive_c")
+    if result.watch(drive_c) is None:
+        return
+    for relative in PREFIX_INSTALL_DIRS:
+        game = "Fallout 4 VR" if relative.endswith("VR") else "Fallout 4"
+        result.check_install(os.path.join(drive_c, *relative.split("/")), game, "proton", library)
+
+
+def probe_prefix(prefix: str) -> Callable[[ProbeResult], None]:
+    """Look for installs inside a stand-alone Wine prefix"""
+    return lambda result: _probe_prefix(result, prefix)
+
+
+def probe_directory(install_dir: str, source: str) -> Callable[[ProbeResult], None]:
+    """Check one fixed install folder (GOG or a known location)"""
+    def probe(result: ProbeResult):
+        game = "Fallout 4 VR" if install_dir.rstrip("\\/").endswith("VR") else "Fallout 4"
+        result.check_install(install_dir, game, source)
+    return probe
+
+
+def probe_known_location(path: str) -> Callable[[ProbeResult], None]:
+    """A fixed Windows folder: either an install or a Steam library"""
+    def probe(result: ProbeResult):
+        if result.watch(os.path.join(path, "steamapps")) is not None:
+            result.libraries.append(path)
+        else:
+            probe_directory(path, "known")(result)
+    return probe
+
+
+# -- Discovery -------------------------------------------------------------
+
+class InstallationFinder:
+    """Discovers installations, caching the answer between runs"""
+
+    def __init__(self, home: Optional[str] = None, steam_roots: Optional[List[str]] = None,
+                 gog_dirs: Optional[List[str]] = None, prefixes: Optional[List[str]] = None,
+                 known_locations: Optional[Iterable[str]] = None,
+                 timeout: float = DEFAULT_PROBE_TIMEOUT, cache_path: Optional[str] = None):
+        home = home or os.path.expanduser("~")
+        self.steam_roots = steam_roots if steam_roots is not None else default_steam_roots(home)
+        self.gog_dirs = gog_dirs if gog_dirs is not None else default_gog_dirs(home)
+        self.prefixes = prefixes if prefixes is not None else default_prefixes(home)
+        if known_locations is None:
+            known_locations = KNOWN_WINDOWS_LOCATIONS if os.name == "nt" else ()
+        self.known_locations = list(known_locations)
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.timed_out: List[str] = []
+        self.failed: List[str] = []
+        self.from_cache = False
+
+    @property
+    def roots(self) -> List[str]:
+        """Everything the search starts from; a change invalidates the cache"""
+        return self.steam_roots + self.gog_dirs + self.prefixes + self.known_locations
+
+    def _load_cache(self) -> Optional[List[Installation]]:
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION or data.get("roots") != self.roots:
+                return None
+            watched = data["watched"]
+            installations = [Installation.from_dict(item) for item in data["installations"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        def validate(result: ProbeResult):
+            for path, signature in watched.items():
+                if stat_signature(path) != signature:
+                    raise ValueError(f"{path} changed")
+
+        # Re-stating could itself hit a dead drive, so it gets a timeout too
+        valid, _, _ = run_probes([("cache", validate)], self.timeout)
+        return installations if valid else None
+
+    def _save_cache(self, installations: List[Installation], watched: Dict[str, Optional[List[int]]]):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": CACHE_VERSION,
+                    "roots": self.roots,
+                    "watched": watched,
+                    "installations": [item.to_dict() for item in installations],
+                }, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def find(self, use_cache: bool = True) -> List[Installation]:
+        """Return every installation found, deduplicated by real path"""
+        self.timed_out = []
+        self.failed = []
+        self.from_cache = False
+        if use_cache:
+            cached = self._load_cache()
+            if cached is not None:
+                self.from_cache = True
+                return cached
+
+        # Round 1: Steam roots (yielding libraries) and the fixed folders
+        probes = [(f"steam:{root}", probe_steam_root(root)) for root in self.steam_roots]
+        probes += [(f"gog:{path}", probe_directory(path, "gog")) for path in self.gog_dirs]
+        probes += [(f"prefix:{path}", probe_prefix(path)) for path in self.prefixes]
+        probes += [(f"known:{path}", probe_known_location(path)) for path in self.known_locations]
+        first, timed_out, failed = run_probes(probes, self.timeout)
+
+        # Round 2: every distinct library, one probe each
+        libraries = {}
+        for result in first:
+            for library in result.libraries:
+                libraries.setdefault(_identity(library), library)
+        second, timed_out2, failed2 = run_probes(
+            [(f"library:{path}", probe_steam_library(path)) for path in libraries.values()],
+            self.timeout
+        )
+        self.timed_out = timed_out + timed_out2
+        self.failed = failed + failed2
+        if self.timed_out:
+            logging.warning(f"Discovery probes timed out: {', '.join(self.timed_out)}")
+        if self.failed:
+            logging.warning(f"Discovery probes failed: {', '.join(self.failed)}")
+
+        installations = []
+        seen = set()
+        watched: Dict[str, Optional[List[int]]] = {}
+        for result in first + second:
+            watched.update(result.watched)
+            for item in result.installations:
+                identity = _identity(item.esm_path)
+                if identity not in seen:
+                    seen.add(identity)
+                    installations.append(item)
+
+        # An incomplete answer isn't worth reusing
+        if not (self.timed_out or self.failed):
+            self._save_cache(installations, watched)
+        return installations
+
+
+def _identity(path: str) -> str:
+    return os.path.normcase(os.path.realpath(path))
+
+
+def default_cache_path() -> str:
+    return os.path.join(fingerprint.default_cache_dir(), CACHE_FILENAME)
+
+
+def find_installations(use_cache: bool = True, timeout: float = DEFAULT_PROBE_TIMEOUT) -> List[Installation]:
+    """Discover installations on this machine with the default locations"""
+    finder = InstallationFinder(timeout=timeout, cache_path=default_cache_path() if use_cache else None)
+    return finder.find(use_cache)
@@ -11,58 +11,233 @@ to versions compatible with Fallout 4 VR, Fallout: London, and other mods.
 
 import os
 import sys
-import shutil
-import subprocess
-import tempfile
+import copy
+import threading
+import time
 import hashlib
+import json
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from pathlib import Path
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 import logging
+import argparse
+import glob
+import multiprocessing
 from datetime import datetime
 
-# Configure logging
-log_filename = f"esm_patcher_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import batch
+import checkpoint
+import decode_plan
+import discovery
+import esm_header
+import fastcopy
+import fingerprint
+import jobs
+import manifest
+import process_watch
+import reverse_delta
+import vcdiff
+
+
+def configure_logging():
+    """Configure logging to a timestamped file and the console
+    
+    Called from main() rather than at import time so that decode worker
+    processes (which re-import this module on Windows) don't each open a
+    log file of their own.
+    """
+    log_filename = f"esm_patcher_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_filename, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+
+class ESMAnalysis:
+    """Staged analysis of an ESM file
+    
+    STATUSES are the outcomes of identification, for tables and summaries.
+    
+    Existence and size come from a single os.stat(); digests are computed
+    on first access and memoized, so every caller holding the same analysis
+    shares one read of the file. An analysis is a snapshot: create a new
+    one after the file changes.
+    """
+    
+    STATUSES = ("patchable", "compatible", "unsupported", "missing")
+    
+    def __init__(self, patcher: "ESMPatcher", path: str):
+        self.patcher = patcher
+        self.path = path
+        self._digests = None
+        self._header = None
+        self.header_error = None
+        self._samples = {}
+        # Set by ESMPatcher.identify_esm_version(): one of STATUSES and the
+        # manifest variant the file was identified as, if any
+        self.status = None
+        self.variant = None
+        try:
+            self.stat = os.stat(path)
+        except OSError:
+            self.stat = None
+    
+    @property
+    def exists(self) -> bool:
+        return self.stat is not None
+    
+    @property
+    def size(self) -> int:
+        return self.stat.st_size
+    
+    @property
+    def size_mb(self) -> float:
+        return self.size / (1024 * 1024)
+    
+    @property
+    def header(self) -> Optional[esm_header.ESMHeader]:
+        """The parsed TES4 header (reads only the first few KB), or None
+        
+        When the header can't be read, header_error says why.
+        """
+        if self._header is None and self.header_error is None:
+            try:
+                self._header = esm_header.read_esm_header(self.path)
+            except (OSError, esm_header.ESMHeaderError) as e:
+                self.header_error = str(e)
+        return self._header
+    
+    def sampled_fingerprint(self, signature: Optional[str] = None) -> str:
+        """Sampled fingerprint of the file (a few hundred KB of reads)
+        
+        When signature is given, the sample is taken with its parameters so
+        the two can be compared directly.
+        """
+        if signature:
+            params = fingerprint.parse_sample_signature(signature)
+        else:
+            params = (self.patcher.fast_hash, fingerprint.SAMPLE_BLOCKS, fingerprint.SAMPLE_BLOCK_SIZE)
+        
+        if params not in self._samples:
+            algorithm, blocks, block_size = params
+            self._samples[params] = fingerprint.sampled_fingerprint(self.path, blocks, block_size, algorithm)
+        return self._samples[params]
+    
+    def matches_sample(self, signature: Optional[str]) -> bool:
+        """Whether the file matches a stored sampled signature (True if none is stored)"""
+        return not signature or self.sampled_fingerprint(signature) == signature
+    
+    @property
+    def hashed(self) -> bool:
+        """Whether the digests have already been computed"""
+        return self._digests is not None
+    
+    def digests(self, progress_callback=None) -> dict:
+        """Return every digest of the file, hashing it on first use"""
+        if self._digests is None:
+            self._digests = self.patcher.compute_digests(self.path, progress_callback, self.stat)
+        return self._digests
+    
+    @property
+    def md5(self) -> str:
+        return self.digests()["md5"]
+    
+    def file_info(self, progress_callback=None) -> dict:
+        """Return the get_file_info() dictionary for this file"""
+        if not self.exists:
+            return {"exists": False}
+        
+        file_info = {
+            "exists": True,
+            "size": self.size,
+            "size_mb": self.size_mb,
+            "path": self.path
+        }
+        file_info.update(self.digests(progress_callback))
+        return file_info
+
 
 class ESMPatcher:
     """Main patcher class for Fallout4.esm files"""
     
-    # Known ESM sizes that need patching (exact byte counts)
-    PATCH_MAPPINGS = {
-        330777465: {  # Exactly 330,777,465 bytes
-            "patch": "fallout4_323025.xdelta",
-            "description": "323,025 KB variant",
-            "md5": "a5c13fb8c0e2e9c7c0c8e6f9d4b5a3e2"  # Add actual MD5 if known
-        },
-        330553163: {  # Exactly 330,553,163 bytes
-            "patch": "fallout4_322806.xdelta",
-            "description": "322,806 KB variant",
-            "md5": "b7d24fa9e1d3c8b6a4f5e7c9d2a1b3c4"  # Add actual MD5 if known
-        }
-    }
+    # Patch engines selectable through apply_patch / --engine
+    ENGINES = ("auto", "xdelta3", "builtin")
+    
+    # How create_backup preserves the original: an O(1) hard link/rename
+    # that apply_patch then decodes from, a full copy, or a reverse delta
+    # of a few MB that rebuilds it from the patched file
+    BACKUP_STRATEGIES = ("rename", "copy", "delta")
+    
+    # xdelta3.exe is killed when it writes less than this many bytes per
+    # second for stall_timeout seconds
+    STALL_MIN_THROUGHPUT = process_watch.DEFAULT_MIN_THROUGHPUT
     
-    # Known compatible ESM sizes (don't need patching)
-    COMPATIBLE_SIZES = {
-        330745373: "Already compatible (315.42 MB) - No patching needed",
-        61741779: "Patched/compatible version (58.9 MB)",
-        61598851: "Patched/compatible version (58.7 MB)",
-    }
+    # Reported when a patch's target has no digest in the manifest
+    NO_TARGET_DIGEST = "Target digest unavailable; verified size and window checksums only"
     
-    def __init__(self):
-        """Initialize the patcher"""
+    def __init__(self, engine: str = "auto", workers: int = 1,
+                 fast_hash: str = fingerprint.DEFAULT_FAST_HASH, hash_buffer_size="auto",
+                 use_cache: bool = True, backup_strategy: str = "rename", resumable: bool = True,
+                 stall_timeout: float = process_watch.DEFAULT_STALL_TIMEOUT):
+        """Initialize the patcher
+        
+        workers is the number of processes the built-in engine decodes
+        windows with (1 = in this process, 0 = one per CPU core).
+        fast_hash names the extra digest get_file_info computes alongside
+        MD5/SHA-256/CRC32; hash_buffer_size is its read size in bytes or
+        "auto" to pick one for the disk holding the file. use_cache enables
+        the persistent fingerprint and decode-plan caches in the user's
+        cache directory.
+        backup_strategy is one of BACKUP_STRATEGIES. resumable journals
+        serial built-in decodes so an interrupted patch picks up where it
+        stopped. stall_timeout is how many seconds xdelta3.exe may run
+        below STALL_MIN_THROUGHPUT before it is killed.
+        """
         self.assets_dir = self.get_assets_directory()
         self.xdelta_path = os.path.join(self.assets_dir, "xdelta3.exe")
         self.current_esm_path = None
         self.backup_created = False
+        self.engine = self.resolve_engine(engine)
+        self.workers = workers
+        self.fast_hash = fast_hash
+        self.hash_buffer_size = hash_buffer_size
+        self.fingerprint_cache = fingerprint.FingerprintCache() if use_cache else None
+        self.use_plan_cache = use_cache
+        if backup_strategy not in self.BACKUP_STRATEGIES:
+            raise ValueError(f"Unknown backup strategy: {backup_strategy}")
+        self.backup_strategy = backup_strategy
+        self.resumable = resumable
+        self.stall_timeout = stall_timeout
+    
+    def clone(self) -> "ESMPatcher":
+        """A patcher with the same settings and fresh per-run state
+        
+        Batch mode patches each target with its own clone, so one target's
+        backup_created can't leak into another's. The fingerprint cache is
+        shared; its lock serialises writes to the cache file.
+        """
+        other = copy.copy(self)
+        other.current_esm_path = None
+        other.backup_created = False
+        return other
+    
+    def resolve_engine(self, engine: str) -> str:
+        """Resolve "auto" to a concrete patch engine"""
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown patch engine: {engine}")
+        
+        if engine == "auto":
+            # Keep using xdelta3.exe on Windows when it is bundled,
+            # otherwise decode in-process
+            if os.name == "nt" and os.path.exists(self.xdelta_path):
+                return "xdelta3"
+            return "builtin"
+        
+        return engine
         
     def get_assets_directory(self) -> str:
         """Get the assets directory path"""
@@ -73,90 +248,310 @@ class ESMPatcher:
             # Running as script
             return os.path.join(os.path.dirname(__file__), "assets")
     
+    @property
+    def registry(self) -> manifest.PatchRegistry:
+        """Known variants and patches, compiled from the manifests on first use"""
+        paths = manifest.manifest_paths(self.assets_dir)
+        if not paths:
+            raise manifest.ManifestError(f"No patch manifest found in {self.assets_dir}")
+        # load_registry() caches, so this only re-reads changed manifests
+        return manifest.load_registry(paths)
+    
     def verify_dependencies(self) -> Tuple[bool, str]:
         """Verify all required files are present"""
         missing_files = []
         
-        # Check xdelta3.exe
-        if not os.path.exists(self.xdelta_path):
+        # Check xdelta3.exe (only needed by the external engine)
+        if self.engine == "xdelta3" and not os.path.exists(self.xdelta_path):
             missing_files.append("xdelta3.exe")
         
-        # Check patch files
-        for patch_info in self.PATCH_MAPPINGS.values():
-            patch_path = os.path.join(self.assets_dir, patch_info["patch"])
-            if not os.path.exists(patch_path):
-                missing_files.append(patch_info["patch"])
+        try:
+            registry = self.registry
+        except (OSError, manifest.ManifestError) as e:
+            return False, f"Cannot load the patch manifest: {e}"
+        
+        # Check patch files; a size mismatch means a truncated download
+        for edge in registry.edges:
+            try:
+                patch_size = os.path.getsize(edge.patch_path)
+            except OSError:
+                missing_files.append(os.path.basename(edge.patch_path))
+                continue
+            if edge.patch_size and patch_size != edge.patch_size:
+                return False, (f"Patch file {os.path.basename(edge.patch_path)} is damaged "
+                               f"({patch_size:,} bytes, expected {edge.patch_size:,})")
         
         if missing_files:
             return False, f"Missing required files: {', '.join(missing_files)}"
         
         return True, "All dependencies verified"
     
-    def get_file_info(self, file_path: str) -> dict:
-        """Get detailed information about a file"""
-        if not os.path.exists(file_path):
-            return {"exists": False}
+    @property
+    def digest_algorithms(self) -> Tuple[str, ...]:
+        """Digests computed for every fingerprint"""
+        return ("md5", "sha256", "crc32", self.fast_hash)
+    
+    def analyze(self, file_path: str) -> ESMAnalysis:
+        """Start a staged analysis of a file (only stats it)"""
+        return ESMAnalysis(self, file_path)
+    
+    def compute_digests(self, file_path: str, progress_callback=None,
+                        stat: Optional[os.stat_result] = None) -> dict:
+        """Hash a file once, returning MD5, SHA-256, CRC32 and the fast hash
         
-        file_size = os.path.getsize(file_path)
+        The persistent fingerprint cache is consulted first, so an unchanged
+        file costs only a stat().
+        """
+        algorithms = self.digest_algorithms
         
-        # Calculate MD5 hash
-        md5_hash = hashlib.md5()
-        with open(file_path, "rb") as f:
-            # Read in chunks to handle large files
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5_hash.update(chunk)
+        if self.fingerprint_cache:
+            stat = stat or os.stat(file_path)
+            digests = self.fingerprint_cache.get(stat, algorithms)
+            if digests:
+                logging.info(f"Fingerprint cache hit for {file_path}")
+                digests["fast_hash"] = digests[self.fast_hash]
+                return digests
         
-        return {
-            "exists": True,
-            "size": file_size,
-            "size_mb": file_size / (1024 * 1024),
-            "md5": md5_hash.hexdigest(),
-            "path": file_path
-        }
+        digests = fingerprint.fingerprint_file(
+            file_path,
+            algorithms=algorithms,
+            buffer_size=self.hash_buffer_size,
+            progress_callback=progress_callback
+        )
+        file_size = digests.pop("size")
+        
+        logging.info(
+            f"Fingerprint of {file_path}: size={file_size:,} "
+            + " ".join(f"{name}={value}" for name, value in digests.items())
+        )
+        
+        # Only cache the result if the file didn't change while we read it
+        if self.fingerprint_cache:
+            try:
+                after = os.stat(file_path)
+                if fingerprint.FingerprintCache.key(after) == fingerprint.FingerprintCache.key(stat):
+                    self.fingerprint_cache.put(after, file_path, digests)
+            except OSError as e:
+                logging.warning(f"Could not update fingerprint cache: {e}")
+        
+        digests["fast_hash"] = digests[self.fast_hash]
+        return digests
+    
+    def get_file_info(self, file_path: str, progress_callback=None) -> dict:
+        """Get detailed information about a file
+        
+        All digests (MD5, SHA-256, CRC32 and the fast hash) come from a
+        single read of the file.
+        """
+        return self.analyze(file_path).file_info(progress_callback)
     
-    def identify_esm_version(self, esm_path: str) -> Tuple[bool, str, Optional[dict]]:
-        """Identify if ESM needs patching and which patch to use"""
-        file_info = self.get_file_info(esm_path)
+    def identify_esm_version(self, esm_path: Union[str, ESMAnalysis]) -> Tuple[bool, str, Optional[dict]]:
+        """Identify if ESM needs patching and which patch to use
+        
+        Accepts a path or an ESMAnalysis; pass an analysis to read the
+        outcome from its status and variant rather than from the message,
+        which is meant for people. Identification normally only needs the
+        file size, the TES4 header and sampled blocks; the file is hashed
+        only when several manifest variants share its size.
+        """
+        analysis = esm_path if isinstance(esm_path, ESMAnalysis) else self.analyze(esm_path)
         
-        if not file_info["exists"]:
+        analysis.status, analysis.variant = "unsupported", None
+        if not analysis.exists:
+            analysis.status = "missing"
             return False, "File does not exist", None
         
-        file_size = file_info["size"]
+        header = analysis.header
+        if header is None:
+            return False, f"Not a valid ESM file ({analysis.header_error})", None
         
-        # Check if this is a known patchable size
-        if file_size in self.PATCH_MAPPINGS:
-            patch_info = self.PATCH_MAPPINGS[file_size]
-            return True, f"Next-Gen ESM detected ({patch_info['description']})", patch_info
+        file_size = analysis.size
+        registry = self.registry
         
-        # Check if it's already patched (different known sizes)
-        known_patched_sizes = [
-            (61741779, "VR-compatible version (58.9 MB)"),
-            (61598851, "VR-compatible version (58.7 MB)"),
-        ]
+        # O(1) size lookup, then the header and a few hundred KB of sampled
+        # blocks rule out a different build of the same size
+        candidates = []
+        for variant in registry.variants_of_size(file_size):
+            if variant.header_signature and header.signature != variant.header_signature:
+                logging.warning(
+                    f"Size matches {variant.description} but header signature "
+                    f"{header.signature} != {variant.header_signature}"
+                )
+            elif not analysis.matches_sample(variant.sampled):
+                logging.warning(f"Size matches {variant.description} but the sampled fingerprint differs")
+            else:
+                candidates.append(variant)
+        
+        if not candidates:
+            if registry.variants_of_size(file_size):
+                return False, f"Unknown ESM version (size: {file_size:,} bytes, {header.describe()})", None
+            # Close to a compatible build: most likely that build with a few
+            # records edited, but nothing identifies it for certain
+            near = registry.compatible_near_size(file_size)
+            if near is not None:
+                analysis.status = "compatible"
+                return False, (f"Probably already patched: {near.description} "
+                               f"(size {file_size:,} bytes, {file_size - near.size:+,} from the known build)"), None
+            return False, f"Unknown ESM version (size: {file_size:,} bytes)", None
+        
+        # Only variants that can't be told apart otherwise need a full hash
+        variant = candidates[0]
+        if len(candidates) > 1 or (analysis.hashed and variant.digests):
+            by_digest = registry.variant_by_digests(analysis.digests())
+            if by_digest is None or by_digest not in candidates:
+                return False, f"Unknown ESM version (size: {file_size:,} bytes, digest not recognised)", None
+            variant = by_digest
+        
+        if not (variant.digests or variant.sampled or variant.header_signature):
+            logging.info(f"Identified {analysis.path} as {variant.id} by size alone; "
+                         f"the manifest lists no fingerprints for it")
+        
+        analysis.variant = variant
+        if variant.compatible:
+            analysis.status = "compatible"
+            return False, f"Already patched: {variant.description}", None
+        
+        patch_info = self.plan_patch(variant.id)
+        if patch_info is None:
+            return False, f"Unknown ESM version ({variant.description}, no patch available)", None
+        analysis.status = "patchable"
+        return True, f"Next-Gen ESM detected ({patch_info['description']})", patch_info
+    
+    def plan_patch(self, variant_id: str) -> Optional[dict]:
+        """Pick the cheapest chain of patches from a variant to a compatible one
+        
+        Variants are nodes and the manifest's patches weighted edges (patch
+        bytes plus estimated decode cost). Returns the plan's patch_info, or
+        None when no compatible variant is reachable.
+        """
+        plan = self.registry.plan(variant_id)
+        if plan is None:
+            return None
+        logging.info(f"Patch plan for {variant_id}: {plan.route()} (cost {plan.cost:,.0f})")
+        return self.registry.patch_info(plan)
+    
+    def analyze_installations(self, paths, max_workers: Optional[int] = None,
+                              progress_callback=None) -> list:
+        """Identify and fingerprint several ESM files in parallel
+        
+        Paths that are the same file (hard links, symlinks, a folder reached
+        twice) are analyzed once and listed in the row's "aliases". Hashing
+        runs on a thread pool since hashlib releases the GIL; on a spinning
+        disk the files are read one at a time. progress_callback(done,
+        total) gets the bytes hashed across all files. Returns one row dict
+        per distinct file, in input order.
+        """
+        rows = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+                identity = (st.st_dev, st.st_ino)
+            except OSError:
+                identity = ("missing", os.path.normcase(os.path.abspath(path)))
+            if identity in rows:
+                if path not in rows[identity]["aliases"]:
+                    rows[identity]["aliases"].append(path)
+            else:
+                rows[identity] = {"path": path, "aliases": []}
+        
+        analyses = {row["path"]: self.analyze(row["path"]) for row in rows.values()}
+        total = sum(a.size for a in analyses.values() if a.exists and not a.hashed)
+        done = {}
+        lock = threading.Lock()
+        
+        def analyze_one(path: str) -> dict:
+            analysis = analyses[path]
+            needs_patch, status_msg, patch_info = self.identify_esm_version(analysis)
+            row = {
+                "status": analysis.status,
+                "message": status_msg,
+                "variant": patch_info["description"] if patch_info else None,
+                "size": analysis.size if analysis.exists else None,
+                "header": analysis.header.describe() if analysis.exists and analysis.header else None,
+            }
+            if analysis.exists:
+                def on_bytes(n: int, _total: int):
+                    with lock:
+                        done[path] = n
+                        current = sum(done.values())
+                    if progress_callback:
+                        progress_callback(current, total)
+                digests = analysis.digests(on_bytes)
+                row.update(md5=digests["md5"], sha256=digests["sha256"])
+            return row
         
-        for size, description in known_patched_sizes:
-            if abs(file_size - size) < 1000:  # Within 1KB tolerance
-                return False, f"Already patched: {description}", None
+        workers = max_workers or min(len(analyses), os.cpu_count() or 1) or 1
+        rotational = any(fingerprint.is_rotational(path) for path in analyses)
+        runner = batch.BatchRunner(analyze_one, max_workers=workers,
+                                   per_device=1 if rotational else workers)
+        results = runner.run(list(analyses))
+        
+        for row, result in zip(rows.values(), results):
+            row.update(result)
+            row.pop("target", None)
+            row.pop("waited", None)
+        return list(rows.values())
+    
+    def find_backup(self, esm_path: str) -> Optional[str]:
+        """The full or reverse-delta backup of esm_path, if there is one"""
+        if os.path.exists(esm_path + ".backup"):
+            return esm_path + ".backup"
+        if reverse_delta.has_backup(esm_path):
+            return reverse_delta.backup_paths(esm_path)[0]
+        return None
+    
+    def patch_source(self, esm_path: str, backup_path: str) -> str:
+        """The file apply_patch should decode from after create_backup()
         
-        # Unknown size
-        return False, f"Unknown ESM version (size: {file_size:,} bytes)", None
+        A reverse-delta backup leaves the original in place until the
+        patched file replaces it.
+        """
+        if backup_path == reverse_delta.backup_paths(esm_path, pending=True)[0]:
+            return esm_path
+        return backup_path
     
-    def create_backup(self, esm_path: str) -> Tuple[bool, str]:
-        """Create a backup of the ESM file"""
+    def create_backup(self, esm_path: str, overwrite: Optional[bool] = None,
+                      progress_callback=None, patch_info: Optional[dict] = None) -> Tuple[bool, str]:
+        """Create a backup of the ESM file
+        
+        overwrite decides what happens to an existing backup; None asks the
+        user. progress_callback(bytes_done, bytes_total) follows a copy.
+        The delta strategy needs the patch_info of the patch about to be
+        applied; its backup stays pending (and an existing backup stays in
+        place) until apply_patch() commits. Returns the backup path; pass
+        it through patch_source() to get the file apply_patch decodes from.
+        """
         try:
-            backup_path = esm_path + ".backup"
+            existing = self.find_backup(esm_path)
             
             # Check if backup already exists
-            if os.path.exists(backup_path):
+            if existing and overwrite is False:
+                return False, "Backup cancelled by user"
+            if existing and overwrite is None:
                 response = messagebox.askyesno(
                     "Backup Exists",
-                    f"A backup already exists at:\n{backup_path}\n\nOverwrite it?"
+                    f"A backup already exists at:\n{existing}\n\nOverwrite it?"
                 )
                 if not response:
                     return False, "Backup cancelled by user"
             
-            logging.info(f"Creating backup: {backup_path}")
-            shutil.copy2(esm_path, backup_path)
+            backup_path = esm_path + ".backup"
+            if self.backup_strategy == "delta":
+                if patch_info is None:
+                    return False, "A reverse-delta backup needs the patch that will be applied"
+                backup_path = self.create_delta_backup(esm_path, patch_info)
+            else:
+                logging.info(f"Creating backup ({self.backup_strategy}): {backup_path}")
+                if self.backup_strategy == "rename":
+                    self.move_to_backup(esm_path, backup_path)
+                else:
+                    method = fastcopy.copy_file(esm_path, backup_path, progress_callback)
+                    logging.info(f"Backup copied using {method}")
+            
+            # Only one kind of backup may exist, or restore would pick the
+            # stale one; a reverse delta replaces a full backup on commit
+            if self.backup_strategy != "delta":
+                reverse_delta.discard_backup(esm_path, pending=False)
             self.backup_created = True
             
             return True, backup_path
@@ -165,107 +560,552 @@ class ESMPatcher:
             logging.error(f"Failed to create backup: {e}")
             return False, str(e)
     
-    def apply_patch(self, esm_path: str, patch_info: dict, progress_callback=None) -> Tuple[bool, str]:
-        """Apply the xdelta3 patch to the ESM file"""
+    def create_delta_backup(self, esm_path: str, patch_info: dict) -> str:
+        """Store a reverse delta from the patched file back to esm_path
+        
+        Uses the reverse delta the manifest ships for this variant when
+        there is one, otherwise inverts the patch locally. The backup is
+        written as pending; apply_patch() checks it against the patched
+        file and promotes it when it commits. Returns the delta's path.
+        """
+        digests = self.compute_digests(esm_path)
+        chain = patch_info.get("chain") or [patch_info["patch"]]
+        shipped = patch_info.get("reverse_patch")
+        delta = None
+        if shipped and os.path.exists(shipped):
+            with open(shipped, "rb") as f:
+                delta = f.read()
+            expected = patch_info.get("reverse_patch_sha256")
+            if expected and hashlib.sha256(delta).hexdigest() != expected.lower():
+                logging.warning(f"Shipped reverse delta {os.path.basename(shipped)} is damaged; rebuilding it")
+                delta = None
+        from_manifest = delta is not None
+        if delta is None:
+            logging.info(f"Building reverse delta for {esm_path}")
+            delta = reverse_delta.build_reverse_delta(esm_path, chain)
+        
+        info = {
+            "variant": patch_info.get("variant"),
+            "original_size": os.path.getsize(esm_path),
+            "original_md5": digests["md5"],
+            "original_sha256": digests["sha256"],
+            "target_size": patch_info.get("target_size"),
+            "shipped": from_manifest,
+        }
+        delta_path = reverse_delta.write_backup(esm_path, delta, info, pending=True)
+        logging.info(f"Reverse-delta backup (pending): {delta_path} ({len(delta):,} bytes)")
+        return delta_path
+    
+    def check_delta_backup(self, esm_path: str, patched_path: str, patch_info: dict) -> Tuple[bool, str]:
+        """Make sure the reverse-delta backup rebuilds the original from patched_path
+        
+        A shipped delta that doesn't is replaced by one built locally from
+        the original, which is still in place at this point.
+        """
+        for attempt in range(2):
+            info = reverse_delta.read_backup_info(esm_path, pending=True)
+            if info is None:
+                return False, "Reverse-delta backup is missing or unreadable"
+            success, error_msg = self.rebuild_original(esm_path, patched_path, info, pending=True)
+            if success:
+                return True, ""
+            if attempt or not info.get("shipped"):
+                break
+            logging.warning(f"Shipped reverse delta does not match this ESM ({error_msg}); rebuilding it")
+            chain = patch_info.get("chain") or [patch_info["patch"]]
+            delta = reverse_delta.build_reverse_delta(esm_path, chain)
+            reverse_delta.write_backup(esm_path, delta, dict(info, shipped=False), pending=True)
+        return False, f"Reverse-delta backup would not restore the original: {error_msg}"
+    
+    def rebuild_original(self, esm_path: str, patched_path: str, info: dict, output=None,
+                         progress_callback=None, pending: bool = False) -> Tuple[bool, str]:
+        """Decode the reverse-delta backup of esm_path against patched_path
+        
+        Writes the original to output (a writable object) if given and
+        checks its size and strongest recorded digest against the backup's
+        info, hashed as it is decoded in a single pass. pending selects a
+        backup that apply_patch() hasn't promoted yet.
+        """
+        delta_path = reverse_delta.backup_paths(esm_path, pending)[0]
+        names = [name for name in ("sha256", "md5") if info.get(f"original_{name}")][:1]
+        hasher = fingerprint.MultiHasher(names)
+        try:
+            if output is None:
+                size = vcdiff.decode_into(patched_path, delta_path, hasher, progress_callback)
+            else:
+                size = vcdiff.decode_into(patched_path, delta_path, output, progress_callback, hasher)
+        except vcdiff.VCDIFFError as e:
+            return False, str(e)
+        digests = hasher.hexdigests()
+        if size != info.get("original_size"):
+            return False, f"rebuilt {size:,} bytes, expected {info.get('original_size'):,}"
+        for name in names:
+            value = info[f"original_{name}"]
+            if digests[name] != value.lower():
+                return False, f"{name.upper()} mismatch ({digests[name]}, expected {value})"
+        return True, ""
+    
+    def move_to_backup(self, esm_path: str, backup_path: str):
+        """Turn the original ESM into the backup without copying it
+        
+        The original is hard-linked to backup_path when the filesystem
+        allows it, so esm_path keeps existing until apply_patch() swaps the
+        patched file in; otherwise it is renamed. Either way it is O(1), and
+        a journal next to the ESM lets recover_interrupted_patch() roll back
+        if the patch never commits.
+        """
+        with open(esm_path + ".patching", "w", encoding="utf-8") as f:
+            json.dump({"backup": backup_path, "temp": esm_path + ".patched"}, f)
+        
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        
+        try:
+            os.link(esm_path, backup_path)
+        except OSError:
+            os.replace(esm_path, backup_path)
+    
+    def lock_patch(self, esm_path: str) -> Optional[checkpoint.PatchLock]:
+        """Lock esm_path for a patch or restore; None if another job or process holds it
+        
+        Release the returned lock once the ESM has been committed or rolled back.
+        """
+        lock = checkpoint.PatchLock(esm_path)
+        return lock if lock.acquire() else None
+    
+    def recover_interrupted_patch(self, esm_path: str) -> Optional[str]:
+        """Roll back a rename-backup patch that didn't commit
+        
+        Does nothing while a patch of esm_path is running in another job
+        or process. Returns a message when something was recovered, else None.
+        """
+        if not self.has_interrupted_patch(esm_path):
+            return None
+        lock = self.lock_patch(esm_path)
+        if lock is None:
+            logging.info(f"Not recovering {esm_path}: a patch or restore of it is running")
+            return None
         try:
-            patch_path = os.path.join(self.assets_dir, patch_info["patch"])
-            temp_output = esm_path + ".patched"
-            
-            # Build xdelta3 command
-            cmd = [
-                self.xdelta_path,
-                "-f",  # Force overwrite
-                "-d",  # Decode
-                "-s", esm_path,  # Source file
-                patch_path,  # Patch file
-                temp_output  # Output file
-            ]
+            return self.roll_back_patch(esm_path)
+        finally:
+            lock.release()
+    
+    def has_interrupted_patch(self, esm_path: str) -> bool:
+        """Whether a patch of esm_path was started and has not committed or been rolled back"""
+        return os.path.exists(esm_path + ".patching") or reverse_delta.has_backup(esm_path, pending=True)
+    
+    def roll_back_patch(self, esm_path: str) -> Optional[str]:
+        """recover_interrupted_patch() for a caller that holds the patch lock"""
+        # A reverse-delta backup is only promoted when its patch commits
+        if reverse_delta.discard_backup(esm_path, pending=True):
+            logging.info(f"Removed the reverse-delta backup of an uncommitted patch of {esm_path}")
+        
+        journal_path = esm_path + ".patching"
+        if not os.path.exists(journal_path):
+            return None
+        
+        try:
+            with open(journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            journal = {}
+        backup_path = journal.get("backup", esm_path + ".backup")
+        temp_output = journal.get("temp", esm_path + ".patched")
+        
+        # A journaled partial output is kept for the next attempt to resume
+        resumable = checkpoint.has_journal(temp_output)
+        if os.path.exists(temp_output) and not resumable:
+            os.remove(temp_output)
+        
+        if not os.path.exists(esm_path) and os.path.exists(backup_path):
+            os.replace(backup_path, esm_path)
+            self.backup_created = False
+            message = f"Restored original ESM from {os.path.basename(backup_path)} after an interrupted patch"
+        else:
+            message = "Cleaned up after an interrupted patch"
+        if resumable:
+            message += "; the partial patch output was kept to resume from"
+        
+        os.remove(journal_path)
+        logging.warning(message)
+        return message
+    
+    def apply_patch(self, esm_path: str, patch_info: dict, progress_callback=None,
+                    engine: Optional[str] = None, source_path: Optional[str] = None) -> Tuple[bool, str]:
+        """Apply the xdelta3 patch to the ESM file
+        
+        The patch is decoded from source_path (default: esm_path itself,
+        pass the backup after a rename backup) into a temporary file that
+        atomically replaces esm_path once verified. On failure a rename
+        backup is rolled back. Callers hold lock_patch() from create_backup()
+        until this returns.
+        """
+        engine = self.resolve_engine(engine) if engine else self.engine
+        source_path = source_path or esm_path
+        temp_output = esm_path + ".patched"
+        
+        def fail(message: str) -> Tuple[bool, str]:
+            logging.error(message)
+            checkpoint.discard(temp_output)
+            self.roll_back_patch(esm_path)
+            return False, message
+        
+        try:
+            chain = patch_info.get("chain") or [patch_info["patch"]]
             
-            logging.info(f"Running command: {' '.join(cmd)}")
+            # Chains stream intermediates through memory, which only the
+            # built-in engine can do
+            if engine == "xdelta3" and len(chain) > 1:
+                logging.info(f"Using the built-in engine for patch chain {patch_info.get('route')}")
+                engine = "builtin"
             
             if progress_callback:
                 progress_callback(30, "Applying patch...")
             
-            # Run xdelta3
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
+            # The built-in engine hashes the output while writing it
+            hasher = None
+            if engine == "xdelta3":
+                success, error_msg = self.run_xdelta3(source_path, chain[0], temp_output,
+                                                      progress_callback, patch_info.get("target_size"))
+            else:
+                hasher = fingerprint.MultiHasher(self.digest_algorithms)
+                success, error_msg = self.run_builtin_decoder(source_path, chain, temp_output,
+                                                              progress_callback, hasher)
             
-            if result.returncode != 0:
-                error_msg = f"xdelta3 failed with return code {result.returncode}"
-                if result.stderr:
-                    error_msg += f"\nError: {result.stderr}"
-                logging.error(error_msg)
-                return False, error_msg
+            if not success:
+                return fail(error_msg)
             
             if progress_callback:
                 progress_callback(70, "Verifying patched file...")
             
-            # Verify the patched file exists and has reasonable size
+            # Verify the patched file before it replaces anything
             if not os.path.exists(temp_output):
-                return False, "Patched file was not created"
+                return fail("Patched file was not created")
             
+            digests = hasher.hexdigests() if hasher else None
+            success, error_msg, digests = self.verify_patched_output(temp_output, patch_info, digests)
+            if not success:
+                return fail(error_msg)
             patched_size = os.path.getsize(temp_output)
-            if patched_size < 50000000:  # Less than 50MB is definitely wrong
-                os.remove(temp_output)
-                return False, f"Patched file is too small ({patched_size} bytes)"
+            
+            if self.backup_strategy == "delta" and reverse_delta.has_backup(esm_path, pending=True):
+                if progress_callback:
+                    progress_callback(80, "Verifying backup...")
+                success, error_msg = self.check_delta_backup(esm_path, temp_output, patch_info)
+                if not success:
+                    return fail(error_msg)
             
             if progress_callback:
                 progress_callback(90, "Replacing original file...")
             
-            # Replace original with patched version
-            os.remove(esm_path)
-            os.rename(temp_output, esm_path)
+            # Atomically replace original with patched version
+            os.replace(temp_output, esm_path)
+            checkpoint.discard(temp_output)
+            if os.path.exists(esm_path + ".patching"):
+                os.remove(esm_path + ".patching")
             
-            logging.info(f"Patch applied successfully. New size: {patched_size:,} bytes")
+            # The patch has committed: from here on nothing may be rolled back
+            backup_warning = self.commit_delta_backup(esm_path)
             
-            return True, f"Patch applied successfully!\nNew file size: {patched_size:,} bytes ({patched_size/(1024*1024):.2f} MB)"
+            # Seed the fingerprint cache so re-analysis doesn't re-read the file
+            if digests and self.fingerprint_cache:
+                try:
+                    self.fingerprint_cache.put(os.stat(esm_path), esm_path, digests)
+                except OSError as e:
+                    logging.warning(f"Could not update fingerprint cache: {e}")
             
-        except subprocess.TimeoutExpired:
-            if os.path.exists(temp_output):
-                os.remove(temp_output)
-            return False, "Patching process timed out"
+            logging.info(f"Patch applied successfully. New size: {patched_size:,} bytes")
+            message = f"Patch applied successfully!\nNew file size: {patched_size:,} bytes ({patched_size/(1024*1024):.2f} MB)"
+            if not self.has_target_digest(patch_info):
+                logging.warning(self.NO_TARGET_DIGEST)
+                message += f"\n{self.NO_TARGET_DIGEST}"
+            if backup_warning:
+                message += f"\n{backup_warning}"
+            
+            return True, message
             
         except Exception as e:
-            if os.path.exists(temp_output):
-                os.remove(temp_output)
-            logging.error(f"Error applying patch: {e}")
+            return fail(f"Error applying patch: {e}")
+    
+    def commit_delta_backup(self, esm_path: str) -> Optional[str]:
+        """Promote the pending reverse-delta backup once the patch has committed
+        
+        The full backup it supersedes is removed. Returns a warning if the
+        backup couldn't be promoted, else None.
+        """
+        if not reverse_delta.has_backup(esm_path, pending=True):
+            return None
+        try:
+            delta_path = reverse_delta.promote_backup(esm_path)
+            if os.path.exists(esm_path + ".backup"):
+                os.remove(esm_path + ".backup")
+        except OSError as e:
+            logging.error(f"Could not finalize the reverse-delta backup: {e}")
+            return f"Warning: the backup could not be finalized ({e})"
+        logging.info(f"Reverse-delta backup: {delta_path}")
+        return None
+    
+    def verify_patched_output(self, output_path: str, patch_info: dict,
+                              digests: Optional[dict]) -> Tuple[bool, str, Optional[dict]]:
+        """Check a decoded file against the target size and digests of its patch
+        
+        digests are the output's digests gathered while it was written; if
+        the patch lists a target digest and none were gathered (external
+        engine), the file is hashed once here. Returns (ok, error, digests).
+        """
+        patched_size = os.path.getsize(output_path)
+        
+        expected = {
+            name: patch_info[f"target_{name}"]
+            for name in ("md5", "sha256")
+            if patch_info.get(f"target_{name}")
+        }
+        if expected and digests is None:
+            digests = fingerprint.fingerprint_file(output_path, self.digest_algorithms, self.hash_buffer_size)
+            digests.pop("size")
+        
+        success, error_msg = self.check_patch_result(patched_size, patch_info, digests)
+        return success, error_msg, digests
+    
+    @staticmethod
+    def has_target_digest(patch_info: dict) -> bool:
+        """Whether the manifest gives a digest to check the patch output against"""
+        return any(patch_info.get(f"target_{name}") for name in ("md5", "sha256"))
+    
+    def check_patch_result(self, patched_size: int, patch_info: dict,
+                           digests: Optional[dict]) -> Tuple[bool, str]:
+        """Compare a decoded size and digests with the patch's expected target"""
+        expected_size = patch_info.get("target_size")
+        if expected_size:
+            if patched_size != expected_size:
+                return False, f"Patched file has the wrong size ({patched_size:,} bytes, expected {expected_size:,})"
+        elif patched_size < 50000000:  # Less than 50MB is definitely wrong
+            return False, f"Patched file is too small ({patched_size} bytes)"
+        
+        for name in ("md5", "sha256"):
+            value = patch_info.get(f"target_{name}")
+            if value and digests[name] != value.lower():
+                return False, f"Patched file {name.upper()} mismatch ({digests[name]}, expected {value})"
+        
+        return True, ""
+    
+    def verify_patch(self, esm_path: str, patch_info: dict, progress_callback=None) -> Tuple[bool, str]:
+        """Dry run: decode a patch into a hashing sink without writing anything
+        
+        Checks every window's Adler32 plus the final size and digests
+        against the patch's expected target, at the cost of one sequential
+        read of the ESM and the patch; without a target digest in the
+        manifest the result says only size and checksums were verified.
+        Always uses the built-in engine.
+        """
+        chain = patch_info.get("chain") or [patch_info["patch"]]
+        hasher = fingerprint.MultiHasher(self.digest_algorithms)
+        names = ", ".join(os.path.basename(path) for path in chain)
+        logging.info(f"Dry run: decoding {names} against {esm_path}")
+        
+        def on_window(done: int, total: int):
+            if progress_callback and total:
+                progress_callback(
+                    int(100 * done / total),
+                    f"Verifying patch... {done / (1024 * 1024):.0f} / {total / (1024 * 1024):.0f} MB"
+                )
+        
+        try:
+            plans = self.load_decode_plans(chain)
+            patched_size = vcdiff.decode_into(esm_path, plans, hasher, on_window)
+        except vcdiff.VCDIFFError as e:
+            logging.error(f"Dry run failed: {e}")
+            return False, f"Patch would fail: {e}"
+        except OSError as e:
+            logging.error(f"Dry run failed: {e}")
             return False, str(e)
+        
+        digests = hasher.hexdigests()
+        success, error_msg = self.check_patch_result(patched_size, patch_info, digests)
+        if not success:
+            logging.error(f"Dry run failed: {error_msg}")
+            return False, f"Patch would fail: {error_msg}"
+        
+        logging.info(f"Dry run OK: {patched_size:,} bytes, sha256={digests['sha256']}")
+        message = (
+            f"Patch verified (dry run, nothing written)\n"
+            f"Patched size: {patched_size:,} bytes ({patched_size/(1024*1024):.2f} MB)\n"
+            f"Patched SHA-256: {digests['sha256']}"
+        )
+        if not self.has_target_digest(patch_info):
+            logging.warning(self.NO_TARGET_DIGEST)
+            message += f"\n{self.NO_TARGET_DIGEST}"
+        return True, message
+    
+    def run_xdelta3(self, esm_path: str, patch_path: str, output_path: str,
+                    progress_callback=None, expected_size: Optional[int] = None) -> Tuple[bool, str]:
+        """Decode a patch with the external xdelta3.exe
+        
+        There is no fixed timeout: a watchdog follows the output file and
+        xdelta3's verbose output, reports progress and kills the process
+        only once its throughput stalls (see stall_timeout).
+        """
+        if not os.path.exists(self.xdelta_path):
+            return False, "xdelta3.exe not found"
+        
+        # Build xdelta3 command
+        cmd = [
+            self.xdelta_path,
+            "-v",  # Report progress on stderr
+            "-f",  # Force overwrite
+            "-d",  # Decode
+            "-s", esm_path,  # Source file
+            patch_path,  # Patch file
+            output_path  # Output file
+        ]
+        
+        logging.info(f"Running command: {' '.join(cmd)}")
+        
+        def on_progress(done: int, total: Optional[int], rate: float):
+            # Map decode progress onto the 30-70% band of the patch step
+            if progress_callback and total:
+                progress_callback(
+                    30 + int(40 * min(done, total) / total),
+                    f"Applying patch... {done / (1024 * 1024):.0f} / {total / (1024 * 1024):.0f} MB "
+                    f"({rate / (1024 * 1024):.1f} MB/s)"
+                )
+        
+        watchdog = process_watch.ProcessWatchdog(
+            cmd, output_path, expected_size,
+            stall_timeout=self.stall_timeout,
+            min_throughput=self.STALL_MIN_THROUGHPUT,
+            progress_callback=on_progress,
+        )
+        try:
+            returncode = watchdog.run()
+        except process_watch.StallError as e:
+            return False, f"xdelta3 stalled and was stopped: {e}"
+        
+        if returncode != 0:
+            error_msg = f"xdelta3 failed with return code {returncode}"
+            if watchdog.stderr:
+                error_msg += f"\nError: {watchdog.stderr}"
+            return False, error_msg
+        
+        return True, ""
     
-    def restore_backup(self, esm_path: str) -> Tuple[bool, str]:
+    def run_builtin_decoder(self, esm_path: str, patch_path: Union[str, list], output_path: str,
+                            progress_callback=None, digest_sink=None) -> Tuple[bool, str]:
+        """Decode a patch in-process with the pure-Python VCDIFF decoder
+        
+        patch_path may be a chain of patches; intermediate results are
+        streamed through memory and only the final output is written.
+        digest_sink, if given, is fed the decoded output as it is written.
+        Serial decodes are journaled when the patcher is resumable.
+        """
+        chain = [patch_path] if isinstance(patch_path, str) else list(patch_path)
+        names = ", ".join(os.path.basename(path) for path in chain)
+        logging.info(f"Decoding {names} with the built-in VCDIFF engine")
+        
+        def on_window(done: int, total: int):
+            # Map decode progress onto the 30-70% band of the patch step
+            if progress_callback and total:
+                progress_callback(
+                    30 + int(40 * done / total),
+                    f"Applying patch... {done / (1024 * 1024):.0f} / {total / (1024 * 1024):.0f} MB"
+                )
+        
+        try:
+            plans = self.load_decode_plans(chain)
+            # Windows of a chained patch depend on the stream before them,
+            # so only single patches decode in parallel
+            if self.workers == 1 or len(chain) > 1:
+                if self.resumable:
+                    _, resumed = checkpoint.decode_resumable(esm_path, chain, plans, output_path,
+                                                             on_window, digest_sink)
+                    if resumed:
+                        logging.info(f"Resumed an interrupted patch at {resumed:,} bytes")
+                else:
+                    vcdiff.decode_file(esm_path, plans, output_path, on_window, digest_sink)
+            else:
+                vcdiff.decode_parallel(esm_path, plans[0], output_path,
+                                       self.workers or None, on_window, digest_sink)
+        except vcdiff.VCDIFFError as e:
+            return False, f"Built-in decoder failed: {e}"
+        
+        return True, ""
+    
+    def load_decode_plans(self, chain: list) -> list:
+        """Decode plans of a chain of patches, compiled once and cached by patch digest"""
+        started = time.perf_counter()
+        plans = decode_plan.load_plans(chain, use_cache=self.use_plan_cache)
+        logging.info(f"Decode plans ready in {time.perf_counter() - started:.2f}s "
+                     f"({sum(len(plan) for plan in plans):,} ops)")
+        return plans
+    
+    def restore_backup(self, esm_path: str, progress_callback=None) -> Tuple[bool, str]:
         """Restore the ESM file from backup"""
         backup_path = esm_path + ".backup"
         
         if not os.path.exists(backup_path):
+            if reverse_delta.has_backup(esm_path):
+                return self.restore_delta_backup(esm_path, progress_callback)
             return False, "No backup file found"
         
         try:
-            if os.path.exists(esm_path):
-                os.remove(esm_path)
-            shutil.copy2(backup_path, esm_path)
-            logging.info(f"Restored from backup: {backup_path}")
+            # Copied to a temporary name and swapped in, so a failed copy
+            # leaves the current ESM in place
+            method = fastcopy.copy_file(backup_path, esm_path, progress_callback)
+            logging.info(f"Restored from backup: {backup_path} (using {method})")
             return True, "Successfully restored from backup"
         except Exception as e:
             logging.error(f"Failed to restore backup: {e}")
             return False, str(e)
+    
+    def restore_delta_backup(self, esm_path: str, progress_callback=None) -> Tuple[bool, str]:
+        """Rebuild the original ESM from the patched one and its reverse delta"""
+        info = reverse_delta.read_backup_info(esm_path)
+        if info is None:
+            return False, "Reverse-delta backup is unreadable"
+        if not os.path.exists(esm_path):
+            return False, "The patched ESM is needed to restore from a reverse-delta backup"
+        
+        temp_output = esm_path + ".restoring"
+        try:
+            with open(temp_output, "wb") as out:
+                success, error_msg = self.rebuild_original(esm_path, esm_path, info, out, progress_callback)
+            if not success:
+                os.remove(temp_output)
+                logging.error(f"Failed to restore backup: {error_msg}")
+                return False, f"Backup does not match this ESM: {error_msg}"
+            os.replace(temp_output, esm_path)
+        except Exception as e:
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+            logging.error(f"Failed to restore backup: {e}")
+            return False, str(e)
+        
+        logging.info(f"Restored from reverse-delta backup: {reverse_delta.backup_paths(esm_path)[0]}")
+        return True, "Successfully restored from backup (rebuilt and verified from the reverse delta)"
 
 
 class PatcherGUI:
     """GUI for the ESM Patcher"""
     
-    def __init__(self):
-        self.patcher = ESMPatcher()
+    def __init__(self, engine: str = "auto", workers: int = 1, use_cache: bool = True,
+                 backup_strategy: str = "rename", resumable: bool = True,
+                 stall_timeout: float = process_watch.DEFAULT_STALL_TIMEOUT):
+        self.patcher = ESMPatcher(engine, workers, use_cache=use_cache, backup_strategy=backup_strategy,
+                                  resumable=resumable, stall_timeout=stall_timeout)
         self.selected_file = None
         self.patch_info = None
+        self.analysis_job = None
+        self.patch_job = None
         
         # Setup main window
         self.root = tk.Tk()
         self.root.title("Fallout 4 ESM Patcher v1.0")
         self.root.geometry("600x550")  # Increased height from 500 to 550
         self.root.resizable(False, False)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Hashing, copying and patching run in the background
+        self.jobs = jobs.JobEngine(self.root)
         
         # Set window icon if available
         try:
@@ -320,20 +1160,25 @@ class PatcherGUI:
         self.file_entry = tk.Entry(file_frame, font=("Arial", 10))
         self.file_entry.pack(side="left", fill="x", expand=True)
         
-        tk.Button(
+        browse_button = tk.Button(
             file_frame,
             text="Browse Folder",
             command=self.browse_folder,
             width=12
-        ).pack(side="right", padx=(5, 0))
+        )
+        browse_button.pack(side="right", padx=(5, 0))
         
         # Auto-detect button
-        tk.Button(
+        detect_button = tk.Button(
             main_frame,
             text="Auto-Detect Fallout 4 Installations",
             command=self.auto_detect,
             width=30
-        ).pack(pady=5)
+        )
+        detect_button.pack(pady=5)
+        
+        # Disabled while a patch or restore runs
+        self.selection_buttons = (browse_button, detect_button)
         
         # Status display with adjusted height
         tk.Label(main_frame, text="File Status:", font=("Arial", 12)).pack(anchor="w", pady=(10, 5))  # Reduced top padding
@@ -403,8 +1248,28 @@ class PatcherGUI:
             height=1  # Explicit height
         ).pack(side="left", padx=5)
     
+    def busy(self) -> bool:
+        """Whether a patch or restore is running; tells the user if so
+        
+        Selecting another file would start an analysis, and analysis rolls
+        back interrupted patches - which a running patch looks like.
+        """
+        if self.patch_job:
+            messagebox.showinfo("Operation In Progress", "Please wait for the current patch or restore to finish.")
+            return True
+        return False
+    
+    def set_selection_enabled(self, enabled: bool):
+        """Enable or disable the controls that select another file"""
+        state = "normal" if enabled else "disabled"
+        for button in self.selection_buttons:
+            button.config(state=state)
+    
     def browse_folder(self):
         """Browse for game folder and auto-detect Fallout4.esm"""
+        if self.busy():
+            return
+        
         folder_path = filedialog.askdirectory(
             title="Select Fallout 4 installation folder"
         )
@@ -422,7 +1287,8 @@ class PatcherGUI:
             ]
             
             for location in search_locations:
-                if os.path.exists(location):
+                # A journal means an interrupted patch moved the ESM aside
+                if os.path.exists(location) or os.path.exists(location + ".patching"):
                     esm_path = location
                     esm_found = True
                     break
@@ -441,6 +1307,9 @@ class PatcherGUI:
     
     def browse_file(self):
         """Legacy browse for ESM file directly (kept for compatibility)"""
+        if self.busy():
+            return
+        
         file_path = filedialog.askopenfilename(
             title="Select Fallout4.esm",
             filetypes=[("ESM Files", "*.esm"), ("All Files", "*.*")]
@@ -452,59 +1321,175 @@ class PatcherGUI:
             self.analyze_file(file_path)
     
     def auto_detect(self):
-        """Auto-detect Fallout 4 installations"""
+        """Auto-detect Fallout 4 installations in the background"""
+        if self.busy():
+            return
+        
         self.status_text.delete(1.0, tk.END)
         self.status_text.insert(tk.END, "Searching for Fallout 4 installations...\n\n")
-        self.root.update()
-        
-        search_paths = [
-            r"C:\Program Files (x86)\Steam\steamapps\common\Fallout 4",
-            r"C:\Program Files (x86)\Steam\steamapps\common\Fallout 4 VR",
-            r"C:\Games\Fallout 4",
-            r"C:\Games\Fallout 4 VR",
-            r"D:\Steam\steamapps\common\Fallout 4",
-            r"D:\Steam\steamapps\common\Fallout 4 VR",
-            r"D:\SteamLibrary\steamapps\common\Fallout 4",
-            r"D:\SteamLibrary\steamapps\common\Fallout 4 VR",
-            r"C:\GOG Games\Fallout 4",
-            r"C:\Program Files (x86)\GOG Galaxy\Games\Fallout 4",
-        ]
         
-        found_files = []
+        use_cache = self.patcher.fingerprint_cache is not None
+        self.jobs.submit(
+            "discovery",
+            lambda job: discovery.find_installations(use_cache),
+            on_done=self.show_installations,
+            on_error=lambda e: self.status_text.insert(tk.END, f"Search failed: {e}\n"),
+        )
+    
+    def show_installations(self, installations):
+        """Show the result of auto_detect
         
-        for base_path in search_paths:
-            # Check both root and Data subfolder
-            for sub_path in ["", "Data"]:
-                full_path = os.path.join(base_path, sub_path) if sub_path else base_path
-                esm_path = os.path.join(full_path, "Fallout4.esm")
-                
-                if os.path.exists(esm_path):
-                    found_files.append(esm_path)
-                    self.status_text.insert(tk.END, f"Found: {esm_path}\n")
+        A single installation is analyzed directly; several are analyzed
+        side by side and shown in a table to pick from.
+        """
+        for item in installations:
+            self.status_text.insert(tk.END, f"Found ({item.game}, {item.source}): {item.esm_path}\n")
         
-        if found_files:
-            self.status_text.insert(tk.END, f"\nFound {len(found_files)} installation(s)\n")
-            if len(found_files) == 1:
-                self.file_entry.delete(0, tk.END)
-                self.file_entry.insert(0, found_files[0])
-                self.analyze_file(found_files[0])
-            else:
-                self.status_text.insert(tk.END, "\nMultiple installations found. Analyzing first one...")
-                self.file_entry.delete(0, tk.END)
-                self.file_entry.insert(0, found_files[0])
-                self.analyze_file(found_files[0])
-        else:
+        if not installations:
             self.status_text.insert(tk.END, "\nNo Fallout 4 installations found.\nPlease browse manually using 'Browse Folder'.")
+            return
+        
+        self.status_text.insert(tk.END, f"\nFound {len(installations)} installation(s)\n")
+        if len(installations) == 1:
+            self.file_entry.delete(0, tk.END)
+            self.file_entry.insert(0, installations[0].esm_path)
+            self.analyze_file(installations[0].esm_path)
+            return
+        
+        self.status_text.insert(tk.END, "\nAnalyzing all installations...\n")
+        if self.analysis_job:
+            self.analysis_job.cancel()
+        paths = [item.esm_path for item in installations]
+        games = {item.esm_path: item.game for item in installations}
+        
+        def work(job: jobs.Job):
+            return self.patcher.analyze_installations(
+                paths, progress_callback=job.byte_progress(0, 100, "Hashing... {done_mb:.0f} / {total_mb:.0f} MB")
+            )
+        
+        def done(rows):
+            for row in rows:
+                row["game"] = games.get(row["path"])
+            self.update_progress(100, "Analysis complete")
+            self.show_installation_table(rows)
+        
+        self.analysis_job = self.jobs.submit(
+            "installations",
+            work,
+            on_progress=self.update_progress,
+            on_done=done,
+            on_error=lambda e: self.status_text.insert(tk.END, f"Analysis failed: {e}\n")
+        )
+    
+    def show_installation_table(self, rows: list):
+        """Window with a sortable table of analyzed installations
+        
+        Clicking a heading sorts by that column (again to reverse);
+        double-clicking a row, or "Use Selected", selects that file.
+        """
+        window = tk.Toplevel(self.root)
+        window.title("Fallout 4 Installations")
+        window.geometry("900x300")
+        window.transient(self.root)
+        
+        frame = tk.Frame(window, padx=10, pady=10)
+        frame.pack(fill="both", expand=True)
+        
+        columns = [key for key, _ in INSTALL_COLUMNS]
+        tree = ttk.Treeview(frame, columns=columns, show="headings", selectmode="browse")
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        widths = {"status": 90, "game": 100, "variant": 130, "size": 80, "md5": 240, "path": 400}
+        sort_state = {"key": "status", "reverse": False}
+        
+        def fill():
+            tree.delete(*tree.get_children())
+            for row in sort_installations(rows, sort_state["key"], sort_state["reverse"]):
+                tree.insert("", tk.END, iid=row["path"],
+                            values=[format_installation_cell(row, key) for key in columns])
+        
+        def sort_by(key: str):
+            sort_state["reverse"] = not sort_state["reverse"] if sort_state["key"] == key else False
+            sort_state["key"] = key
+            fill()
+        
+        def use_selected(event=None):
+            selection = tree.selection()
+            if not selection or self.busy():
+                return
+            window.destroy()
+            self.file_entry.delete(0, tk.END)
+            self.file_entry.insert(0, selection[0])
+            self.analyze_file(selection[0])
+        
+        for key, heading in INSTALL_COLUMNS:
+            tree.heading(key, text=heading, command=lambda key=key: sort_by(key))
+            tree.column(key, width=widths[key], anchor="w")
+        tree.bind("<Double-1>", use_selected)
+        fill()
+        
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        
+        tk.Button(
+            window,
+            text="Use Selected",
+            command=use_selected,
+            font=("Arial", 10),
+            padx=15
+        ).pack(pady=(0, 10))
     
     def analyze_file(self, file_path: str):
-        """Analyze the selected ESM file"""
+        """Analyze the selected ESM file in the background
+        
+        A new selection cancels an analysis that is still running. Nothing
+        is analyzed while a patch or restore runs.
+        """
+        if self.busy():
+            return
+        
+        if self.analysis_job:
+            self.analysis_job.cancel()
+        
         self.status_text.delete(1.0, tk.END)
+        self.status_text.insert(tk.END, f"Analyzing {file_path}...\n")
         self.selected_file = file_path
+        self.patch_info = None
+        self.patch_button.config(state="disabled")
+        
+        self.analysis_job = self.jobs.submit(
+            "analysis",
+            lambda job: self.run_analysis(job, file_path),
+            on_progress=self.update_progress,
+            on_done=lambda result: self.show_analysis(file_path, *result),
+            on_error=lambda e: self.analysis_failed(file_path, e)
+        )
+    
+    def run_analysis(self, job: jobs.Job, file_path: str):
+        """Worker side of analyze_file()"""
+        # Roll back a patch that was interrupted before it committed
+        recovered = self.patcher.recover_interrupted_patch(file_path)
+        
+        # Stat, header and size triage are cheap; the hash is the only full read
+        analysis = self.patcher.analyze(file_path)
+        if not analysis.exists:
+            return recovered, analysis, None
         
-        # Get file info
-        file_info = self.patcher.get_file_info(file_path)
+        identification = self.patcher.identify_esm_version(analysis)
+        analysis.digests(job.byte_progress(0, 100, "Hashing... {done_mb:.0f} / {total_mb:.0f} MB"))
+        return recovered, analysis, identification
+    
+    def show_analysis(self, file_path: str, recovered: Optional[str], analysis: ESMAnalysis,
+                      identification: Optional[Tuple[bool, str, Optional[dict]]]):
+        """Display the result of an analysis"""
+        self.analysis_job = None
+        self.update_progress(0, "")
+        self.status_text.delete(1.0, tk.END)
+        
+        if recovered:
+            self.status_text.insert(tk.END, f"⚠ {recovered}\n\n")
         
-        if not file_info["exists"]:
+        if not analysis.exists:
             self.status_text.insert(tk.END, "ERROR: File does not exist!")
             self.patch_button.config(state="disabled")
             return
@@ -512,44 +1497,56 @@ class PatcherGUI:
         # Display file info
         self.status_text.insert(tk.END, f"File: {os.path.basename(file_path)}\n")
         self.status_text.insert(tk.END, f"Path: {os.path.dirname(file_path)}\n")
-        self.status_text.insert(tk.END, f"Size: {file_info['size']:,} bytes ({file_info['size_mb']:.2f} MB)\n")
-        self.status_text.insert(tk.END, f"MD5: {file_info['md5']}\n\n")
+        self.status_text.insert(tk.END, f"Size: {analysis.size:,} bytes ({analysis.size_mb:.2f} MB)\n")
+        if analysis.header:
+            self.status_text.insert(tk.END, f"Header: {analysis.header.describe()}\n")
+        self.status_text.insert(tk.END, f"MD5: {analysis.md5}\n\n")
         
         # Check if patching is needed
-        needs_patch, status_msg, patch_info = self.patcher.identify_esm_version(file_path)
+        needs_patch, status_msg, patch_info = identification
         
         self.status_text.insert(tk.END, f"Status: {status_msg}\n")
         
-        if needs_patch:
+        if needs_patch and not self.patch_job:
             self.patch_info = patch_info
             self.status_text.insert(tk.END, f"\n✓ This file can be patched for VR compatibility\n")
             self.status_text.insert(tk.END, f"Patch to apply: {patch_info['description']}\n")
+            if len(patch_info["chain"]) > 1:
+                self.status_text.insert(tk.END, f"Patch chain: {patch_info['route']}\n")
             self.patch_button.config(state="normal")
         else:
-            self.patch_info = None
+            self.patch_info = patch_info if needs_patch else None
             self.patch_button.config(state="disabled")
-            if "Already patched" in status_msg:
+            if analysis.status == "compatible":
                 self.status_text.insert(tk.END, "\n✓ This file is already VR-compatible!\n")
-            elif "Unknown" in status_msg:
+            elif analysis.status == "unsupported":
                 self.status_text.insert(tk.END, "\n⚠ Unknown file version - cannot patch\n")
         
         # Check for backup
-        backup_path = file_path + ".backup"
-        if os.path.exists(backup_path):
+        backup_path = self.patcher.find_backup(file_path)
+        if backup_path:
             self.status_text.insert(tk.END, f"\n📁 Backup found: {os.path.basename(backup_path)}")
-            self.restore_button.config(state="normal")
+            if not self.patch_job:
+                self.restore_button.config(state="normal")
         else:
             self.restore_button.config(state="disabled")
     
+    def analysis_failed(self, file_path: str, error: BaseException):
+        """Report an analysis that raised"""
+        self.analysis_job = None
+        self.update_progress(0, "")
+        logging.error(f"Failed to analyze {file_path}: {error}")
+        self.status_text.delete(1.0, tk.END)
+        self.status_text.insert(tk.END, f"ERROR: Could not analyze file:\n{error}")
+    
     def update_progress(self, value: int, text: str):
         """Update progress bar and label"""
         self.progress_var.set(value)
         self.progress_label.config(text=text)
-        self.root.update()
     
     def apply_patch(self):
-        """Apply the patch to the selected file"""
-        if not self.selected_file or not self.patch_info:
+        """Apply the patch to the selected file in the background"""
+        if not self.selected_file or not self.patch_info or self.patch_job:
             return
         
         result = messagebox.askyesno(
@@ -560,75 +1557,152 @@ class PatcherGUI:
         if not result:
             return
         
+        # Ask about an existing backup here: the worker can't show dialogs
+        backup_path = self.patcher.find_backup(self.selected_file)
+        if backup_path:
+            overwrite = messagebox.askyesno(
+                "Backup Exists",
+                f"A backup already exists at:\n{backup_path}\n\nOverwrite it?"
+            )
+            if not overwrite:
+                return
+        
         # Disable buttons during patching
         self.patch_button.config(state="disabled")
         self.restore_button.config(state="disabled")
+        self.set_selection_enabled(False)
         
-        try:
-            # Create backup
-            self.update_progress(10, "Creating backup...")
-            success, backup_msg = self.patcher.create_backup(self.selected_file)
-            
-            if not success:
-                messagebox.showerror("Backup Failed", f"Failed to create backup:\n{backup_msg}")
-                return
-            
-            # Apply patch
-            success, patch_msg = self.patcher.apply_patch(
-                self.selected_file,
-                self.patch_info,
-                self.update_progress
-            )
-            
-            self.update_progress(100, "Complete!")
-            
-            if success:
-                messagebox.showinfo("Success", patch_msg)
-                # Re-analyze the file to show new status
-                self.analyze_file(self.selected_file)
-            else:
-                messagebox.showerror("Patch Failed", f"Failed to apply patch:\n{patch_msg}")
+        esm_path = self.selected_file
+        patch_info = self.patch_info
+        
+        def work(job: jobs.Job):
+            lock = self.patcher.lock_patch(esm_path)
+            if lock is None:
+                return "backup", False, "Another patch or restore of this file is running"
+            try:
+                # Create backup
+                job.progress(10, "Creating backup...")
+                success, backup_msg = self.patcher.create_backup(
+                    esm_path,
+                    overwrite=True,
+                    progress_callback=job.byte_progress(10, 30, "Creating backup... {done_mb:.0f} / {total_mb:.0f} MB"),
+                    patch_info=patch_info
+                )
+                if not success:
+                    return "backup", False, backup_msg
                 
-                # Offer to restore backup
-                if self.patcher.backup_created:
-                    restore = messagebox.askyesno(
-                        "Restore Backup?",
-                        "Would you like to restore the original file from backup?"
-                    )
-                    if restore:
-                        self.restore_backup()
+                # Apply patch, decoding from the backup we just made
+                success, patch_msg = self.patcher.apply_patch(
+                    esm_path,
+                    patch_info,
+                    job.progress,
+                    source_path=self.patcher.patch_source(esm_path, backup_msg)
+                )
+                return "patch", success, patch_msg
+            finally:
+                lock.release()
         
-        finally:
-            # Reset progress
-            self.update_progress(0, "")
+        self.patch_job = self.jobs.submit(
+            "patch",
+            work,
+            on_progress=self.update_progress,
+            on_done=lambda result: self.patch_finished(esm_path, *result),
+            on_error=lambda e: self.patch_finished(esm_path, "patch", False, str(e))
+        )
+    
+    def patch_finished(self, esm_path: str, stage: str, success: bool, message: str):
+        """Report the outcome of a patch job"""
+        self.patch_job = None
+        self.set_selection_enabled(True)
+        self.update_progress(100 if success else 0, "Complete!" if success else "")
+        
+        if stage == "backup":
+            messagebox.showerror("Backup Failed", f"Failed to create backup:\n{message}")
+        elif success:
+            messagebox.showinfo("Success", message)
+        else:
+            messagebox.showerror("Patch Failed", f"Failed to apply patch:\n{message}")
             
-            # Re-enable buttons as appropriate
-            if self.patch_info:
-                self.patch_button.config(state="normal")
-            if os.path.exists(self.selected_file + ".backup"):
-                self.restore_button.config(state="normal")
+            # Offer to restore backup
+            if self.patcher.backup_created and self.patcher.find_backup(esm_path):
+                restore = messagebox.askyesno(
+                    "Restore Backup?",
+                    "Would you like to restore the original file from backup?"
+                )
+                if restore:
+                    self.restore_backup(esm_path, confirm=False)
+                    return
+        
+        # Reset progress and re-analyze the file to show its new status
+        self.update_progress(0, "")
+        if self.selected_file == esm_path:
+            self.analyze_file(esm_path)
     
-    def restore_backup(self):
-        """Restore from backup"""
-        if not self.selected_file:
+    def restore_backup(self, esm_path: Optional[str] = None, confirm: bool = True):
+        """Restore from backup in the background"""
+        esm_path = esm_path or self.selected_file
+        if not esm_path or self.patch_job:
             return
         
-        result = messagebox.askyesno(
-            "Confirm Restore",
-            f"This will restore the original file from backup.\n\nContinue?"
-        )
+        if confirm:
+            result = messagebox.askyesno(
+                "Confirm Restore",
+                f"This will restore the original file from backup.\n\nContinue?"
+            )
+            
+            if not result:
+                return
         
-        if not result:
-            return
+        self.patch_button.config(state="disabled")
+        self.restore_button.config(state="disabled")
+        self.set_selection_enabled(False)
+        
+        def work(job: jobs.Job):
+            lock = self.patcher.lock_patch(esm_path)
+            if lock is None:
+                return False, "A patch or restore of this file is running"
+            try:
+                return self.patcher.restore_backup(
+                    esm_path,
+                    job.byte_progress(0, 100, "Restoring backup... {done_mb:.0f} / {total_mb:.0f} MB")
+                )
+            finally:
+                lock.release()
         
-        success, msg = self.patcher.restore_backup(self.selected_file)
+        self.patch_job = self.jobs.submit(
+            "restore",
+            work,
+            on_progress=self.update_progress,
+            on_done=lambda result: self.restore_finished(esm_path, *result),
+            on_error=lambda e: self.restore_finished(esm_path, False, str(e))
+        )
+    
+    def restore_finished(self, esm_path: str, success: bool, msg: str):
+        """Report the outcome of a restore job"""
+        self.patch_job = None
+        self.set_selection_enabled(True)
+        self.update_progress(0, "")
         
         if success:
             messagebox.showinfo("Success", msg)
-            # Re-analyze the file
-            self.analyze_file(self.selected_file)
         else:
             messagebox.showerror("Restore Failed", f"Failed to restore backup:\n{msg}")
+        
+        # Re-analyze the file
+        if self.selected_file == esm_path:
+            self.analyze_file(esm_path)
+    
+    def on_close(self):
+        """Cancel background work and close the window"""
+        if self.patch_job:
+            if not messagebox.askyesno(
+                "Operation In Progress",
+                "A patch or restore is still running.\n\n"
+                "Cancel it and quit? An unfinished patch is rolled back."
+            ):
+                return
+        self.jobs.shutdown()
+        self.root.destroy()
     
     def show_help(self):
         """Show help dialog"""
@@ -680,54 +1754,380 @@ For more information, visit the Nexus Mods page.
         self.root.mainloop()
 
 
+def find_esm(input_path: str) -> Optional[str]:
+    """Resolve a .esm file or a game folder to its Fallout4.esm, if any"""
+    if os.path.isfile(input_path) and input_path.lower().endswith('.esm'):
+        return input_path
+    if os.path.isdir(input_path):
+        search_locations = [
+            os.path.join(input_path, "Fallout4.esm"),
+            os.path.join(input_path, "Data", "Fallout4.esm"),
+            os.path.join(input_path, "data", "Fallout4.esm"),
+        ]
+        for location in search_locations:
+            # A journal means an interrupted patch moved the ESM aside
+            if os.path.exists(location) or os.path.exists(location + ".patching"):
+                return location
+    return None
+
+
+# Reported by a dry run that finds a patch it may not roll back
+INTERRUPTED_PATCH_MESSAGE = "An interrupted patch has not been rolled back; run without --dry-run to recover it"
+
+
+def patch_target(patcher: ESMPatcher, input_path: str, dry_run: bool = False,
+                 overwrite_backup: bool = False) -> dict:
+    """Identify and patch (or dry-run) one installation for batch mode
+    
+    Never prompts; returns a result dict for the batch summary.
+    """
+    esm_path = find_esm(input_path)
+    if not esm_path:
+        return {"target": input_path, "status": "not_found",
+                "message": "Fallout4.esm not found"}
+    
+    result = {"target": input_path, "esm": esm_path}
+    if dry_run:
+        # A dry run changes nothing, not even to repair an earlier patch
+        if patcher.has_interrupted_patch(esm_path):
+            result.update(status="interrupted", message=INTERRUPTED_PATCH_MESSAGE)
+            return result
+    else:
+        recovered = patcher.recover_interrupted_patch(esm_path)
+        if recovered:
+            result["recovered"] = recovered
+    
+    analysis = patcher.analyze(esm_path)
+    needs_patch, status_msg, patch_info = patcher.identify_esm_version(analysis)
+    if not needs_patch:
+        result.update(status=analysis.status, message=status_msg)
+        return result
+    result["variant"] = patch_info["description"]
+    
+    if dry_run:
+        success, message = patcher.verify_patch(esm_path, patch_info)
+        result.update(status="verified" if success else "failed", message=message)
+        return result
+    
+    # Held until the patch has committed or been rolled back
+    lock = patcher.lock_patch(esm_path)
+    if lock is None:
+        result.update(status="failed", message="Another patch or restore of this ESM is running")
+        return result
+    try:
+        return patch_locked_target(patcher, esm_path, patch_info, result, overwrite_backup)
+    finally:
+        lock.release()
+
+
+def patch_locked_target(patcher: ESMPatcher, esm_path: str, patch_info: dict, result: dict,
+                        overwrite_backup: bool) -> dict:
+    """Back up and patch esm_path for patch_target() once its patch lock is held"""
+    success, backup_msg = patcher.create_backup(esm_path, overwrite=overwrite_backup, patch_info=patch_info)
+    if not success:
+        if backup_msg == "Backup cancelled by user":
+            backup_msg = "A backup already exists (use --overwrite-backup)"
+        result.update(status="failed", message=f"Backup failed: {backup_msg}")
+        return result
+    result["backup"] = backup_msg
+    
+    success, patch_msg = patcher.apply_patch(esm_path, patch_info,
+                                             source_path=patcher.patch_source(esm_path, backup_msg))
+    result.update(status="patched" if success else "failed", message=patch_msg)
+    return result
+
+
+# Columns of the installation table: (row key, heading)
+INSTALL_COLUMNS = (
+    ("status", "Status"),
+    ("game", "Game"),
+    ("variant", "Variant"),
+    ("size", "Size"),
+    ("md5", "MD5"),
+    ("path", "Path"),
+)
+
+
+def sort_installations(rows: list, key: str = "status", reverse: bool = False) -> list:
+    """Sort installation rows by one column; empty cells sort last"""
+    present = [row for row in rows if row.get(key) is not None]
+    empty = [row for row in rows if row.get(key) is None]
+    return sorted(present, key=lambda row: row[key], reverse=reverse) + empty
+
+
+def format_installation_cell(row: dict, key: str) -> str:
+    value = row.get(key)
+    if value is None:
+        return "-"
+    if key == "size":
+        return f"{value / (1024 * 1024):.1f} MB"
+    if key == "path" and row.get("aliases"):
+        return f"{value} (+{len(row['aliases'])} link(s))"
+    return str(value)
+
+
+def format_installation_table(rows: list) -> str:
+    """Plain-text table of analyze_installations() rows"""
+    table = [[heading for _, heading in INSTALL_COLUMNS]]
+    table += [[format_installation_cell(row, key) for key, _ in INSTALL_COLUMNS] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(INSTALL_COLUMNS))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in table]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def run_scan(args) -> int:
+    """Scan mode: analyze every given or discovered installation and print a table"""
+    patcher = ESMPatcher(args.engine, args.jobs, use_cache=not args.no_cache,
+                         backup_strategy=args.backup, resumable=not args.no_resume,
+                         stall_timeout=args.stall_timeout)
+    
+    games = {}
+    if args.paths or args.manifest:
+        paths = []
+        for target in batch.expand_targets(args.paths, args.manifest or ()):
+            esm_path = find_esm(target)
+            if esm_path:
+                paths.append(esm_path)
+            else:
+                print(f"Warning: Fallout4.esm not found in {target}", file=sys.stderr)
+    else:
+        print("Searching for Fallout 4 installations...", file=sys.stderr)
+        installations = discovery.find_installations(not args.no_cache)
+        paths = [item.esm_path for item in installations]
+        games = {item.esm_path: item.game for item in installations}
+    
+    if not paths:
+        print("No Fallout 4 installations found.", file=sys.stderr)
+        return 1
+    
+    print(f"Analyzing {len(paths)} installation(s)...", file=sys.stderr)
+    rows = patcher.analyze_installations(paths)
+    for row in rows:
+        row["game"] = games.get(row["path"])
+    rows = sort_installations(rows, args.sort, args.reverse)
+    
+    if args.summary:
+        batch.write_summary({"version": batch.SUMMARY_VERSION, "installations": rows}, args.summary)
+    else:
+        print(format_installation_table(rows))
+    return 0
+
+
+def run_batch(args) -> int:
+    """Batch mode: patch every target from the command line and manifests"""
+    targets = batch.expand_targets(args.paths, args.manifest or ())
+    if not targets:
+        print("Error: no targets to process", file=sys.stderr)
+        return 1
+    
+    patcher = ESMPatcher(args.engine, args.jobs, use_cache=not args.no_cache,
+                         backup_strategy=args.backup, resumable=not args.no_resume,
+                         stall_timeout=args.stall_timeout)
+    
+    # Checked once for the whole batch
+    deps_ok, deps_msg = patcher.verify_dependencies()
+    if not deps_ok:
+        print(f"Error: {deps_msg}", file=sys.stderr)
+        return 1
+    
+    def on_result(result: dict):
+        # Progress goes to stderr so the summary can be piped from stdout
+        message = result.get("message", "").split("\n", 1)[0]
+        print(f"[{result['status']}] {result['target']}: {message}", file=sys.stderr)
+    
+    print(f"Processing {len(targets)} target(s)...", file=sys.stderr)
+    runner = batch.BatchRunner(
+        lambda target: patch_target(patcher.clone(), target, args.dry_run, args.overwrite_backup),
+        max_workers=args.batch_workers,
+        per_device=args.io_per_device,
+        on_result=on_result,
+    )
+    summary = batch.summarize(runner.run(targets))
+    batch.write_summary(summary, args.summary or "-")
+    return 0 if summary["ok"] else 1
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """Build the command line parser"""
+    parser = argparse.ArgumentParser(
+        prog="esm_patcher.py",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=(
+            "Modes:\n"
+            "  GUI Mode: Run without arguments\n"
+            "  CLI Mode: esm_patcher.py <path_to_fallout4.esm_or_folder>\n"
+            "  Batch Mode: several paths, a glob pattern or --manifest; prints a\n"
+            "              JSON summary of every target\n"
+            "  Scan Mode: --scan [paths]; analyzes installations without patching\n"
+            "\nExamples:\n"
+            '  esm_patcher.py "C:\\Games\\Fallout 4"\n'
+            '  esm_patcher.py "C:\\Games\\Fallout 4\\Data\\Fallout4.esm"\n'
+            "  esm_patcher.py --engine builtin /srv/images/fo4/Data/Fallout4.esm\n"
+            '  esm_patcher.py --dry-run "C:\\Games\\Fallout 4"\n'
+            '  esm_patcher.py --manifest images.txt --summary results.json\n'
+            '  esm_patcher.py --scan --sort size\n'
+            '  esm_patcher.py "D:\\Images\\*\\Fallout 4" --batch-workers 8'
+        ),
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        metavar="path",
+        help="Fallout4.esm or the game folder containing it (omit to start the GUI); "
+             "several paths or glob patterns run in batch mode"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ESMPatcher.ENGINES,
+        default="auto",
+        help="patch engine: external xdelta3.exe or the built-in VCDIFF decoder "
+             "(default: auto, xdelta3.exe on Windows when available)"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="decode patch windows in N parallel processes with the built-in "
+             "engine (0 = one per CPU core, default: 1)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't read or update the persistent fingerprint and decode-plan caches"
+    )
+    parser.add_argument(
+        "--backup",
+        choices=ESMPatcher.BACKUP_STRATEGIES,
+        default="rename",
+        help="rename: keep the original as the backup via an O(1) hard link or "
+             "rename and decode from it; copy: full copy; delta: a reverse delta of "
+             "a few MB that rebuilds and verifies the original; building it and "
+             "decoding it once more to check it roughly doubles the patch time "
+             "(default: rename)"
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        type=float,
+        default=process_watch.DEFAULT_STALL_TIMEOUT,
+        metavar="SECONDS",
+        help="stop xdelta3.exe once it has made next to no progress for this long "
+             f"(default: {process_watch.DEFAULT_STALL_TIMEOUT:.0f})"
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="decode without a resume journal; an interrupted patch then starts over"
+    )
+    parser.add_argument(
+        "--dry-run", "--verify-only",
+        dest="dry_run",
+        action="store_true",
+        help="decode the patch against the ESM and check its checksums, size and "
+             "digest without writing anything or taking a backup"
+    )
+    parser.add_argument(
+        "--overwrite-backup",
+        action="store_true",
+        help="replace an existing backup of Fallout4.esm without asking"
+    )
+    
+    scan_group = parser.add_argument_group("scan mode")
+    scan_group.add_argument(
+        "--scan",
+        action="store_true",
+        help="analyze every given path, or every installation found on this "
+             "machine, in parallel and print a status table; changes nothing"
+    )
+    scan_group.add_argument(
+        "--sort",
+        choices=[key for key, _ in INSTALL_COLUMNS],
+        default="status",
+        help="table column to sort by (default: status)"
+    )
+    scan_group.add_argument(
+        "--reverse",
+        action="store_true",
+        help="sort in descending order"
+    )
+    
+    batch_group = parser.add_argument_group("batch mode")
+    batch_group.add_argument(
+        "--manifest",
+        action="append",
+        metavar="FILE",
+        help="read target paths from FILE, one per line (may be repeated)"
+    )
+    batch_group.add_argument(
+        "--batch-workers",
+        type=int,
+        default=4,
+        metavar="N",
+        help="process up to N targets at once (default: 4); decoding only overlaps "
+             "with --engine xdelta3 or --jobs other than 1, the in-process decoder "
+             "holds Python's interpreter lock"
+    )
+    batch_group.add_argument(
+        "--io-per-device",
+        type=int,
+        default=1,
+        metavar="N",
+        help="at most N targets at once on the same disk (default: 1)"
+    )
+    batch_group.add_argument(
+        "--summary",
+        metavar="FILE",
+        help="write the JSON result summary to FILE instead of stdout"
+    )
+    return parser
+
+
 def main():
     """Main entry point"""
     try:
+        parser = build_arg_parser()
+        args = parser.parse_args()
+        if args.jobs < 0:
+            parser.error("--jobs must be 0 or a positive number")
+        if args.batch_workers < 1 or args.io_per_device < 1:
+            parser.error("--batch-workers and --io-per-device must be at least 1")
+        if args.stall_timeout <= 0:
+            parser.error("--stall-timeout must be a positive number of seconds")
+        configure_logging()
+        
+        if args.scan:
+            sys.exit(run_scan(args))
+        
+        batch_mode = (
+            len(args.paths) > 1 or args.manifest or args.summary
+            or any(glob.has_magic(path) for path in args.paths)
+        )
+        if batch_mode:
+            sys.exit(run_batch(args))
+        
         # Check if running with command line arguments
-        if len(sys.argv) > 1:
-            # Command line mode
-            if sys.argv[1] == "--help" or sys.argv[1] == "-h":
-                print(__doc__)
-                print("\nUsage:")
-                print("  GUI Mode: Run without arguments")
-                print("  CLI Mode: esm_patcher.py <path_to_fallout4.esm_or_folder>")
-                print("  Help: esm_patcher.py --help")
-                print("\nExamples:")
-                print('  esm_patcher.py "C:\\Games\\Fallout 4"')
-                print('  esm_patcher.py "C:\\Games\\Fallout 4\\Data\\Fallout4.esm"')
-                sys.exit(0)
-            
+        if args.paths:
             # CLI patching mode
-            input_path = sys.argv[1]
-            esm_path = None
+            input_path = args.paths[0]
+            esm_path = find_esm(input_path)
             
-            # Check if it's a file or directory
-            if os.path.isfile(input_path) and input_path.lower().endswith('.esm'):
-                esm_path = input_path
+            if esm_path:
+                if os.path.isdir(input_path):
+                    print(f"Found Fallout4.esm at: {esm_path}")
             elif os.path.isdir(input_path):
-                # Search for Fallout4.esm in the directory
-                search_locations = [
-                    os.path.join(input_path, "Fallout4.esm"),
-                    os.path.join(input_path, "Data", "Fallout4.esm"),
-                    os.path.join(input_path, "data", "Fallout4.esm"),
-                ]
-                
-                for location in search_locations:
-                    if os.path.exists(location):
-                        esm_path = location
-                        print(f"Found Fallout4.esm at: {esm_path}")
-                        break
-                
-                if not esm_path:
-                    print(f"Error: Fallout4.esm not found in {input_path}")
-                    print("Please specify the game folder or the direct path to Fallout4.esm")
-                    sys.exit(1)
+                print(f"Error: Fallout4.esm not found in {input_path}")
+                print("Please specify the game folder or the direct path to Fallout4.esm")
+                sys.exit(1)
             else:
                 print(f"Error: Invalid path: {input_path}")
                 print("Please specify a folder or .esm file")
                 sys.exit(1)
             
-            patcher = ESMPatcher()
+            patcher = ESMPatcher(args.engine, args.jobs, use_cache=not args.no_cache,
+                                 backup_strategy=args.backup, resumable=not args.no_resume,
+                                 stall_timeout=args.stall_timeout)
             
             # Verify dependencies
             deps_ok, deps_msg = patcher.verify_dependencies()
@@ -735,38 +2135,68 @@ def main():
                 print(f"Error: {deps_msg}")
                 sys.exit(1)
             
+            # Roll back a patch that was interrupted before it committed;
+            # a dry run only reports it
+            if args.dry_run:
+                if patcher.has_interrupted_patch(esm_path):
+                    print(f"Status: {INTERRUPTED_PATCH_MESSAGE}")
+                    sys.exit(1)
+            else:
+                recovered = patcher.recover_interrupted_patch(esm_path)
+                if recovered:
+                    print(recovered)
+            
             # Analyze file
-            needs_patch, status_msg, patch_info = patcher.identify_esm_version(esm_path)
+            analysis = patcher.analyze(esm_path)
+            needs_patch, status_msg, patch_info = patcher.identify_esm_version(analysis)
             print(f"Status: {status_msg}")
             
             if not needs_patch:
-                if "compatible" in status_msg.lower():
+                if analysis.status == "compatible":
                     print("File is already compatible with mods!")
                 else:
                     print("File cannot be patched.")
                 sys.exit(0)
             
-            # Create backup
-            print("Creating backup...")
-            success, backup_msg = patcher.create_backup(esm_path)
-            if not success:
-                print(f"Backup failed: {backup_msg}")
-                sys.exit(1)
-            print(f"Backup created: {backup_msg}")
-            
-            # Apply patch
-            print("Applying patch...")
-            success, patch_msg = patcher.apply_patch(esm_path, patch_info)
+            if args.dry_run:
+                print("Verifying patch (dry run)...")
+                success, verify_msg = patcher.verify_patch(esm_path, patch_info)
+                print(verify_msg)
+                sys.exit(0 if success else 1)
             
-            if success:
-                print(f"Success! {patch_msg}")
-            else:
-                print(f"Patch failed: {patch_msg}")
+            # Held until the patch has committed or been rolled back
+            lock = patcher.lock_patch(esm_path)
+            if lock is None:
+                print("Error: another patch or restore of this ESM is running")
                 sys.exit(1)
+            try:
+                # Create backup
+                print("Creating backup...")
+                success, backup_msg = patcher.create_backup(esm_path, overwrite=True if args.overwrite_backup else None,
+                                                            patch_info=patch_info)
+                if not success:
+                    print(f"Backup failed: {backup_msg}")
+                    sys.exit(1)
+                print(f"Backup created: {backup_msg}")
+                
+                # Apply patch
+                print("Applying patch...")
+                success, patch_msg = patcher.apply_patch(esm_path, patch_info,
+                                                         source_path=patcher.patch_source(esm_path, backup_msg))
+                
+                if success:
+                    print(f"Success! {patch_msg}")
+                else:
+                    print(f"Patch failed: {patch_msg}")
+                    sys.exit(1)
+            finally:
+                lock.release()
         
         else:
             # GUI mode
-            app = PatcherGUI()
+            app = PatcherGUI(args.engine, args.jobs, use_cache=not args.no_cache,
+                             backup_strategy=args.backup, resumable=not args.no_resume,
+                             stall_timeout=args.stall_timeout)
             app.run()
     
     except KeyboardInterrupt:
@@ -779,4 +2209,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Required for the decode worker processes in the frozen executable
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
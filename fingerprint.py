@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+File fingerprinting
+Description: Single-pass multi-digest hashing of large ESM files
+
+Reads a file once with readinto() into a reusable buffer and feeds the
+same memoryview to every requested digest (MD5, SHA-256, CRC32 and a
+configurable fast hash), so identification, verification and logging all
+share one read of the file.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import xxhash  # Optional: much faster than any hashlib digest
+except ImportError:
+    xxhash = None
+
+# Digests computed by default; the last one is the "fast" hash
+DEFAULT_FAST_HASH = "blake2b"
+DEFAULT_ALGORITHMS = ("md5", "sha256", "crc32", DEFAULT_FAST_HASH)
+
+# Sampled fingerprints: header, trailer and this many evenly spaced blocks
+SAMPLE_BLOCKS = 16
+SAMPLE_BLOCK_SIZE = 16 * 1024
+
+# Read sizes: SSD/NVMe saturate well below 1 MiB per read, spinning disks
+# and network shares benefit from fewer, larger sequential requests
+SSD_BUFFER_SIZE = 1024 * 1024
+HDD_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+class _CRC32:
+    """hashlib-style wrapper around zlib.crc32"""
+
+    name = "crc32"
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f"{self.value & 0xFFFFFFFF:08x}"
+
+
+def new_digest(name: str):
+    """Create a digest object by name (hashlib, "crc32" or xxhash names)"""
+    if name == "crc32":
+        return _CRC32()
+    if name.startswith("xxh"):
+        if xxhash is None:
+            raise ValueError(f"{name} requires the optional 'xxhash' package")
+        return getattr(xxhash, name)()
+    return hashlib.new(name)
+
+
+class MultiHasher:
+    """Feeds each buffer to several digests at once"""
+
+    def __init__(self, algorithms: Iterable[str] = DEFAULT_ALGORITHMS):
+        self.digests = {name: new_digest(name) for name in algorithms}
+        self.size = 0
+
+    def update(self, data) -> None:
+        for digest in self.digests.values():
+            digest.update(data)
+        self.size += len(data)
+
+    def write(self, data) -> int:
+        """File-like alias for update() so the hasher can be used as a sink"""
+        self.update(data)
+        return len(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {name: digest.hexdigest() for name, digest in self.digests.items()}
+
+
+def is_rotational(path: str) -> Optional[bool]:
+    """Best-effort check whether path lives on a spinning disk
+
+    Returns None when the platform can't tell.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        st_dev = os.stat(path).st_dev
+        sys_dir = os.path.realpath(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}")
+        # Partitions don't have a queue directory; their parent disk does
+        for candidate in (sys_dir, os.path.dirname(sys_dir)):
+            flag = os.path.join(candidate, "queue", "rotational")
+            if os.path.exists(flag):
+                with open(flag) as f:
+                    return f.read().strip() == "1"
+    except OSError:
+        pass
+    return None
+
+
+def auto_buffer_size(path: str) -> int:
+    """Pick a read size suited to the device holding path"""
+    # UNC paths are network shares: favour large requests
+    if path.startswith("\\\\") or path.startswith("//"):
+        return HDD_BUFFER_SIZE
+    if is_rotational(path):
+        return HDD_BUFFER_SIZE
+    return SSD_BUFFER_SIZE
+
+
+def fingerprint_file(
+    path: str,
+    algorithms: Iterable[str] = DEFAULT_ALGORITHMS,
+    buffer_size: Union[int, str] = "auto",
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Union[int, str]]:
+    """Hash a file with every requested digest in a single pass
+
+    buffer_size is a byte count or "auto". Returns a dict with "size"
+    and one hex digest per algorithm name. progress_callback, if given, is
+    called as progress_callback(bytes_done, bytes_total) after each read.
+    """
+    if buffer_size == "auto":
+        buffer_size = auto_buffer_size(path)
+
+    hasher = MultiHasher(algorithms)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+
+    with open(path, "rb", buffering=0) as f:
+        total = os.fstat(f.fileno()).st_size
+        while True:
+            n = f.readinto(view)
+            if not n:
+                break
+            hasher.update(view[:n])
+            if progress_callback:
+                progress_callback(hasher.size, total)
+
+    result = {"size": hasher.size}
+    result.update(hasher.hexdigests())
+    return result
+
+
+def sample_offsets(size: int, blocks: int = SAMPLE_BLOCKS, block_size: int = SAMPLE_BLOCK_SIZE) -> List[int]:
+    """Offsets of the header, the trailer and blocks evenly spaced between"""
+    if size <= (blocks + 2) * block_size:
+        # Small file: sampling would read most of it anyway
+        return list(range(0, size, block_size))
+
+    last = size - block_size
+    return [0] + [last * i // (blocks + 1) for i in range(1, blocks + 1)] + [last]
+
+
+def _pread(fd: int, length: int, offset: int) -> bytes:
+    """os.pread, with a seek+read fallback for Windows"""
+    if hasattr(os, "pread"):
+        return os.pread(fd, length, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, length)
+
+
+def parse_sample_signature(signature: str) -> Tuple[str, int, int]:
+    """Return (algorithm, blocks, block_size) from a sampled signature"""
+    algorithm, layout, _ = signature.split(":", 2)
+    blocks, block_size = layout.split("x")
+    return algorithm, int(blocks), int(block_size)
+
+
+def sampled_fingerprint(
+    path: str,
+    blocks: int = SAMPLE_BLOCKS,
+    block_size: int = SAMPLE_BLOCK_SIZE,
+    algorithm: str = DEFAULT_FAST_HASH,
+) -> str:
+    """Hash a sparse sample of a file
+
+    Covers the file size, header, trailer and blocks evenly spaced blocks
+    of block_size bytes, read with positioned reads - a few hundred KB
+    instead of the whole file. The signature records its sampling
+    parameters ("algorithm:BLOCKSxSIZE:hexdigest") so stored values can be
+    recomputed the same way.
+    """
+    digest = new_digest(algorithm)
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        size = os.fstat(fd).st_size
+        digest.update(size.to_bytes(8, "little"))
+        for offset in sample_offsets(size, blocks, block_size):
+            digest.update(_pread(fd, block_size, offset))
+    finally:
+        os.close(fd)
+
+    return f"{algorithm}:{blocks}x{block_size}:{digest.hexdigest()}"
+
+
+def matches_sampled_fingerprint(path: str, signature: str) -> bool:
+    """Check a file against a stored sampled signature"""
+    algorithm, blocks, block_size = parse_sample_signature(signature)
+    return sampled_fingerprint(path, blocks, block_size, algorithm) == signature
+
+
+def default_cache_dir() -> str:
+    """Per-user cache directory for the patcher"""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(r"~\AppData\Local")
+        return os.path.join(base, "ESM_Patcher", "Cache")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/ESM_Patcher")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "esm_patcher")
+
+
+class FingerprintCache:
+    """Persistent digest cache keyed by file identity
+
+    Entries are keyed by (device, inode, size, mtime_ns) from os.stat(), so
+    an unchanged file is recognised with a single stat() and any rewrite of
+    it misses the cache. The cache is a small JSON file holding at most
+    max_entries entries, evicting the least recently used one.
+    """
+
+    VERSION = 1
+    FILENAME = "fingerprints.json"
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 64):
+        self.path = path or os.path.join(default_cache_dir(), self.FILENAME)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(stat: os.stat_result) -> str:
+        return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _load(self) -> "OrderedDict[str, dict]":
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                return OrderedDict(data.get("entries", []))
+        except (OSError, ValueError, TypeError):
+            pass
+        return OrderedDict()
+
+    def _save(self, entries: "OrderedDict[str, dict]") -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            # Stored as a list so the LRU order survives the round trip
+            json.dump({"version": self.VERSION, "entries": list(entries.items())}, f)
+        os.replace(temp_path, self.path)
+
+    def get(self, stat: os.stat_result, algorithms: Iterable[str]) -> Optional[Dict[str, str]]:
+        """Return cached digests if every requested algorithm is present"""
+        key = self.key(stat)
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is None or not all(name in entry["digests"] for name in algorithms):
+                return None
+
+            # Mark as most recently used
+            if next(reversed(entries)) != key:
+                entries.move_to_end(key)
+                try:
+                    self._save(entries)
+                except OSError:
+                    pass
+            return dict(entry["digests"])
+
+    def put(self, stat: os.stat_result, path: str, digests: Dict[str, str]) -> None:
+        """Store digests for a file, evicting the least recently used entries"""
+        key = self.key(stat)
+        with self._lock:
+            entries = self._load()
+            entry = entries.pop(key, {"digests": {}})
+            entry["path"] = path
+            entry["digests"].update(digests)
+            entries[key] = entry
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._save(entries)
+
+    def clear(self) -> None:
+        """Remove the cache file"""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Background jobs
+Description: Thread-pool job engine for keeping the Tk GUI responsive
+
+Long operations (hashing, copying, decoding) run on worker threads. They
+report progress and results through a queue that the Tk main loop drains
+with root.after(), so every widget update happens on the main thread.
+Jobs are cancelled cooperatively: the next progress report of a cancelled
+job raises JobCancelled inside the worker.
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's worker thread once the job has been cancelled"""
+
+
+class Job:
+    """Handle for one background task"""
+
+    def __init__(self, engine: "JobEngine", name: str,
+                 on_progress: Optional[Callable[[int, str], None]],
+                 on_done: Optional[Callable[[Any], None]],
+                 on_error: Optional[Callable[[BaseException], None]]):
+        self.engine = engine
+        self.name = name
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """Ask the job to stop; none of its callbacks will run afterwards"""
+        self._cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            # Never started, so no event will ever retire it
+            self.engine._jobs.discard(self)
+
+    def check_cancelled(self) -> None:
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"{self.name} cancelled")
+
+    def progress(self, value: int, text: str = "") -> None:
+        """Report progress as a 0-100 value (called from the worker)"""
+        self.check_cancelled()
+        self.engine._post("progress", self, (value, text))
+
+    def byte_progress(self, start: int, end: int, text: str) -> Callable[[int, int], None]:
+        """Build a (bytes_done, bytes_total) callback mapped onto start..end
+
+        text is formatted with done_mb, total_mb and percent.
+        """
+        def callback(done: int, total: int):
+            fraction = done / total if total else 1.0
+            self.progress(
+                start + int((end - start) * fraction),
+                text.format(done_mb=done / (1024 * 1024), total_mb=total / (1024 * 1024),
+                            percent=int(fraction * 100))
+            )
+        return callback
+
+
+class JobEngine:
+    """Runs jobs on a thread pool and dispatches their events on the Tk thread"""
+
+    def __init__(self, root, max_workers: int = 2, poll_interval_ms: int = 50):
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._events = queue.Queue()
+        self._jobs = set()
+        self._poll_id = self.root.after(self.poll_interval_ms, self._poll)
+
+    def submit(self, name: str, func: Callable[[Job], Any],
+               on_progress: Optional[Callable[[int, str], None]] = None,
+               on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None) -> Job:
+        """Run func(job) on a worker thread
+
+        on_progress(value, text), on_done(result) and on_error(exception)
+        are called on the Tk thread, and never for a cancelled job.
+        """
+        job = Job(self, name, on_progress, on_done, on_error)
+        self._jobs.add(job)
+        job.future = self._executor.submit(self._run, job, func)
+        return job
+
+    def _run(self, job: Job, func: Callable[[Job], Any]) -> None:
+        try:
+            result = func(job)
+        except JobCancelled:
+            self._post("cancelled", job, None)
+        except BaseException as e:
+            self._post("error", job, e)
+        else:
+            self._post("done", job, result)
+
+    def _post(self, kind: str, job: Job, payload) -> None:
+        self._events.put((kind, job, payload))
+
+    def _poll(self) -> None:
+        """Drain the event queue, then schedule the next poll"""
+        try:
+            self._dispatch()
+        finally:
+            self._poll_id = self.root.after(self.poll_interval_ms, self._poll)
+
+    def _dispatch(self) -> None:
+        """Deliver queued events; only the latest progress per job is shown"""
+        latest_progress: Dict[Job, Any] = {}
+        finished = []
+        try:
+            while True:
+                kind, job, payload = self._events.get_nowait()
+                if kind == "progress":
+                    latest_progress[job] = payload
+                else:
+                    finished.append((kind, job, payload))
+        except queue.Empty:
+            pass
+
+        for job, (value, text) in latest_progress.items():
+            if not job.cancelled and job.on_progress:
+                job.on_progress(value, text)
+
+        for kind, job, payload in finished:
+            self._jobs.discard(job)
+            if job.cancelled:
+                continue
+            if kind == "done" and job.on_done:
+                job.on_done(payload)
+            elif kind == "error" and job.on_error:
+                job.on_error(payload)
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._jobs)
+
+    def shutdown(self) -> None:
+        """Cancel every job and stop polling"""
+        for job in list(self._jobs):
+            job.cancel()
+        if self._poll_id is not None:
+            self.root.after_cancel(self._poll_id)
+            self._poll_id = None
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Patch manifest
+Description: Loads the ESM variants and patches the patcher knows about
+
+A manifest is a JSON file listing ESM variants (size, sampled and full
+digests, TES4 header signature, whether mods already accept it) and the
+patches that connect them as edges, plus optional "reverse" deltas that
+turn a patched variant back into its original for compact backups (see
+reverse_delta.py). assets/patches.json ships with the patcher; further
+manifests dropped into assets/manifests/ add releases without code
+changes. All manifests are compiled into one registry with dict indexes
+by size and by digest, so identification stays O(1) however many
+variants are listed. Registries are cached per set of manifest files
+and rebuilt only when one of them changes.
+"""
+
+import glob
+import heapq
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FORMAT_VERSION = 1
+MANIFEST_FILENAME = "patches.json"
+MANIFEST_DIR = "manifests"
+
+# Full digests a variant may list, in order of preference
+DIGEST_NAMES = ("sha256", "md5")
+
+# Planner edge weight: patch bytes plus this many cost units per byte the
+# patch decodes. Producing a 330 MB target dwarfs reading a 2 MB patch, so
+# shorter chains win and patch size breaks ties. Edges may set their own
+# "decode_cost" instead.
+DECODE_COST_PER_BYTE = 1.0
+
+# A file whose size is this close to a compatible variant's, without
+# matching any variant exactly, is reported as probably already patched
+COMPATIBLE_SIZE_TOLERANCE = 1000
+
+
+class ManifestError(Exception):
+    """Raised for an unreadable or inconsistent manifest"""
+
+
+class Variant:
+    """One known build of Fallout4.esm"""
+
+    def __init__(self, variant_id: str, data: dict, manifest_path: str):
+        try:
+            self.id = variant_id
+            self.size = int(data["size"])
+            self.description = data.get("description") or variant_id
+        except (KeyError, TypeError, ValueError):
+            raise ManifestError(f"{manifest_path}: variant {variant_id!r} needs a size")
+        self.compatible = bool(data.get("compatible", False))
+        self.digests = {name: data[name].lower() for name in DIGEST_NAMES if data.get(name)}
+        self.sampled = data.get("sampled")
+        self.header_signature = data.get("header_signature")
+        self.manifest_path = manifest_path
+
+    def __repr__(self) -> str:
+        return f"Variant({self.id!r}, {self.size})"
+
+
+class Edge:
+    """A patch that turns one variant into another"""
+
+    def __init__(self, data: dict, manifest_path: str):
+        try:
+            self.source = data["from"]
+            self.target = data["to"]
+            patch = data["patch"]
+        except (KeyError, TypeError):
+            raise ManifestError(f"{manifest_path}: edges need 'from', 'to' and 'patch'")
+        # Patch files are relative to the manifest that lists them
+        self.patch_path = os.path.join(os.path.dirname(os.path.abspath(manifest_path)), patch)
+        self.patch_size = data.get("patch_size")
+        self.patch_sha256 = data.get("patch_sha256")
+        self.decode_cost = data.get("decode_cost")
+
+    def __repr__(self) -> str:
+        return f"Edge({self.source!r} -> {self.target!r})"
+
+
+class PatchPlan:
+    """The patches that take one variant to a compatible one, in order"""
+
+    def __init__(self, edges: List[Edge], cost: float):
+        self.edges = edges
+        self.cost = cost
+
+    @property
+    def patch_paths(self) -> List[str]:
+        return [edge.patch_path for edge in self.edges]
+
+    def route(self) -> str:
+        return " -> ".join([self.edges[0].source] + [edge.target for edge in self.edges])
+
+
+class PatchRegistry:
+    """Every variant and patch from a set of manifests, indexed for lookup"""
+
+    def __init__(self):
+        self.variants: Dict[str, Variant] = {}
+        self.edges: List[Edge] = []
+        self.by_size: Dict[int, List[Variant]] = {}
+        self.by_digest: Dict[Tuple[str, str], Variant] = {}
+        self.outgoing: Dict[str, List[Edge]] = {}
+        # Reverse deltas by (patched variant, original variant); never planned over
+        self.reverse: Dict[Tuple[str, str], Edge] = {}
+
+    def add_manifest(self, data: dict, manifest_path: str) -> None:
+        """Merge one parsed manifest; later manifests may override variants"""
+        if not isinstance(data, dict):
+            raise ManifestError(f"{manifest_path}: not a manifest")
+        if data.get("format") != FORMAT_VERSION:
+            raise ManifestError(f"{manifest_path}: unsupported manifest format {data.get('format')!r}")
+        for variant_id, item in data.get("variants", {}).items():
+            self.variants[variant_id] = Variant(variant_id, item, manifest_path)
+        for item in data.get("edges", []):
+            self.edges.append(Edge(item, manifest_path))
+        for item in data.get("reverse", []):
+            edge = Edge(item, manifest_path)
+            self.reverse[(edge.source, edge.target)] = edge
+
+    def compile(self) -> "PatchRegistry":
+        """Build the lookup indexes once every manifest has been added"""
+        self.by_size = {}
+        self.by_digest = {}
+        self.outgoing = {}
+        for variant in self.variants.values():
+            self.by_size.setdefault(variant.size, []).append(variant)
+            for name, value in variant.digests.items():
+                self.by_digest[(name, value)] = variant
+        for edge in self.edges:
+            for end in (edge.source, edge.target):
+                if end not in self.variants:
+                    raise ManifestError(f"Patch {os.path.basename(edge.patch_path)} refers to "
+                                        f"unknown variant {end!r}")
+            self.outgoing.setdefault(edge.source, []).append(edge)
+        for edge in self.reverse.values():
+            for end in (edge.source, edge.target):
+                if end not in self.variants:
+                    raise ManifestError(f"Reverse delta {os.path.basename(edge.patch_path)} refers to "
+                                        f"unknown variant {end!r}")
+        return self
+
+    def variants_of_size(self, size: int) -> List[Variant]:
+        return self.by_size.get(size, [])
+
+    def compatible_near_size(self, size: int,
+                             tolerance: int = COMPATIBLE_SIZE_TOLERANCE) -> Optional[Variant]:
+        """The compatible variant closest to size, if within tolerance bytes"""
+        near = [variant for variant in self.variants.values()
+                if variant.compatible and abs(variant.size - size) < tolerance]
+        return min(near, key=lambda variant: abs(variant.size - size), default=None)
+
+    def variant_by_digests(self, digests: Dict[str, str]) -> Optional[Variant]:
+        """The variant matching any of a file's full digests"""
+        for name in DIGEST_NAMES:
+            if name in digests:
+                variant = self.by_digest.get((name, digests[name].lower()))
+                if variant is not None:
+                    return variant
+        return None
+
+    def edges_from(self, variant_id: str) -> List[Edge]:
+        return self.outgoing.get(variant_id, [])
+
+    def edge_cost(self, edge: Edge) -> float:
+        """Planner weight of an edge: patch bytes plus estimated decode cost"""
+        decode_cost = edge.decode_cost
+        if decode_cost is None:
+            decode_cost = DECODE_COST_PER_BYTE * self.variants[edge.target].size
+        return (edge.patch_size or 0) + decode_cost
+
+    def plan(self, variant_id: str) -> Optional[PatchPlan]:
+        """Cheapest chain of patches from a variant to any compatible variant
+
+        Dijkstra over the variant graph; None if no compatible variant is
+        reachable.
+        """
+        best = {variant_id: 0.0}
+        previous: Dict[str, Edge] = {}
+        queue = [(0.0, variant_id)]
+        done = set()
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if node in done:
+                continue
+            done.add(node)
+            if node != variant_id and self.variants[node].compatible:
+                edges = []
+                while node != variant_id:
+                    edges.append(previous[node])
+                    node = previous[node].source
+                return PatchPlan(edges[::-1], cost)
+            for edge in self.edges_from(node):
+                new_cost = cost + self.edge_cost(edge)
+                if new_cost < best.get(edge.target, float("inf")):
+                    best[edge.target] = new_cost
+                    previous[edge.target] = edge
+                    heapq.heappush(queue, (new_cost, edge.target))
+        return None
+
+    def patch_info(self, plan: PatchPlan) -> dict:
+        """Describe a plan the way ESMPatcher.apply_patch expects
+
+        "chain" lists the patch files in order; "patch" is the single patch
+        of a one-step plan and None for a chain. "reverse_patch" is a shipped
+        reverse delta from the target back to the source, if any.
+        """
+        source = self.variants[plan.edges[0].source]
+        target = self.variants[plan.edges[-1].target]
+        reverse = self.reverse.get((target.id, source.id))
+        return {
+            "patch": plan.patch_paths[0] if len(plan.edges) == 1 else None,
+            "chain": plan.patch_paths,
+            "route": plan.route(),
+            "cost": plan.cost,
+            "patch_size": sum(edge.patch_size or 0 for edge in plan.edges),
+            "description": source.description,
+            "variant": source.id,
+            "md5": source.digests.get("md5"),
+            "sha256": source.digests.get("sha256"),
+            "header_signature": source.header_signature,
+            "sampled": source.sampled,
+            "target_variant": target.id,
+            "target_size": target.size,
+            "target_md5": target.digests.get("md5"),
+            "target_sha256": target.digests.get("sha256"),
+            "reverse_patch": reverse.patch_path if reverse else None,
+            "reverse_patch_sha256": reverse.patch_sha256 if reverse else None,
+        }
+
+    def patch_infos(self) -> List[dict]:
+        """patch_info() of every variant that has a plan"""
+        plans = (self.plan(variant_id) for variant_id in self.variants)
+        return [self.patch_info(plan) for plan in plans if plan is not None]
+
+
+def manifest_paths(assets_dir: str) -> List[str]:
+    """The bundled manifest followed by any dropped into assets/manifests/"""
+    paths = [os.path.join(assets_dir, MANIFEST_FILENAME)]
+    paths += sorted(glob.glob(os.path.join(assets_dir, MANIFEST_DIR, "*.json")))
+    return [path for path in paths if os.path.isfile(path)]
+
+
+_cache: Dict[tuple, PatchRegistry] = {}
+_cache_lock = threading.Lock()
+
+
+def load_registry(paths: Iterable[str]) -> PatchRegistry:
+    """Compile the manifests at paths, reusing a cached registry if none changed"""
+    paths = list(paths)
+    key = []
+    for path in paths:
+        st = os.stat(path)
+        key.append((path, st.st_mtime_ns, st.st_size))
+    key = tuple(key)
+
+    with _cache_lock:
+        registry = _cache.get(key)
+        if registry is None:
+            registry = PatchRegistry()
+            for path in paths:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except ValueError as e:
+                    raise ManifestError(f"{path}: {e}")
+                registry.add_manifest(data, path)
+            registry.compile()
+            # Only the current set of files is worth keeping
+            _cache.clear()
+            _cache[key] = registry
+        return registry
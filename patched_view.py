@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Patched view
+Description: Read-only file object over the output of a patch, decoded on demand
+
+Inspection tools (record dumpers, QA diffs, header checks) usually read a
+small part of the patched ESM. A PatchedView serves any byte range of the
+patched file without writing it anywhere: it looks up the delta windows
+that overlap a read, decodes just those against a memory map of the
+source and keeps the most recently used windows in a small LRU cache.
+Memory use is the cache plus whatever the caller holds on to.
+
+Random access works because windows are executed from their decode plan
+(see decode_plan.py), which has the patch's compressed instruction
+streams already unpacked. A chain of patches is a stack of views, each
+reading its source from the one below.
+
+    with open_patched("Fallout4.esm", "assets/fallout4_323025.xdelta") as view:
+        header = esm_header.parse_esm_header(view.read(64 * 1024))
+"""
+
+import io
+import mmap
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import List, Optional, Union
+
+import decode_plan
+import vcdiff
+
+# Decoded windows kept per view; the bundled patches use 8 MiB windows
+DEFAULT_CACHE_WINDOWS = 4
+
+
+class PatchedView(io.RawIOBase):
+    """The target of a decode plan applied to source, readable like a file
+
+    source is a buffer holding the whole source file (typically an mmap)
+    or another PatchedView. Every decoded window is checked against its
+    Adler32 unless verify is False.
+    """
+
+    def __init__(self, source, plan: decode_plan.DecodePlan,
+                 cache_windows: int = DEFAULT_CACHE_WINDOWS, verify: bool = True):
+        super().__init__()
+        self._source = source
+        self._plan = plan
+        self._starts = [window.target_offset for window in plan.windows]
+        self._length = plan.target_length
+        self._cache: "OrderedDict[int, bytearray]" = OrderedDict()
+        self._cache_windows = max(1, cache_windows)
+        self._verify = verify
+        self._position = 0
+        self._on_close = []
+        self.windows_decoded = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._length + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        """Fill buffer from the current position; returns the bytes read, 0 at EOF"""
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        with memoryview(buffer).cast("B") as out:
+            data = self.segment(self._position, min(len(out), max(0, self._length - self._position)))
+            out[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def segment(self, position: int, length: int) -> memoryview:
+        """Bytes position..position + length of the patched file
+
+        Also what lets a view serve as the source of another view.
+        """
+        if not length:
+            return memoryview(b"")
+        if position < 0 or position + length > self._length:
+            raise vcdiff.VCDIFFError(f"Range {position:,}+{length:,} is outside the patched file "
+                                     f"({self._length:,} bytes)")
+        index = bisect_right(self._starts, position) - 1
+        window = self._window(index)
+        offset = position - self._starts[index]
+        if offset + length <= len(window):
+            return memoryview(window)[offset:offset + length]
+
+        # The range crosses windows
+        parts = bytearray()
+        while len(parts) < length:
+            window = self._window(index)
+            parts += memoryview(window)[offset:offset + length - len(parts)]
+            index += 1
+            offset = 0
+        return memoryview(parts)
+
+    def _window(self, index: int) -> bytearray:
+        """Decoded target of window index, from the cache if possible"""
+        data = self._cache.get(index)
+        if data is not None:
+            self._cache.move_to_end(index)
+            return data
+
+        window = self._plan.windows[index]
+        data = self._plan.execute_window(window, self._source)
+        if self._verify:
+            vcdiff.verify_window(window, data)
+        self.windows_decoded += 1
+        self._cache[index] = data
+        if len(self._cache) > self._cache_windows:
+            self._cache.popitem(last=False)
+        return data
+
+    def close(self) -> None:
+        if not self.closed:
+            self._cache.clear()
+            for callback in reversed(self._on_close):
+                callback()
+            self._on_close = []
+        super().close()
+
+
+def open_patched(
+    source_path: str,
+    patch_path: Union[str, List[str]],
+    cache_windows: int = DEFAULT_CACHE_WINDOWS,
+    verify: bool = True,
+    plan_cache_dir: Optional[str] = None,
+) -> PatchedView:
+    """A PatchedView of source_path with a patch, or a chain of patches, applied
+
+    Decode plans come from the plan cache (compiled on first use). Closing
+    the view unmaps the source. In a chain every view caches cache_windows
+    windows; source windows of the bundled patches span ~64 MB of their
+    source, so intermediate views pin correspondingly more memory.
+    """
+    patch_paths = [patch_path] if isinstance(patch_path, str) else list(patch_path)
+    plans = decode_plan.load_plans(patch_paths, plan_cache_dir)
+
+    with open(source_path, "rb") as f:
+        # mmap refuses empty files; an empty source is still a valid input
+        if os.fstat(f.fileno()).st_size:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            source = b""
+
+    views = []
+    for plan in plans:
+        views.append(PatchedView(views[-1] if views else source, plan, cache_windows, verify))
+
+    view = views[-1]
+    # Closing the outermost view releases the whole stack
+    view._on_close += [lower.close for lower in views[:-1]]
+    if isinstance(source, mmap.mmap):
+        view._on_close.insert(0, source.close)
+    return view
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Process watchdog
+Description: Runs an external decoder and judges it by its progress, not its age
+
+A fixed timeout is wrong both ways for xdelta3.exe: it kills healthy runs
+on slow disks and network shares, and it sits out its whole length on a
+run that hung in the first second. The watchdog instead samples how far
+the process has got - the size of the file it is writing and, when
+available, the output totals it reports on stderr with -v - and derives
+its throughput. Progress is passed to a callback as it happens; the
+process is killed only when its throughput over the last stall_timeout
+seconds drops below min_throughput.
+"""
+
+import collections
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+
+# Defaults: a run is stalled after this many seconds below this many bytes/s
+DEFAULT_STALL_TIMEOUT = 60.0
+DEFAULT_MIN_THROUGHPUT = 64 * 1024
+
+POLL_INTERVAL = 0.25
+
+# Lines of stderr kept for error messages; progress lines are left out
+STDERR_TAIL_LINES = 20
+
+# "out 8.00 MiB", "total out 330745373 bytes" and similar in xdelta3 -v output
+_OUTPUT_SIZE = re.compile(r"\bout\s+([\d.]+)\s*(bytes|B|KiB|MiB|GiB|KB|MB|GB)?\b", re.IGNORECASE)
+_UNITS = {"": 1, "b": 1, "bytes": 1, "kib": 1024, "kb": 1024, "mib": 1024 ** 2,
+          "mb": 1024 ** 2, "gib": 1024 ** 3, "gb": 1024 ** 3}
+
+
+class StallError(Exception):
+    """Raised when a watched process stops making progress and is killed"""
+
+
+def parse_output_size(line: str) -> Optional[int]:
+    """Bytes of output a line of xdelta3 -v output reports, if any"""
+    matches = _OUTPUT_SIZE.findall(line)
+    if not matches:
+        return None
+    value, unit = matches[-1]
+    try:
+        return int(float(value) * _UNITS[unit.lower()])
+    except ValueError:
+        return None
+
+
+class ProcessWatchdog:
+    """Run a command that writes output_path, killing it only if it stalls
+
+    total is the expected output size, used for progress only.
+    progress_callback(bytes_done, total, bytes_per_second) is called from
+    the calling thread at every poll that saw progress.
+    """
+
+    def __init__(self, cmd: List[str], output_path: str, total: Optional[int] = None,
+                 stall_timeout: float = DEFAULT_STALL_TIMEOUT,
+                 min_throughput: float = DEFAULT_MIN_THROUGHPUT,
+                 progress_callback: Optional[Callable[[int, Optional[int], float], None]] = None,
+                 poll_interval: float = POLL_INTERVAL):
+        self.cmd = cmd
+        self.output_path = output_path
+        self.total = total
+        self.stall_timeout = stall_timeout
+        self.min_throughput = min_throughput
+        self.progress_callback = progress_callback
+        self.poll_interval = poll_interval
+        self.stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        self.reported = 0  # Largest output size seen on stderr
+        self.done = 0
+        self.throughput = 0.0
+
+    def _read_stderr(self, stream) -> None:
+        for line in stream:
+            line = line.rstrip()
+            if not line:
+                continue
+            size = parse_output_size(line)
+            if size is None:
+                self.stderr_tail.append(line)
+            else:
+                self.reported = max(self.reported, size)
+
+    def _progress(self) -> int:
+        try:
+            written = os.path.getsize(self.output_path)
+        except OSError:
+            written = 0
+        return max(written, self.reported)
+
+    @property
+    def stderr(self) -> str:
+        return "\n".join(self.stderr_tail)
+
+    def run(self) -> int:
+        """Run the command to completion and return its exit code
+
+        Raises StallError (after killing the process) on a stall.
+        """
+        process = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+        )
+        reader = threading.Thread(target=self._read_stderr, args=(process.stderr,), daemon=True)
+        reader.start()
+
+        started = time.monotonic()
+        # (time, bytes done) samples covering the last stall_timeout seconds
+        history = collections.deque([(started, 0)])
+        try:
+            while True:
+                try:
+                    returncode = process.wait(self.poll_interval)
+                except subprocess.TimeoutExpired:
+                    returncode = None
+
+                now = time.monotonic()
+                done = self._progress()
+                if done > self.done:
+                    then, before = history[0]
+                    self.throughput = (done - before) / max(now - then, 1e-6)
+                    self.done = done
+                    if self.progress_callback:
+                        self.progress_callback(done, self.total, self.throughput)
+                history.append((now, done))
+                while len(history) > 1 and now - history[1][0] >= self.stall_timeout:
+                    history.popleft()
+
+                if returncode is not None:
+                    reader.join(timeout=1.0)
+                    return returncode
+
+                then, before = history[0]
+                if now - then >= self.stall_timeout and (done - before) / (now - then) < self.min_throughput:
+                    raise StallError(
+                        f"under {self.min_throughput / 1024:.0f} KB/s for {now - then:.0f}s "
+                        f"({(done - before) / 1024:.0f} KB written in that time, "
+                        f"{done / (1024 * 1024):.1f} MB in total)"
+                    )
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            if process.stderr:
+                reader.join(timeout=1.0)
+                process.stderr.close()
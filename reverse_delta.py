@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Reverse-delta backups for ESM Patcher
+Rebuilds the original ESM from the patched one instead of keeping a full copy
+
+A forward patch copies most of the original into the target. Inverting
+its COPY map gives, for every byte of the original, either a place in
+the patched file holding the same byte or nothing; the bytes with
+nothing are stored as literals. The result is a plain VCDIFF from the
+patched file back to the original - a few MB where a copy of the
+original takes ~315 MB - written next to the ESM together with the
+original's size and digests so a restore can be verified. A backup is
+written under a pending name first and only promoted once the patch it
+belongs to has committed, so a failed patch never leaves one behind.
+
+Reverse deltas for known variants can also be precomputed and listed in
+a patch manifest under "reverse"; backups then copy the shipped file.
+
+Usage:
+  python reverse_delta.py Fallout4.esm assets/fallout4_323025.xdelta \\
+      -o assets/fallout4_323025.reverse.vcdiff \\
+      --manifest assets/patches.json --from compatible --to nextgen-323025
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import compose_delta
+import delta_encoder
+import vcdiff
+
+BACKUP_FORMAT = 1
+DELTA_SUFFIX = ".backup.vcdiff"
+INFO_SUFFIX = ".backup.json"
+PENDING_SUFFIX = ".pending"
+
+# Target (original) bytes per reverse-delta window, as xdelta3 uses
+WINDOW_SIZE = 8 * 1024 * 1024
+
+# Copies shorter than this cost more to encode than the literal bytes
+MIN_COPY = 4
+
+# Kinds of reverse pieces: COPY values are offsets in the patched file,
+# LITERAL values offsets in the original
+COPY = delta_encoder.COPY
+LITERAL = delta_encoder.LITERAL
+
+
+def backup_paths(esm_path: str, pending: bool = False) -> Tuple[str, str]:
+    """(delta, info) file names of the reverse-delta backup of esm_path"""
+    suffix = PENDING_SUFFIX if pending else ""
+    return esm_path + DELTA_SUFFIX + suffix, esm_path + INFO_SUFFIX + suffix
+
+
+def has_backup(esm_path: str, pending: bool = False) -> bool:
+    return all(os.path.exists(path) for path in backup_paths(esm_path, pending))
+
+
+def read_backup_info(esm_path: str, pending: bool = False) -> Optional[dict]:
+    """The info file of a reverse-delta backup, or None if unreadable"""
+    try:
+        with open(backup_paths(esm_path, pending)[1], "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(info, dict) or info.get("format") != BACKUP_FORMAT:
+        return None
+    return info
+
+
+def write_backup(esm_path: str, delta: bytes, info: dict, pending: bool = False) -> str:
+    """Store a reverse delta and its info next to esm_path; returns the delta path"""
+    delta_path, info_path = backup_paths(esm_path, pending)
+    info = dict(info, format=BACKUP_FORMAT, delta_size=len(delta),
+                delta_sha256=hashlib.sha256(delta).hexdigest())
+    for path, data in ((delta_path, delta), (info_path, json.dumps(info, indent=2).encode("utf-8"))):
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    return delta_path
+
+
+def promote_backup(esm_path: str) -> str:
+    """Make the pending backup of esm_path its backup; returns the delta path
+
+    The old info file goes first: a delta without info is no backup, so a
+    crash half way never pairs the new delta with the old info.
+    """
+    pending = backup_paths(esm_path, pending=True)
+    final = backup_paths(esm_path)
+    if os.path.exists(final[1]):
+        os.remove(final[1])
+    for source, target in zip(pending, final):
+        os.replace(source, target)
+    return final[0]
+
+
+def discard_backup(esm_path: str, pending: bool = True) -> bool:
+    """Remove a (by default pending) backup of esm_path; True if there was one"""
+    removed = False
+    for path in backup_paths(esm_path, pending):
+        if os.path.exists(path):
+            os.remove(path)
+            removed = True
+    return removed
+
+
+def reverse_pieces(target: compose_delta.TargetMap, original_size: int) -> Iterator[Tuple[int, int, int]]:
+    """Cover the original with (kind, length, value) pieces, in order
+
+    target maps the patched file onto the original; its COPY_SOURCE
+    pieces say which original ranges reappear where. Ranges are taken
+    greedily by start (longest first), the gaps become literals.
+    """
+    copies = sorted(
+        ((value, -length, start) for start, length, kind, value
+         in zip(target.starts, target.lengths, target.kinds, target.values)
+         if kind == compose_delta.COPY_SOURCE),
+    )
+    position = 0
+    for source, negative_length, patched in copies:
+        end = min(source - negative_length, original_size)
+        if end <= position:
+            continue
+        if source > position:
+            yield LITERAL, source - position, position
+            position = source
+        n = end - position
+        if n >= MIN_COPY:
+            yield COPY, n, patched + position - source
+        else:
+            yield LITERAL, n, position
+        position = end
+    if position < original_size:
+        yield LITERAL, original_size - position, position
+
+
+def encode_reverse(pieces: Iterator[Tuple[int, int, int]], original, window_size: int = WINDOW_SIZE) -> bytes:
+    """Write reverse pieces as a delta; literals are read from original
+
+    Each window covers window_size bytes of the original with a source
+    segment spanning the patched ranges it copies, and carries the
+    Adler32 of its part of the original.
+    """
+    parts = [vcdiff.encode_header()]
+    window: List[Tuple[int, int, int]] = []
+    window_start = 0
+    filled = 0
+
+    def flush():
+        parts.append(delta_encoder.encode_window(window, original, window_start, filled))
+
+    for kind, n, value in pieces:
+        while n:
+            take = min(n, window_size - filled)
+            window.append((kind, take, value))
+            filled += take
+            n -= take
+            value += take
+            if filled == window_size:
+                flush()
+                window_start += filled
+                window = []
+                filled = 0
+    if window:
+        flush()
+    return b"".join(parts)
+
+
+def build_reverse_delta(original_path: str, patch_paths: List[str]) -> bytes:
+    """Reverse delta that turns the output of patch_paths back into original_path"""
+    target = None
+    for path in patch_paths:
+        with open(path, "rb") as f:
+            target, _ = compose_delta.map_delta(f.read(), target)
+
+    with open(original_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return encode_reverse(iter(()), b"")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as original:
+            return encode_reverse(reverse_pieces(target, size), original)
+
+
+def main():
+    """Precompute a reverse delta for shipping"""
+    parser = argparse.ArgumentParser(
+        description="Build the reverse delta that turns a patched ESM back into its original",
+    )
+    parser.add_argument("original", help="the unpatched ESM")
+    parser.add_argument("patches", nargs="+", help="the patches that produce the patched ESM, in order")
+    parser.add_argument("-o", "--output", required=True, help="reverse delta to write")
+    parser.add_argument("--manifest", help="patch manifest to list the reverse delta in")
+    parser.add_argument("--from", dest="source", metavar="VARIANT", help="manifest variant of the patched ESM")
+    parser.add_argument("--to", dest="target", metavar="VARIANT", help="manifest variant of the original")
+    args = parser.parse_args()
+    if args.manifest and not (args.source and args.target):
+        parser.error("--manifest needs --from and --to")
+
+    print(f"Inverting {len(args.patches)} patch(es)...")
+    started = time.perf_counter()
+    try:
+        delta = build_reverse_delta(args.original, args.patches)
+    except vcdiff.VCDIFFError as e:
+        print(f"✗ {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+
+    temp_path = args.output + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(delta)
+    os.replace(temp_path, args.output)
+    print(f"✓ Wrote {args.output}: {len(delta):,} bytes ({elapsed:.1f}s)")
+
+    if args.manifest:
+        compose_delta.update_manifest(args.manifest, args.output, args.source, args.target, section="reverse")
+        print(f"✓ Listed {args.source} -> {args.target} under reverse in {args.manifest}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
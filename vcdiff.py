@@ -0,0 +1,919 @@
+#!/usr/bin/env python3
+"""
+VCDIFF decoder
+Description: Pure-Python RFC 3284 decoder for xdelta3 patch files
+
+This module decodes the VCDIFF deltas produced by xdelta3, including the
+xdelta3 extensions used by the bundled patches: the application header,
+VCD_ADLER32 window checksums and LZMA secondary compression of the
+data/instruction/address sections. It can also write plain deltas (default
+code table, Adler32 checksums, no secondary compression) for the offline
+patch tools.
+"""
+
+import lzma
+import mmap
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+# File header
+VCD_MAGIC = b"\xd6\xc3\xc4"
+VCD_VERSION = 0x00
+
+# Header indicator bits
+VCD_DECOMPRESS = 0x01
+VCD_CODETABLE = 0x02
+VCD_APPHEADER = 0x04  # xdelta3 extension
+
+# Window indicator bits
+VCD_SOURCE = 0x01
+VCD_TARGET = 0x02
+VCD_ADLER32 = 0x04  # xdelta3 extension
+
+# Delta indicator bits
+VCD_DATACOMP = 0x01
+VCD_INSTCOMP = 0x02
+VCD_ADDRCOMP = 0x04
+
+# xdelta3 secondary compressor IDs
+SECONDARY_DJW = 1
+SECONDARY_LZMA = 2
+SECONDARY_FGK = 16
+
+# Instruction types
+VCD_NOOP = 0
+VCD_ADD = 1
+VCD_RUN = 2
+VCD_COPY = 3
+
+# Address cache sizes of the default code table
+NEAR_CACHE_SIZE = 4
+SAME_CACHE_SIZE = 3
+
+
+class VCDIFFError(Exception):
+    """Raised when a delta is malformed or does not match its source"""
+
+
+def read_varint(buf, pos: int) -> Tuple[int, int]:
+    """Read a VCDIFF base-128 integer, returning (value, new position)"""
+    value = 0
+    try:
+        while True:
+            byte = buf[pos]
+            pos += 1
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value, pos
+    except IndexError:
+        raise VCDIFFError("Truncated integer in delta") from None
+
+
+def build_default_code_table() -> List[Tuple[Tuple[int, int, int], ...]]:
+    """Build the RFC 3284 default instruction code table
+
+    Each entry is a tuple of one or two (type, size, mode) instructions;
+    NOOP halves are dropped so the executor can simply iterate.
+    """
+    table = [((VCD_RUN, 0, 0),)]
+
+    # ADD size 0, [1,17]
+    for size in range(0, 18):
+        table.append(((VCD_ADD, size, 0),))
+
+    # COPY size 0, [4,18] for every mode
+    copy_modes = 2 + NEAR_CACHE_SIZE + SAME_CACHE_SIZE
+    for mode in range(copy_modes):
+        table.append(((VCD_COPY, 0, mode),))
+        for size in range(4, 19):
+            table.append(((VCD_COPY, size, mode),))
+
+    # ADD [1,4] + COPY [4,6] for the self, here and near modes
+    for mode in range(2 + NEAR_CACHE_SIZE):
+        for add_size in range(1, 5):
+            for copy_size in range(4, 7):
+                table.append(((VCD_ADD, add_size, 0), (VCD_COPY, copy_size, mode)))
+
+    # ADD [1,4] + COPY 4 for the same modes
+    for mode in range(2 + NEAR_CACHE_SIZE, copy_modes):
+        for add_size in range(1, 5):
+            table.append(((VCD_ADD, add_size, 0), (VCD_COPY, 4, mode)))
+
+    # COPY 4 + ADD 1 for every mode
+    for mode in range(copy_modes):
+        table.append(((VCD_COPY, 4, mode), (VCD_ADD, 1, 0)))
+
+    assert len(table) == 256
+    return table
+
+
+CODE_TABLE = build_default_code_table()
+
+
+class VCDIFFHeader:
+    """Parsed VCDIFF file header"""
+
+    def __init__(self, indicator: int, secondary_id: int, app_header: bytes, size: int):
+        self.indicator = indicator
+        self.secondary_id = secondary_id
+        self.app_header = app_header
+        self.size = size
+
+    def app_header_text(self) -> str:
+        """Return the xdelta3 application header ("target//source/") as text"""
+        return self.app_header.decode("utf-8", errors="replace")
+
+
+class VCDIFFWindow:
+    """Location and layout of a single delta window inside the patch"""
+
+    __slots__ = (
+        "index", "indicator", "source_length", "source_position",
+        "target_offset", "target_length", "delta_indicator",
+        "data_start", "data_length", "inst_length", "addr_length",
+        "checksum", "end",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    @property
+    def inst_start(self) -> int:
+        return self.data_start + self.data_length
+
+    @property
+    def addr_start(self) -> int:
+        return self.inst_start + self.inst_length
+
+
+def parse_header(delta) -> VCDIFFHeader:
+    """Parse the file header at the start of a delta"""
+    if len(delta) < 5 or bytes(delta[:3]) != VCD_MAGIC:
+        raise VCDIFFError("Not a VCDIFF file (bad magic)")
+    if delta[3] != VCD_VERSION:
+        raise VCDIFFError(f"Unsupported VCDIFF version {delta[3]}")
+
+    indicator = delta[4]
+    pos = 5
+    secondary_id = 0
+    app_header = b""
+
+    if indicator & ~(VCD_DECOMPRESS | VCD_CODETABLE | VCD_APPHEADER):
+        raise VCDIFFError(f"Unknown header indicator bits 0x{indicator:02x}")
+
+    if indicator & VCD_DECOMPRESS:
+        secondary_id = delta[pos]
+        pos += 1
+        if secondary_id != SECONDARY_LZMA:
+            raise VCDIFFError(f"Unsupported secondary compressor (id {secondary_id})")
+
+    if indicator & VCD_CODETABLE:
+        raise VCDIFFError("Application-defined code tables are not supported")
+
+    if indicator & VCD_APPHEADER:
+        length, pos = read_varint(delta, pos)
+        app_header = bytes(delta[pos:pos + length])
+        pos += length
+
+    return VCDIFFHeader(indicator, secondary_id, app_header, pos)
+
+
+def parse_window(delta, pos: int, index: int, target_offset: int) -> VCDIFFWindow:
+    """Parse the window header starting at pos"""
+    indicator = delta[pos]
+    pos += 1
+
+    if indicator & ~(VCD_SOURCE | VCD_TARGET | VCD_ADLER32):
+        raise VCDIFFError(f"Unknown window indicator bits 0x{indicator:02x} in window {index}")
+    if indicator & VCD_SOURCE and indicator & VCD_TARGET:
+        raise VCDIFFError(f"Window {index} sets both VCD_SOURCE and VCD_TARGET")
+
+    source_length = source_position = 0
+    if indicator & (VCD_SOURCE | VCD_TARGET):
+        source_length, pos = read_varint(delta, pos)
+        source_position, pos = read_varint(delta, pos)
+
+    encoding_length, pos = read_varint(delta, pos)
+    end = pos + encoding_length
+
+    target_length, pos = read_varint(delta, pos)
+    delta_indicator = delta[pos]
+    pos += 1
+    data_length, pos = read_varint(delta, pos)
+    inst_length, pos = read_varint(delta, pos)
+    addr_length, pos = read_varint(delta, pos)
+
+    checksum = None
+    if indicator & VCD_ADLER32:
+        checksum = int.from_bytes(delta[pos:pos + 4], "big")
+        pos += 4
+
+    if pos + data_length + inst_length + addr_length != end or end > len(delta):
+        raise VCDIFFError(f"Inconsistent section lengths in window {index}")
+
+    return VCDIFFWindow(
+        index=index,
+        indicator=indicator,
+        source_length=source_length,
+        source_position=source_position,
+        target_offset=target_offset,
+        target_length=target_length,
+        delta_indicator=delta_indicator,
+        data_start=pos,
+        data_length=data_length,
+        inst_length=inst_length,
+        addr_length=addr_length,
+        checksum=checksum,
+        end=end,
+    )
+
+
+def index_windows(delta) -> Tuple[VCDIFFHeader, List[VCDIFFWindow]]:
+    """Walk the delta once and return its header and window table"""
+    header = parse_header(delta)
+    windows = []
+    pos = header.size
+    target_offset = 0
+
+    while pos < len(delta):
+        window = parse_window(delta, pos, len(windows), target_offset)
+        windows.append(window)
+        target_offset += window.target_length
+        pos = window.end
+
+    return header, windows
+
+
+class SectionDecoder:
+    """Extracts the data, instruction and address sections of each window
+
+    xdelta3 keeps one secondary-compressed xz stream per section type for
+    the whole delta and only sync-flushes it at window boundaries, so the
+    windows of a delta must be passed to sections() in order.
+    """
+
+    SECTIONS = (
+        (VCD_DATACOMP, "data"),
+        (VCD_INSTCOMP, "instruction"),
+        (VCD_ADDRCOMP, "address"),
+    )
+
+    def __init__(self, header: VCDIFFHeader):
+        self.secondary_id = header.secondary_id
+        self.decompressors = [None, None, None]
+        self.next_index = 0
+
+    def sections(self, delta, window: VCDIFFWindow) -> Tuple[bytes, bytes, bytes]:
+        """Return the (data, instructions, addresses) sections of a window"""
+        if window.index != self.next_index:
+            raise VCDIFFError(f"Window {window.index} decoded out of order (expected {self.next_index})")
+        self.next_index += 1
+
+        bounds = (
+            (window.data_start, window.data_length),
+            (window.inst_start, window.inst_length),
+            (window.addr_start, window.addr_length),
+        )
+        result = []
+        for slot, ((flag, what), (start, length)) in enumerate(zip(self.SECTIONS, bounds)):
+            raw = delta[start:start + length]
+            if window.delta_indicator & flag:
+                result.append(self._decompress(slot, raw, what, window))
+            else:
+                result.append(bytes(raw))
+        return result[0], result[1], result[2]
+
+    def _decompress(self, slot: int, raw, what: str, window: VCDIFFWindow) -> bytes:
+        """Undo LZMA secondary compression of one section"""
+        if not self.secondary_id:
+            raise VCDIFFError(f"Window {window.index} has a compressed {what} section but no secondary compressor")
+
+        expected, pos = read_varint(raw, 0)
+        if self.decompressors[slot] is None:
+            self.decompressors[slot] = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+        # The stream never ends, so stop at the advertised size
+        try:
+            decoded = self.decompressors[slot].decompress(bytes(raw[pos:]), max_length=expected)
+        except lzma.LZMAError as e:
+            raise VCDIFFError(f"Corrupt {what} section in window {window.index}: {e}") from None
+        if len(decoded) != expected:
+            raise VCDIFFError(
+                f"{what.capitalize()} section in window {window.index} decompressed to "
+                f"{len(decoded)} bytes, expected {expected}"
+            )
+        return decoded
+
+
+def source_segment(window: VCDIFFWindow, source) -> memoryview:
+    """View of the part of source a window copies from"""
+    if not window.indicator & VCD_SOURCE:
+        return memoryview(b"")
+    seg_end = window.source_position + window.source_length
+    if source is None or seg_end > len(source):
+        raise VCDIFFError(f"Window {window.index} reads past the end of the source file")
+    if hasattr(source, "segment"):
+        # StreamedSource or patched_view.PatchedView
+        return source.segment(window.source_position, window.source_length)
+    return memoryview(source)[window.source_position:seg_end]
+
+
+def execute_window(window: VCDIFFWindow, sections: Tuple[bytes, bytes, bytes], source, out=None):
+    """Run one window's instructions and return the decoded target bytes
+
+    sections comes from SectionDecoder.sections(). source is a buffer
+    (typically an mmap) holding the whole source file; the window's source
+    segment is sliced out of it. The target is written into out when given
+    (e.g. a memoryview over the window's slice of an output mmap),
+    otherwise into a new bytearray.
+    """
+    if window.indicator & VCD_TARGET:
+        raise VCDIFFError(f"Window {window.index} copies from the target (VCD_TARGET is not supported)")
+
+    data, inst, addr = sections
+
+    seg_len = window.source_length
+    segment = source_segment(window, source)
+
+    target_len = window.target_length
+    if out is None:
+        out = bytearray(target_len)
+    elif len(out) != target_len:
+        raise ValueError(f"Output buffer holds {len(out)} bytes, window {window.index} needs {target_len}")
+    near = [0] * NEAR_CACHE_SIZE
+    same = [0] * (SAME_CACHE_SIZE * 256)
+    next_slot = 0
+    here_modes = 2 + NEAR_CACHE_SIZE
+
+    data_pos = inst_pos = addr_pos = 0
+    tpos = 0
+    inst_end = len(inst)
+
+    try:
+        while inst_pos < inst_end:
+            code = inst[inst_pos]
+            inst_pos += 1
+
+            for itype, size, mode in CODE_TABLE[code]:
+                if size == 0:
+                    size, inst_pos = read_varint(inst, inst_pos)
+
+                if tpos + size > target_len:
+                    raise VCDIFFError(f"Instruction overflows target window {window.index}")
+
+                if itype == VCD_ADD:
+                    out[tpos:tpos + size] = data[data_pos:data_pos + size]
+                    data_pos += size
+                    tpos += size
+                    continue
+
+                if itype == VCD_RUN:
+                    out[tpos:tpos + size] = data[data_pos:data_pos + 1] * size
+                    data_pos += 1
+                    tpos += size
+                    continue
+
+                # COPY: decode the address through the address cache
+                here = seg_len + tpos
+                if mode == 0:
+                    address, addr_pos = read_varint(addr, addr_pos)
+                elif mode == 1:
+                    offset, addr_pos = read_varint(addr, addr_pos)
+                    address = here - offset
+                elif mode < here_modes:
+                    offset, addr_pos = read_varint(addr, addr_pos)
+                    address = near[mode - 2] + offset
+                else:
+                    address = same[(mode - here_modes) * 256 + addr[addr_pos]]
+                    addr_pos += 1
+
+                near[next_slot] = address
+                next_slot = (next_slot + 1) % NEAR_CACHE_SIZE
+                same[address % (SAME_CACHE_SIZE * 256)] = address
+
+                if address >= here:
+                    raise VCDIFFError(f"COPY address {address} beyond current position in window {window.index}")
+
+                # Part of the copy that falls in the source segment
+                if address < seg_len:
+                    n = min(size, seg_len - address)
+                    out[tpos:tpos + n] = segment[address:address + n]
+                    tpos += n
+                    size -= n
+                    address = seg_len
+
+                # Remainder comes from the target written so far; when it
+                # overlaps the write position the bytes repeat with that period
+                start = address - seg_len
+                while size > 0:
+                    n = min(size, tpos - start)
+                    out[tpos:tpos + n] = out[start:start + n]
+                    tpos += n
+                    start += n
+                    size -= n
+    except IndexError:
+        raise VCDIFFError(f"Truncated section data in window {window.index}") from None
+    finally:
+        # Drop the export so the caller can close the source mmap
+        segment.release()
+
+    if tpos != target_len:
+        raise VCDIFFError(f"Window {window.index} decoded {tpos} bytes, expected {target_len}")
+    if data_pos != len(data) or addr_pos != len(addr):
+        raise VCDIFFError(f"Window {window.index} has unused section data")
+
+    return out
+
+
+def iter_instructions(window: VCDIFFWindow, sections: Tuple[bytes, bytes, bytes]):
+    """Walk a window's instructions without executing them
+
+    Yields (VCD_ADD, size, data), (VCD_RUN, size, byte) and
+    (VCD_COPY, size, address), with COPY addresses resolved through the
+    address cache into the window's address space (source segment first,
+    then the target window). Used to rewrite deltas rather than apply them.
+    """
+    data, inst, addr = sections
+    near = [0] * NEAR_CACHE_SIZE
+    same = [0] * (SAME_CACHE_SIZE * 256)
+    next_slot = 0
+    here_modes = 2 + NEAR_CACHE_SIZE
+
+    data_pos = inst_pos = addr_pos = 0
+    tpos = 0
+    inst_end = len(inst)
+
+    try:
+        while inst_pos < inst_end:
+            code = inst[inst_pos]
+            inst_pos += 1
+
+            for itype, size, mode in CODE_TABLE[code]:
+                if size == 0:
+                    size, inst_pos = read_varint(inst, inst_pos)
+
+                if itype == VCD_ADD:
+                    yield VCD_ADD, size, data[data_pos:data_pos + size]
+                    data_pos += size
+                elif itype == VCD_RUN:
+                    yield VCD_RUN, size, data[data_pos]
+                    data_pos += 1
+                else:
+                    here = window.source_length + tpos
+                    if mode == 0:
+                        address, addr_pos = read_varint(addr, addr_pos)
+                    elif mode == 1:
+                        offset, addr_pos = read_varint(addr, addr_pos)
+                        address = here - offset
+                    elif mode < here_modes:
+                        offset, addr_pos = read_varint(addr, addr_pos)
+                        address = near[mode - 2] + offset
+                    else:
+                        address = same[(mode - here_modes) * 256 + addr[addr_pos]]
+                        addr_pos += 1
+
+                    near[next_slot] = address
+                    next_slot = (next_slot + 1) % NEAR_CACHE_SIZE
+                    same[address % (SAME_CACHE_SIZE * 256)] = address
+
+                    if address >= here:
+                        raise VCDIFFError(f"COPY address {address} beyond current position in window {window.index}")
+                    yield VCD_COPY, size, address
+                tpos += size
+    except IndexError:
+        raise VCDIFFError(f"Truncated section data in window {window.index}") from None
+
+    if tpos != window.target_length:
+        raise VCDIFFError(f"Window {window.index} decoded {tpos} bytes, expected {window.target_length}")
+
+
+def verify_window(window: VCDIFFWindow, output) -> None:
+    """Check a decoded window against its VCD_ADLER32 checksum, if present"""
+    if window.checksum is None:
+        return
+    actual = zlib.adler32(output) & 0xFFFFFFFF
+    if actual != window.checksum:
+        raise VCDIFFError(
+            f"Adler32 mismatch in window {window.index} "
+            f"(expected {window.checksum:08x}, got {actual:08x}) - wrong source file?"
+        )
+
+
+class StreamedSource:
+    """Source that is itself the output of an upstream decode, produced on demand
+
+    Lets one delta be applied to the output of another without writing the
+    intermediate file. Upstream windows are pulled only when a downstream
+    window needs their bytes, and iter_decode() releases everything below
+    the lowest source position any remaining window reads, so memory holds
+    the span of source still in use rather than the whole intermediate.
+    """
+
+    def __init__(self, chunks: Iterable, length: int):
+        self._chunks = iter(chunks)
+        self._length = length
+        self._buffer = bytearray()
+        self._base = 0  # Offset of _buffer[0] in the stream
+        self._floor = 0  # Nothing below this is asked for again
+
+    def __len__(self) -> int:
+        return self._length
+
+    def segment(self, position: int, length: int) -> memoryview:
+        """View of stream[position:position + length], decoding upstream as needed"""
+        if position < self._base:
+            raise VCDIFFError(f"Source bytes at {position:,} were already released")
+        end = position + length
+        while self._base + len(self._buffer) < end:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                raise VCDIFFError(f"Upstream delta ended at {self._base + len(self._buffer):,} bytes, "
+                                  f"{end:,} needed")
+            self._buffer += chunk
+            if self._floor > self._base:
+                self.release(self._floor)
+        return memoryview(self._buffer)[position - self._base:end - self._base]
+
+    def release(self, offset: int) -> None:
+        """Forget bytes below offset; they will not be asked for again
+
+        Bytes below offset that are still to be decoded are dropped as
+        they arrive.
+        """
+        self._floor = max(self._floor, offset)
+        drop = min(offset - self._base, len(self._buffer))
+        if drop > 0:
+            # bytearray deletes from the front without moving the rest
+            del self._buffer[:drop]
+            self._base += drop
+
+
+def iter_decode(source, delta, start: int = 0) -> Iterator[Tuple[VCDIFFWindow, bytearray]]:
+    """Decode a delta window by window, yielding (window, target bytes)
+
+    Every window is checked against its Adler32 before it is yielded. When
+    source is a StreamedSource, the part of it no later window reads is
+    released as decoding moves on. delta may also be a compiled
+    decode_plan.DecodePlan, which runs its op tables instead. Windows
+    before start are skipped (their sections are still unpacked, since
+    later windows continue the same compressed streams).
+    """
+    if hasattr(delta, "execute_window"):
+        windows = delta.windows
+        run = delta.execute_window
+    else:
+        header, windows = index_windows(delta)
+        sections = SectionDecoder(header)
+
+        def run(window, source):
+            return execute_window(window, sections.sections(delta, window), source)
+
+        for window in windows[:start]:
+            sections.sections(delta, window)
+
+    # keep_from[i]: lowest source offset read by window i or any after it
+    keep_from = [len(source) if source is not None else 0] * (len(windows) + 1)
+    for i in range(len(windows) - 1, -1, -1):
+        window = windows[i]
+        position = window.source_position if window.indicator & VCD_SOURCE else keep_from[i + 1]
+        keep_from[i] = min(position, keep_from[i + 1])
+
+    if isinstance(source, StreamedSource):
+        source.release(keep_from[start])
+    for window in windows[start:]:
+        out = run(window, source)
+        verify_window(window, out)
+        if isinstance(source, StreamedSource):
+            source.release(keep_from[window.index + 1])
+        yield window, out
+
+
+def target_length(delta) -> int:
+    """Size of the file a delta (or decode plan) produces"""
+    if hasattr(delta, "execute_window"):
+        return delta.target_length
+    return sum(w.target_length for w in index_windows(delta)[1])
+
+
+def chain_source(source, deltas: List) -> object:
+    """Stack deltas on source, returning a StreamedSource of the last output
+
+    Each delta is applied to the output of the one before it; nothing is
+    decoded until the returned source is read.
+    """
+    for delta in deltas:
+        source = StreamedSource(
+            (out for _, out in iter_decode(source, delta)),
+            target_length(delta),
+        )
+    return source
+
+
+def decode(
+    source,
+    delta,
+    output: BinaryIO,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    digest_sink=None,
+) -> int:
+    """Decode a whole delta against source, writing the target to output
+
+    Returns the number of bytes written. progress_callback, if given, is
+    called as progress_callback(bytes_done, bytes_total) after each window.
+    digest_sink, if given, has its update() method fed the target bytes in
+    order as they are written, so the output can be verified without
+    reading it back.
+    """
+    total = target_length(delta)
+    done = 0
+
+    for _, out in iter_decode(source, delta):
+        output.write(out)
+        if digest_sink is not None:
+            digest_sink.update(out)
+        done += len(out)
+        if progress_callback:
+            progress_callback(done, total)
+
+    return done
+
+
+def decode_file(
+    source_path: str,
+    patch_path: Union[str, list],
+    output_path: str,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    digest_sink=None,
+) -> int:
+    """Decode patch_path against source_path into output_path
+
+    See decode_into() for patch chains and decode() for progress_callback
+    and digest_sink.
+    """
+    with open(output_path, "wb") as out:
+        return decode_into(source_path, patch_path, out, progress_callback, digest_sink)
+
+
+def decode_into(
+    source_path: str,
+    patch_path: Union[str, list],
+    output,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    digest_sink=None,
+) -> int:
+    """Decode patch_path against source_path into a writable object
+
+    output only needs a write() method; a hashing sink turns this into a
+    verification pass that never materializes the target. patch_path may
+    be a list of patches applied one after another, streamed through
+    memory without intermediate files; progress then follows the last one.
+    Entries that are not paths are taken as already loaded deltas or
+    decode plans.
+    """
+    patch_paths = [patch_path] if not isinstance(patch_path, (list, tuple)) else list(patch_path)
+    deltas = []
+    for path in patch_paths:
+        if isinstance(path, str):
+            with open(path, "rb") as f:
+                path = f.read()
+        deltas.append(path)
+
+    with open(source_path, "rb") as src:
+        # mmap refuses empty files; an empty source is still a valid input
+        if os.fstat(src.fileno()).st_size == 0:
+            source = chain_source(b"", deltas[:-1])
+            return decode(source, deltas[-1], output, progress_callback, digest_sink)
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            chained = chain_source(source, deltas[:-1])
+            return decode(chained, deltas[-1], output, progress_callback, digest_sink)
+
+
+def write_varint(value: int) -> bytes:
+    """Encode a VCDIFF base-128 integer"""
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def encode_header(app_header: bytes = b"") -> bytes:
+    """File header for a delta written with the default code table and no
+    secondary compression"""
+    if not app_header:
+        return VCD_MAGIC + bytes([VCD_VERSION, 0])
+    return VCD_MAGIC + bytes([VCD_VERSION, VCD_APPHEADER]) + write_varint(len(app_header)) + app_header
+
+
+class WindowEncoder:
+    """Builds one delta window from ADD/RUN/COPY instructions
+
+    Uses the default code table's single-instruction codes and picks the
+    shortest address encoding the address cache allows, mirroring the
+    decoder. COPY addresses are in the window's address space: the source
+    segment first, then the target window written so far.
+    """
+
+    def __init__(self, source_position: Optional[int] = None, source_length: int = 0):
+        self.source_position = source_position
+        self.source_length = source_length if source_position is not None else 0
+        self.target_length = 0
+        self.data = bytearray()
+        self.inst = bytearray()
+        self.addr = bytearray()
+        self._near = [0] * NEAR_CACHE_SIZE
+        self._same = [0] * (SAME_CACHE_SIZE * 256)
+        self._next_slot = 0
+
+    def add(self, data) -> None:
+        size = len(data)
+        if not size:
+            return
+        if size <= 17:
+            self.inst.append(1 + size)
+        else:
+            self.inst.append(1)
+            self.inst += write_varint(size)
+        self.data += data
+        self.target_length += size
+
+    def run(self, byte: int, size: int) -> None:
+        if not size:
+            return
+        self.inst.append(0)
+        self.inst += write_varint(size)
+        self.data.append(byte)
+        self.target_length += size
+
+    def copy(self, address: int, size: int) -> None:
+        if not size:
+            return
+        here = self.source_length + self.target_length
+        if address >= here:
+            raise VCDIFFError(f"COPY address {address} beyond current position {here}")
+        mode, encoded = self._encode_address(address, here)
+
+        base = 19 + mode * 16
+        if 4 <= size <= 18:
+            self.inst.append(base + size - 3)
+        else:
+            self.inst.append(base)
+            self.inst += write_varint(size)
+        self.addr += encoded
+        self.target_length += size
+
+    def _encode_address(self, address: int, here: int) -> Tuple[int, bytes]:
+        here_modes = 2 + NEAR_CACHE_SIZE
+        slot = address % (SAME_CACHE_SIZE * 256)
+        if self._same[slot] == address:
+            best = (here_modes + slot // 256, bytes([slot % 256]))
+        else:
+            best = (0, write_varint(address))
+            candidate = write_varint(here - address)
+            if len(candidate) < len(best[1]):
+                best = (1, candidate)
+            for i, near in enumerate(self._near):
+                if address >= near:
+                    candidate = write_varint(address - near)
+                    if len(candidate) < len(best[1]):
+                        best = (2 + i, candidate)
+
+        self._near[self._next_slot] = address
+        self._next_slot = (self._next_slot + 1) % NEAR_CACHE_SIZE
+        self._same[slot] = address
+        return best
+
+    def encode(self, checksum: Optional[int] = None) -> bytes:
+        """Serialize the window; checksum is the target's Adler32, if known"""
+        indicator = 0
+        prefix = b""
+        if self.source_position is not None:
+            indicator |= VCD_SOURCE
+            prefix = write_varint(self.source_length) + write_varint(self.source_position)
+
+        lengths = (write_varint(self.target_length) + bytes([0]) + write_varint(len(self.data))
+                   + write_varint(len(self.inst)) + write_varint(len(self.addr)))
+        if checksum is not None:
+            indicator |= VCD_ADLER32
+            lengths += checksum.to_bytes(4, "big")
+        body = lengths + self.data + self.inst + self.addr
+
+        return bytes([indicator]) + prefix + write_varint(len(body)) + body
+
+
+# Per-process state of the parallel decode workers
+_worker_source = None
+_worker_output = None
+_worker_plan = None
+
+
+def _init_worker(source_path: str, output_path: str, plan=None) -> None:
+    """Map the source read-only and the preallocated output read-write"""
+    global _worker_source, _worker_output, _worker_plan
+
+    _worker_plan = plan
+
+    with open(source_path, "rb") as src:
+        if os.fstat(src.fileno()).st_size:
+            _worker_source = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            _worker_source = b""
+
+    with open(output_path, "r+b") as out:
+        _worker_output = mmap.mmap(out.fileno(), 0, access=mmap.ACCESS_WRITE)
+
+
+def _decode_window_job(window: VCDIFFWindow, sections: Optional[Tuple[bytes, bytes, bytes]]) -> int:
+    """Decode one window straight into its slice of the output mapping
+
+    sections is None when the worker was given a decode plan.
+    """
+    end = window.target_offset + window.target_length
+    with memoryview(_worker_output)[window.target_offset:end] as out:
+        if sections is None:
+            _worker_plan.execute_window(window, _worker_source, out)
+        else:
+            execute_window(window, sections, _worker_source, out)
+        verify_window(window, out)
+    return window.index
+
+
+def decode_parallel(
+    source_path: str,
+    patch_path,
+    output_path: str,
+    workers: Optional[int] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    digest_sink=None,
+) -> int:
+    """Decode patch_path against source_path using a pool of processes
+
+    The delta is indexed and its secondary-compressed sections are unpacked
+    up front (that part is inherently sequential and cheap), then each window
+    is decoded by a worker into its own disjoint slice of a preallocated,
+    memory-mapped output file. Workers share a read-only mapping of the
+    source. workers defaults to the number of CPU cores.
+
+    digest_sink, if given, is fed the target in order: as soon as a prefix
+    of windows is complete it is hashed from this process's own mapping of
+    the output, which is still in the page cache.
+
+    patch_path may instead be a decode_plan.DecodePlan; it is handed to
+    each worker once and jobs carry only the window layout.
+    """
+    plan = None
+    if hasattr(patch_path, "execute_window"):
+        plan = patch_path
+        windows = plan.windows
+        jobs = [(window, None) for window in windows]
+    else:
+        with open(patch_path, "rb") as f:
+            delta = f.read()
+        header, windows = index_windows(delta)
+        sections = SectionDecoder(header)
+        jobs = [(window, sections.sections(delta, window)) for window in windows]
+    total = sum(w.target_length for w in windows)
+
+    with open(output_path, "wb") as out:
+        out.truncate(total)
+    if total == 0:
+        return 0
+
+    workers = min(workers or os.cpu_count() or 1, len(windows))
+    done = 0
+    finished = [False] * len(windows)
+    next_to_hash = 0
+
+    with open(output_path, "r+b") as out, \
+            mmap.mmap(out.fileno(), 0, access=mmap.ACCESS_READ) as output, \
+            ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(source_path, output_path, plan),
+            ) as pool:
+        futures = [pool.submit(_decode_window_job, window, job_sections) for window, job_sections in jobs]
+        try:
+            for future in as_completed(futures):
+                index = future.result()
+                finished[index] = True
+                done += windows[index].target_length
+
+                while digest_sink is not None and next_to_hash < len(windows) and finished[next_to_hash]:
+                    window = windows[next_to_hash]
+                    end = window.target_offset + window.target_length
+                    with memoryview(output)[window.target_offset:end] as view:
+                        digest_sink.update(view)
+                    next_to_hash += 1
+
+                if progress_callback:
+                    progress_callback(done, total)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return done